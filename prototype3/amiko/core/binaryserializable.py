@@ -0,0 +1,227 @@
+#    binaryserializable.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+from collections import deque
+import hashlib
+import struct
+
+import serializable
+
+
+
+__doc__ = """
+Compact binary serialization of serializable objects.
+
+This is an alternative for the json-based serialization in serializable.py,
+intended for network traffic between nodes that both support it.
+Every value is preceded by a one-byte type tag. Strings are stored as raw
+bytes, and objects are stored as a class ID followed by the values of their
+serializable attributes, in alphabetical order of attribute name. The class
+IDs are only meaningful to nodes with the same set of serializable classes;
+getFormatName returns a name that identifies this set, so nodes can check that
+they agree on the format before using it.
+"""
+
+tag_None    = 'N'
+tag_True    = 'T'
+tag_False   = 'F'
+tag_int     = 'i' #64-bit signed
+tag_long    = 'L' #decimal string, for integers that don't fit in 64 bits
+tag_float   = 'f'
+tag_str     = 's'
+tag_unicode = 'u'
+tag_list    = 'l'
+tag_dict    = 'd'
+tag_object  = 'o'
+
+int64 = struct.Struct('>q')
+uint32 = struct.Struct('>I')
+uint16 = struct.Struct('>H')
+float64 = struct.Struct('>d')
+
+
+
+class ClassTable:
+	def __init__(self, registeredClasses):
+		names = sorted(registeredClasses.keys())
+
+		#class -> (ID, sorted attribute names)
+		self.encodeInfo = {}
+
+		#ID -> (class, sorted attribute names)
+		self.decodeInfo = []
+
+		description = []
+		for ID, name in enumerate(names):
+			c = registeredClasses[name]
+			attributes = tuple(sorted(c.serializableAttributes.keys()))
+			self.encodeInfo[c] = (ID, attributes)
+			self.decodeInfo.append((c, attributes))
+			description.append(name + ':' + ','.join(attributes))
+
+		#binary2: the version that allows confirmations to be combined with
+		#messages (see network.py)
+		self.formatName = "binary2-" + \
+			hashlib.sha256(';'.join(description)).hexdigest()[:16]
+
+
+classTable = None
+classTableKey = None
+
+def getClassTable():
+	global classTable, classTableKey
+	key = (id(serializable.registeredClasses), len(serializable.registeredClasses))
+	if key != classTableKey:
+		classTable = ClassTable(serializable.registeredClasses)
+		classTableKey = key
+	return classTable
+
+
+def getFormatName():
+	"""
+	Return value:
+	str, identifying the binary format, including the set of classes
+	that can be serialized.
+	"""
+	return getClassTable().formatName
+
+
+
+def encodeValue(obj, out, encodeInfo):
+	t = type(obj)
+	if obj is None:
+		out.append(tag_None)
+	elif t == bool:
+		out.append(tag_True if obj else tag_False)
+	elif t == int or t == long:
+		if -0x8000000000000000 <= obj <= 0x7fffffffffffffff:
+			out.append(tag_int + int64.pack(obj))
+		else:
+			s = str(obj)
+			out.append(tag_long + uint32.pack(len(s)) + s)
+	elif t == float:
+		out.append(tag_float + float64.pack(obj))
+	elif t == str:
+		out.append(tag_str + uint32.pack(len(obj)))
+		out.append(obj)
+	elif t == unicode:
+		s = obj.encode('utf-8')
+		out.append(tag_unicode + uint32.pack(len(s)))
+		out.append(s)
+	elif t == list or t == tuple or t == deque:
+		out.append(tag_list + uint32.pack(len(obj)))
+		for x in obj:
+			encodeValue(x, out, encodeInfo)
+	elif t == dict:
+		out.append(tag_dict + uint32.pack(len(obj)))
+		for k, v in obj.iteritems():
+			encodeValue(k, out, encodeInfo)
+			encodeValue(v, out, encodeInfo)
+	elif isinstance(obj, serializable.Serializable):
+		ID, attributes = encodeInfo[obj.__class__]
+		out.append(tag_object + uint16.pack(ID))
+		for name in attributes:
+			encodeValue(getattr(obj, name), out, encodeInfo)
+	else:
+		raise Exception("Type can not be serialized: " + str(t))
+
+
+def serialize(obj):
+	out = []
+	encodeValue(obj, out, getClassTable().encodeInfo)
+	return ''.join(out)
+
+
+
+def decodeValue(data, pos, decodeInfo):
+	"""
+	Return value:
+	tuple (value, position after value)
+	"""
+	tag = data[pos]
+	pos += 1
+
+	if tag == tag_str:
+		length, = uint32.unpack_from(data, pos)
+		pos += 4
+		value = data[pos:pos+length]
+		if len(value) != length:
+			raise Exception("Formatting error: incomplete string")
+		return value, pos+length
+	elif tag == tag_int:
+		return int64.unpack_from(data, pos)[0], pos+8
+	elif tag == tag_object:
+		ID, = uint16.unpack_from(data, pos)
+		pos += 2
+		c, attributes = decodeInfo[ID]
+		kwargs = {}
+		for name in attributes:
+			kwargs[name], pos = decodeValue(data, pos, decodeInfo)
+		return c(**kwargs), pos
+	elif tag == tag_None:
+		return None, pos
+	elif tag == tag_True:
+		return True, pos
+	elif tag == tag_False:
+		return False, pos
+	elif tag == tag_list:
+		length, = uint32.unpack_from(data, pos)
+		pos += 4
+		value = []
+		for i in xrange(length):
+			x, pos = decodeValue(data, pos, decodeInfo)
+			value.append(x)
+		return value, pos
+	elif tag == tag_dict:
+		length, = uint32.unpack_from(data, pos)
+		pos += 4
+		value = {}
+		for i in xrange(length):
+			k, pos = decodeValue(data, pos, decodeInfo)
+			value[k], pos = decodeValue(data, pos, decodeInfo)
+		return value, pos
+	elif tag == tag_float:
+		return float64.unpack_from(data, pos)[0], pos+8
+	elif tag == tag_unicode:
+		length, = uint32.unpack_from(data, pos)
+		pos += 4
+		return data[pos:pos+length].decode('utf-8'), pos+length
+	elif tag == tag_long:
+		length, = uint32.unpack_from(data, pos)
+		pos += 4
+		return long(data[pos:pos+length]), pos+length
+
+	raise Exception("Formatting error: unknown type tag %s" % repr(tag))
+
+
+def deserialize(data):
+	value, pos = decodeValue(data, 0, getClassTable().decodeInfo)
+	if pos != len(data):
+		raise Exception("Formatting error: unexpected data after the end")
+	return value
+
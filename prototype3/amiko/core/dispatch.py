@@ -0,0 +1,86 @@
+#    dispatch.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+
+
+__doc__ = """
+Class-level message dispatch tables.
+
+Methods that handle messages are marked with the handles decorator; after
+the class definition, registerHandlers builds the dispatch table of the
+class. The handleMessage method of the class can then look up its handler
+with a single dictionary access, without making bound methods:
+
+	class C(...):
+		def handleMessage(self, msg):
+			return self.messageHandlers[msg.__class__](self, msg)
+
+		@dispatch.handles(messages.A, messages.B)
+		def msg_AorB(self, msg):
+			...
+
+	dispatch.registerHandlers(C)
+"""
+
+
+
+def handles(*messageClasses):
+	"""
+	Method decorator, which marks a method as the handler of messages of the
+	given classes.
+	"""
+
+	def decorator(method):
+		method.handledMessageClasses = messageClasses
+		return method
+
+	return decorator
+
+
+def registerHandlers(c):
+	"""
+	Makes the dispatch table c.messageHandlers (message class -> function) of
+	class c, out of the methods of c and its base classes that are marked
+	with the handles decorator. Methods of c override methods of its base
+	classes for the same message class.
+	"""
+
+	handlers = dict(getattr(c, 'messageHandlers', {}))
+
+	ownHandlers = {}
+	for function in c.__dict__.itervalues():
+		for messageClass in getattr(function, 'handledMessageClasses', ()):
+			if messageClass in ownHandlers:
+				raise Exception(
+					"Class %s has multiple handlers for message class %s" % \
+					(c.__name__, messageClass.__name__))
+			ownHandlers[messageClass] = function
+
+	handlers.update(ownHandlers)
+	c.messageHandlers = handlers
+
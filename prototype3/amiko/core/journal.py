@@ -0,0 +1,306 @@
+#    journal.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import os
+import time
+
+import log
+import serializable
+
+
+
+__doc__ = """
+Persistent storage of a state tree, as a snapshot file plus an append-only
+journal of changes made since that snapshot.
+
+Each line in the journal contains one commit: a sequence number and a list
+of changes. A change is a path into the state tree, optionally followed by a
+new value for that position; a change without value removes the position.
+A change can also be a list operation: the name of the operation, followed by
+the path of the list and the argument of the operation (see listOperations).
+The snapshot contains the sequence number of the last commit included in it,
+so journal entries that are already part of the snapshot are skipped when
+replaying.
+"""
+
+
+
+class Journal:
+	def __init__(self, filename, syncInterval=0.0):
+		"""
+		Constructor.
+
+		Arguments:
+		filename:     name of the snapshot file. The journal is stored next
+		              to it, with the extension ".journal" appended.
+		syncInterval: maximum time (float, in seconds) between writing a
+		              commit to the journal and flushing it to disk with
+		              fsync. Commits within this interval share a single fsync.
+		"""
+
+		self.filename = filename
+		self.journalFilename = filename + ".journal"
+		self.syncInterval = syncInterval
+
+		self.sequence = 0
+		self.numRecords = 0 #number of commits since last snapshot
+
+		self.__file = None
+		self.__unsyncedSince = None
+
+
+	def load(self):
+		"""
+		Return value:
+		The state, as found in the snapshot with all newer journal entries
+		applied to it.
+
+		Exceptions:
+		IOError: there is no snapshot file
+		"""
+
+		self.close()
+
+		oldFile = self.filename + ".old"
+		if os.access(oldFile, os.F_OK):
+			if os.access(self.filename, os.F_OK):
+				#Remove old file if normal state file exists:
+				os.remove(oldFile)
+			else:
+				#Use old file if state file does not exist:
+				os.rename(oldFile, self.filename)
+
+		with open(self.filename, 'rb') as fp:
+			state = serializable.deserializeState(fp.read())
+
+		#Files made without journal don't have a sequence number:
+		self.sequence = state.pop("JournalSequence", 0)
+		self.numRecords = 0
+
+		validLength = 0
+		try:
+			with open(self.journalFilename, 'rb') as fp:
+				for line in fp:
+					try:
+						if not line.endswith('\n'):
+							raise ValueError("Incomplete journal line")
+						commit = serializable.deserializeState(line)
+					except ValueError:
+						#Interrupted write at the end of the journal:
+						#this commit never finished, so ignore it.
+						log.log("Ignoring incomplete journal data in %s" % \
+							self.journalFilename)
+						break
+
+					validLength += len(line)
+					if commit["seq"] <= self.sequence:
+						continue #already included in the snapshot
+
+					for change in commit["changes"]:
+						applyChange(state, *change)
+					self.sequence = commit["seq"]
+					self.numRecords += 1
+		except IOError:
+			pass #No journal: the snapshot is complete
+
+		#Remove incomplete data, so new commits are appended to valid ones:
+		if os.access(self.journalFilename, os.F_OK):
+			with open(self.journalFilename, 'r+b') as fp:
+				fp.truncate(validLength)
+
+		return state
+
+
+	def append(self, changes):
+		"""
+		Appends a single commit to the journal.
+
+		Arguments:
+		changes: list of changes; each change is a tuple (path, value)
+		         for setting a value, (path,) for removing a value, or
+		         (operation, path, argument) for a list operation
+		"""
+
+		if len(changes) == 0:
+			return
+
+		self.sequence += 1
+		line = serializable.serializeState(
+			{"seq": self.sequence, "changes": [list(c) for c in changes]})
+
+		if self.__file is None:
+			self.__file = open(self.journalFilename, 'ab')
+		self.__file.write(line + '\n')
+		self.__file.flush()
+
+		self.numRecords += 1
+		if self.__unsyncedSince is None:
+			self.__unsyncedSince = time.time()
+		self.sync(force=False)
+
+
+	def sync(self, force=True):
+		"""
+		Flushes journal data to disk.
+
+		Arguments:
+		force: if False, only flush when the oldest not-yet-flushed commit is
+		       older than the sync interval.
+		"""
+
+		if self.__unsyncedSince is None:
+			return
+		if not force and time.time() < self.getSyncDeadline():
+			return
+
+		os.fsync(self.__file.fileno())
+		self.__unsyncedSince = None
+
+
+	def getSyncDeadline(self):
+		"""
+		Return value:
+		The time (float, as in time.time()) at which the not-yet-flushed data
+		needs to be flushed, or None if there is no such data.
+		"""
+
+		if self.__unsyncedSince is None:
+			return None
+		return self.__unsyncedSince + self.syncInterval
+
+
+	def writeSnapshot(self, state):
+		"""
+		Replaces the snapshot file with the given state, and empties the
+		journal.
+		"""
+
+		state = state.copy()
+		state["JournalSequence"] = self.sequence
+		stateData = serializable.serializeState(state)
+
+		newFile = self.filename + ".new"
+		log.log("Saving in " + newFile)
+		with open(newFile, 'wb') as fp:
+			fp.write(stateData)
+			fp.flush()
+			os.fsync(fp.fileno())
+
+		oldFile = self.filename + ".old"
+
+		#Replace old data with new data
+		try:
+			os.rename(self.filename, oldFile)
+		except OSError:
+			log.log("Got OSError on renaming old state file; probably it didn't exist yet, which is OK in a fresh installation.")
+		os.rename(newFile, self.filename)
+		try:
+			os.remove(oldFile)
+		except OSError:
+			log.log("Got OSError on removing old state file; probably it didn't exist, which is OK in a fresh installation.")
+
+		#The journal contents are now included in the snapshot.
+		#If we crash before this point, the sequence numbers make sure the
+		#journal entries are ignored on the next load.
+		self.close()
+		with open(self.journalFilename, 'wb') as fp:
+			pass
+		self.numRecords = 0
+
+
+	def close(self):
+		if self.__file is None:
+			return
+		self.sync()
+		self.__file.close()
+		self.__file = None
+
+
+
+def appendItem(lst, value):
+	lst.append(value)
+
+
+def popItems(lst, count):
+	del lst[:count]
+
+
+#Operation name -> function(list, argument):
+listOperations = \
+{
+'append' : appendItem, #adds the argument at the end of the list
+'popleft': popItems    #removes the given number of items from the start
+}
+
+
+def applyChange(state, path, *value):
+	"""
+	Applies a single journal change to a state tree.
+
+	Arguments:
+	state: the state tree (modified in-place)
+	path:  list of dictionary keys, leading to the position to be changed.
+	       For list operations, this is the name of the operation instead.
+	value: optional; the new value. If omitted, the position is removed.
+	       For list operations, this is the path of the list, followed by
+	       the argument of the operation.
+	"""
+
+	if type(path) == str:
+		operation = listOperations[path]
+		path, argument = value
+		container = state
+		for key in path:
+			container = container[key]
+		operation(container, argument)
+		return
+
+	container = state
+	for key in path[:-1]:
+		container = container[key]
+
+	if len(value) == 0:
+		#Tolerate removal of values that were created and removed again
+		#within the same commit:
+		container.pop(path[-1], None)
+	else:
+		container[path[-1]] = value[0]
+
+
+
+def prefixChange(prefix, change):
+	"""
+	Return value:
+	The change, with prefix (a list of dictionary keys) inserted at the start
+	of its path. This converts a change of a sub-tree into a change of the
+	tree that contains it.
+	"""
+
+	if type(change[0]) == str:
+		return (change[0], prefix + change[1]) + tuple(change[2:])
+	return (prefix + change[0],) + tuple(change[1:])
@@ -29,6 +29,7 @@
 import messages
 
 import serializable
+import dispatch
 
 
 
@@ -37,14 +38,10 @@ class Link(serializable.Serializable):
 
 
 	def handleMessage(self, msg):
-		return \
-		{
-		messages.Link_Deposit: self.msg_ownDeposit,
-		messages.Deposit: self.msg_peerDeposit,
-		messages.ChannelMessage: self.continueChannelConversation
-		}[msg.__class__](msg)
+		return self.messageHandlers[msg.__class__](self, msg)
 
 
+	@dispatch.handles(messages.Link_Deposit)
 	def msg_ownDeposit(self, msg):
 		if self.remoteID is None:
 			raise Exception('Can not deposit into a link whose remote ID is unknown')
@@ -66,6 +63,7 @@ class Link(serializable.Serializable):
 			self.startChannelConversation(msg.ID, channelIndex)
 
 
+	@dispatch.handles(messages.Deposit)
 	def msg_peerDeposit(self, msg):
 		if msg.channelIndex != len(self.channels):
 			raise Exception('Received Deposit message with incorrect channel index.')
@@ -90,6 +88,7 @@ class Link(serializable.Serializable):
 		return self.continueChannelConversation(inputMessage)
 
 
+	@dispatch.handles(messages.ChannelMessage)
 	def continueChannelConversation(self, msg):
 		outputMessage = self.channels[msg.channelIndex].handleMessage(msg.message)
 
@@ -107,4 +106,5 @@ class Link(serializable.Serializable):
 
 
 serializable.registerClass(Link)
+dispatch.registerHandlers(Link)
 
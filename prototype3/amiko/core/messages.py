@@ -30,9 +30,10 @@ import serializable
 
 
 
-#Note: local link IDs and payee IDs should never be made equal to this!
+#Prefix of the IDs of payer links.
+#Note: local link IDs and payee IDs should never start with this!
 #TODO: enforce the above rule
-payerLocalID = "__payer__"
+payerIDPrefix = "__payer__"
 
 
 
@@ -45,7 +46,7 @@ class Connect(serializable.Serializable):
 
 
 class Pay(Connect):
-	pass
+	serializableAttributes = {'ID': '', 'dice': 0, 'callbackID': None}
 serializable.registerClass(Pay)
 
 
@@ -71,7 +72,7 @@ serializable.registerClass(OutboundMessage)
 
 
 class Timeout(serializable.Serializable):
-	serializableAttributes = {'state':''}
+	serializableAttributes = {'ID': '', 'state':''}
 serializable.registerClass(Timeout)
 
 
@@ -81,7 +82,7 @@ serializable.registerClass(ChannelMessage)
 
 
 class Receipt(serializable.Serializable):
-	serializableAttributes = {'amount':0, 'receipt':'', 'transactionID':'', 'meetingPoints':[]}
+	serializableAttributes = {'ID': '', 'amount':0, 'receipt':'', 'transactionID':'', 'meetingPoints':[]}
 serializable.registerClass(Receipt)
 
 
@@ -101,7 +102,7 @@ serializable.registerClass(PaymentRequest)
 
 
 class PayerLink_Confirm(serializable.Serializable):
-	serializableAttributes = {'agreement':False}
+	serializableAttributes = {'ID': '', 'agreement':False}
 serializable.registerClass(PayerLink_Confirm)
 
 
@@ -126,6 +127,15 @@ class Link_Deposit(serializable.Serializable):
 serializable.registerClass(Link_Deposit)
 
 
+class Link_Call(serializable.Serializable):
+	"""
+	Calls a method of a link that is kept in another shard:
+	link.<method>(message, *arguments)
+	"""
+	serializableAttributes = {'ID': '', 'method': '', 'message': None, 'arguments': []}
+serializable.registerClass(Link_Call)
+
+
 class ReturnValue(serializable.Serializable):
 	serializableAttributes = {'value':''}
 serializable.registerClass(ReturnValue)
@@ -176,6 +186,12 @@ serializable.registerClass(SettleCommit)
 
 
 class TimeoutMessage(serializable.Serializable):
-	serializableAttributes = {'timestamp': 0.0, 'message': None}
+	#ID: optional; can be used to cancel the message with CancelTimeoutMessages
+	serializableAttributes = {'timestamp': 0.0, 'message': None, 'ID': None}
 serializable.registerClass(TimeoutMessage)
 
+
+class CancelTimeoutMessages(serializable.Serializable):
+	serializableAttributes = {'ID': None}
+serializable.registerClass(CancelTimeoutMessages)
+
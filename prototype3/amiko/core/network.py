@@ -27,9 +27,17 @@
 #    OpenSSL library used as well as that of the covered work.
 
 import asyncore
+import errno
+import fcntl
+import math
+import os
+import select
 import socket
+import struct
+import time
 
 import serializable
+import binaryserializable
 import messages
 import log
 import randomsource
@@ -40,44 +48,155 @@ class ConnectFailed(Exception):
 	pass
 
 
+
+#Wire formats:
+#json:   newline-terminated json data
+#binary: binaryFrameStart, followed by the data size (32-bit, big endian)
+#        and data in the format of binaryserializable.
+#The format used for sending is negotiated per connection; the receiving side
+#recognizes the format of each message by its first byte.
+#It is assumed that the json data never starts with binaryFrameStart.
+binaryFrameStart = '\x00'
+binaryFrameHeader = struct.Struct('>cI')
+
+
 class Connection(asyncore.dispatcher_with_send):
 	def __init__(self, sock, network):
 		asyncore.dispatcher_with_send.__init__(self, sock, map=network.channelMap)
-		self.readBuffer = ''
+		self.readBuffer = bytearray()
+		self.hasBacklog = False
 		self.network = network
 		self.localID = None
 		self.dice = None
 		self.isClosed = False
 
+		#Confirmation that is not yet sent:
+		self.pendingAck = None        #index of the last received message
+		self.numPendingAcks = 0       #number of messages not yet confirmed
+		self.pendingAckDeadline = None
+
+		#Whether the binary format is used for sending:
+		self.sendBinary = False
+
+
+	def readable(self):
+		#Backpressure: don't read more data while we are still processing
+		#earlier received messages.
+		return not self.hasBacklog
+
 
 	def handle_read(self):
-		data = self.recv(8192)
+		data = self.recv(self.network.readChunkSize)
 		if data:
-			self.readBuffer += data
-
-			#TODO restrict the size of the buffer, to prevent memory issues
+			self.readBuffer.extend(data)
+			self.processReadBuffer()
+
+
+	def processReadBuffer(self):
+		"""
+		Processes the complete messages in the read buffer.
+		At most network.maxMessagesPerRead messages are processed; if more
+		messages are available, hasBacklog is set, and reading new data is
+		paused until the remaining messages are processed.
+		"""
+
+		buf = self.readBuffer
+		maxMessageSize = self.network.maxMessageSize
+		pos = 0 #start of the first not-yet-processed message
+		numProcessed = 0
+		self.hasBacklog = False
+
+		while pos < len(buf):
+			if numProcessed >= self.network.maxMessagesPerRead:
+				self.hasBacklog = True
+				break
 
-			while True:
-				newlinePos = self.readBuffer.find('\n')
+			if buf[pos] == ord(binaryFrameStart):
+				if len(buf) - pos < binaryFrameHeader.size:
+					break #incomplete header
+				start, size = binaryFrameHeader.unpack_from(buf, pos)
+				if size > maxMessageSize:
+					self.protocolError("Message size %d exceeds maximum" % size)
+					return
+				dataStart = pos + binaryFrameHeader.size
+				dataEnd = dataStart + size
+				if len(buf) < dataEnd:
+					break #incomplete message
+				msgData = str(buf[dataStart:dataEnd])
+				pos = dataEnd
+				self.processReceivedBinaryData(msgData)
+			else:
+				newlinePos = buf.find('\n', pos)
+				size = (len(buf) if newlinePos < 0 else newlinePos) - pos
+				if size > maxMessageSize:
+					self.protocolError("Message size exceeds maximum")
+					return
 				if newlinePos < 0:
 					break #no more messages in the buffer
-				msgData = self.readBuffer[:newlinePos]
-				self.readBuffer = self.readBuffer[newlinePos+1:]
+				msgData = str(buf[pos:newlinePos])
+				pos = newlinePos + 1
 				self.processReceivedMessageData(msgData)
 
+			numProcessed += 1
+
+			if self.isClosed:
+				return
+
+		#Remove processed data (only once, to avoid repeated copying):
+		del buf[:pos]
+
+		if self.hasBacklog:
+			self.network.backloggedConnections.add(self)
+		else:
+			self.network.backloggedConnections.discard(self)
+		self.network.poller.markChanged(self) #readable() may have changed
+
+
+	def protocolError(self, reason):
+		log.log("Protocol error on connection %s: %s; closing connection" % \
+			(self.localID, reason))
+		self.readBuffer = bytearray()
+		self.hasBacklog = False
+		self.network.removeConnection(self)
+		self.close()
+		self.isClosed = True
+
 
 	def processReceivedMessageData(self, msgData):
 		log.log("Received data: %s\n" % msgData)
 
 		try:
 			container = serializable.deserialize(msgData)
-			if 'received' in container.keys():
+		except Exception as e:
+			log.logException()
+			return
+
+		self.processReceivedContainer(container)
+
+
+	def processReceivedBinaryData(self, msgData):
+		log.log("Received binary data: %s\n" % msgData.encode('hex'))
+
+		try:
+			container = binaryserializable.deserialize(msgData)
+		except Exception as e:
+			log.logException()
+			return
+
+		self.processReceivedContainer(container)
+
+
+	def processReceivedContainer(self, container):
+		try:
+			if 'received' in container:
 				#Process received confirmation:
 				index = container['received']
 				self.network.callback.handleMessage(
 					messages.Confirmation(localID=self.localID, index=index)
 					)
-			elif 'message' in container.keys():
+
+			#A message can be combined with a confirmation:
+			if 'message' in container:
 				index = container['index']
 				msg = container['message']
 				#print "Got message: ", str(msg.__class__)
@@ -87,29 +206,116 @@ class Connection(asyncore.dispatcher_with_send):
 						raise Exception("Received connect message while already connected")
 					self.localID = msg.ID
 					self.dice = msg.dice
-					self.network.checkForDuplicateConnections(self.localID)
+					self.selectFormat(container.get('formats', []))
+					self.network.setInterface(self)
 				else:
-					#Send confirmation on non-connect messages:
-					confirmation = {'received': index}
-					self.send(serializable.serialize(confirmation) + '\n')
+					#Confirm non-connect messages:
+					self.addPendingAck(index)
 
 				#TODO: filter for acceptable message types, IDs etc. before
 				#sending them to a general-purpose message handler
 				self.network.callback.handleMessage(msg)
-			else:
+			elif 'format' in container:
+				#The peer accepted the binary format we offered:
+				if self.network.binaryFormat and \
+					container['format'] == binaryserializable.getFormatName():
+						log.log("Switching to binary format")
+						self.sendBinary = True
+			elif 'received' not in container:
 				log.log("Received message with invalid format")
 		except Exception as e:
 			log.logException()
 			#TODO: send error back to remote host?
 
 
-	def sendMessage(self, index, msg):
+	def addPendingAck(self, index):
+		"""
+		Schedules the confirmation of a received message.
+		Confirmations are cumulative, so only the last one needs to be sent.
+		It is sent once network.ackCount messages are waiting for
+		confirmation, or network.ackDelay seconds after the first of them was
+		received, or together with an outgoing message, whichever comes first.
+		"""
+
+		self.pendingAck = index
+		self.numPendingAcks += 1
+
+		if self.numPendingAcks >= self.network.ackCount:
+			self.sendPendingAck()
+		elif self.pendingAckDeadline is None:
+			self.pendingAckDeadline = time.time() + self.network.ackDelay
+			self.network.pendingAckConnections.add(self)
+
+
+	def sendPendingAck(self):
+		if self.pendingAck is None:
+			return
+		self.sendContainer({'received': self.pendingAck})
+
+
+	def selectFormat(self, formats):
+		"""
+		Selects the format to be used for sending, out of the formats offered
+		by the peer, and informs the peer about the selection.
+		"""
+
+		if not self.network.binaryFormat:
+			return
+		formatName = binaryserializable.getFormatName()
+		if formatName not in formats:
+			return
+
+		#The acceptance is the last message we send in json format:
+		self.sendContainer({'format': formatName})
+		self.sendBinary = True
+
+
+	def sendMessage(self, index, msg, offerFormats=False):
 		log.log("Sending message %s" % str(msg.__class__))
 		container = {'index': index, 'message': msg}
-		self.send(serializable.serialize(container) + '\n')
+		if offerFormats and self.network.binaryFormat:
+			container['formats'] = [binaryserializable.getFormatName()]
+		if self.sendBinary and self.pendingAck is not None:
+			#Peers that use the binary format support combined containers:
+			container['received'] = self.pendingAck
+		self.sendContainer(container)
+
+
+	def sendContainer(self, container):
+		if 'received' in container:
+			#The pending confirmation is included:
+			self.pendingAck = None
+			self.numPendingAcks = 0
+			self.pendingAckDeadline = None
+			self.network.pendingAckConnections.discard(self)
+
+		if self.sendBinary:
+			data = binaryserializable.serialize(container)
+			self.send(binaryFrameHeader.pack(binaryFrameStart, len(data)) + data)
+		else:
+			self.send(serializable.serialize(container) + '\n')
+
+
+	def send(self, data):
+		asyncore.dispatcher_with_send.send(self, data)
+		self.network.poller.markChanged(self) #writable() may have changed
+
+
+	def handle_write(self):
+		maxSendBuffer = self.network.maxSendBuffer
+		wasFull = len(self.out_buffer) >= maxSendBuffer
+		asyncore.dispatcher_with_send.handle_write(self)
+		self.network.poller.markChanged(self) #writable() may have changed
+		if wasFull and len(self.out_buffer) < maxSendBuffer and \
+			not (self.localID is None):
+				#New messages can be sent again:
+				self.network.changedInterfaces.add(self.localID)
 
 
 	def handle_close(self):
+		log.log('Connection %s was closed remotely' % self.localID)
+		self.network.removeConnection(self)
+		self.close()
 		self.isClosed = True
 
 
@@ -135,16 +341,323 @@ class Listener(asyncore.dispatcher):
 
 
 
+class Waker(asyncore.file_dispatcher):
+	"""
+	The read side of a pipe, which is watched together with the sockets.
+	Writing to the pipe (with wakeUp) makes a waiting processNetworkEvents
+	call return; this can be done from any thread.
+	"""
+
+	def __init__(self, network):
+		readFD, self.writeFD = os.pipe()
+		asyncore.file_dispatcher.__init__(self, readFD, map=network.channelMap)
+		os.close(readFD) #file_dispatcher made its own copy
+
+		fcntl.fcntl(self.writeFD, fcntl.F_SETFL,
+			fcntl.fcntl(self.writeFD, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+	def wakeUp(self):
+		try:
+			os.write(self.writeFD, 'x')
+		except OSError as e:
+			#A full pipe will already wake up the reader:
+			if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+				raise
+
+
+	def writable(self):
+		return False
+
+
+	def handle_read(self):
+		self.recv(4096) #discard the data: it only serves to wake up
+
+
+	def close(self):
+		asyncore.file_dispatcher.close(self)
+		os.close(self.writeFD)
+
+
+
+class ChannelMap(dict):
+	"""
+	A dictionary of file descriptor -> dispatcher, as used by asyncore, which
+	keeps track of the file descriptors that were added or removed.
+	"""
+
+	def __init__(self):
+		dict.__init__(self)
+		self.changedFileDescriptors = set()
+
+
+	def __setitem__(self, fd, obj):
+		dict.__setitem__(self, fd, obj)
+		self.changedFileDescriptors.add(fd)
+
+
+	def __delitem__(self, fd):
+		dict.__delitem__(self, fd)
+		self.changedFileDescriptors.add(fd)
+
+
+	def popChangedFileDescriptors(self):
+		ret = self.changedFileDescriptors
+		self.changedFileDescriptors = set()
+		return ret
+
+
+
+class Poller:
+	"""
+	Waits for events on the dispatchers in a channel map, using epoll (or
+	poll, where epoll is not available).
+
+	Unlike the select-based asyncore.loop, this has no limit on file
+	descriptor numbers, and the kernel keeps the set of watched file
+	descriptors between calls, so only changes need to be passed.
+	The event mask of a dispatcher is only re-calculated when it is added,
+	or after markChanged was called for it.
+	"""
+
+	def __init__(self):
+		if hasattr(select, 'epoll'):
+			self.__poll = select.epoll()
+			self.__timeoutScale = 0.001 #epoll takes seconds
+			self.__infiniteTimeout = -1
+		else:
+			self.__poll = select.poll()
+			self.__timeoutScale = 1 #poll takes milliseconds
+			self.__infiniteTimeout = None
+
+		#fd -> (dispatcher, event mask):
+		self.__registered = {}
+
+		#Dispatchers whose event mask may have changed:
+		self.__changed = set()
+
+
+	def markChanged(self, obj):
+		"""
+		Indicates that the readable() or writable() result of a dispatcher
+		may have changed, so its event mask needs to be re-calculated.
+		"""
+		self.__changed.add(obj)
+
+
+	def poll(self, channelMap, timeout):
+		"""
+		Waits for events.
+
+		Arguments:
+		channelMap: ChannelMap of the dispatchers to be watched
+		timeout:    maximum waiting time (float, in seconds), or None to wait
+		            until an event occurs
+
+		Return value:
+		list of (fd, event flags) tuples, with flags as used by
+		asyncore.readwrite.
+		"""
+
+		#Forget closed dispatchers, and check new ones:
+		for fd in channelMap.popChangedFileDescriptors():
+			obj = channelMap.get(fd)
+			old = self.__registered.get(fd)
+			if old is not None and old[0] is not obj:
+				self.__unregister(fd)
+			if obj is not None:
+				self.__changed.add(obj)
+
+		#Update changed masks:
+		changed = self.__changed
+		self.__changed = set()
+		for obj in changed:
+			fd = obj._fileno
+			if fd is None or channelMap.get(fd) is not obj:
+				continue #closed
+
+			mask = 0
+			if obj.readable():
+				mask |= select.POLLIN | select.POLLPRI
+			if obj.writable() and not obj.accepting:
+				mask |= select.POLLOUT
+			if mask != 0:
+				mask |= select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+			old = self.__registered.get(fd)
+			oldMask = 0 if old is None else old[1]
+			if mask == oldMask:
+				continue
+
+			if mask == 0:
+				#Same as asyncore: no interest means no error reporting either
+				self.__unregister(fd)
+			elif old is None:
+				self.__poll.register(fd, mask)
+				self.__registered[fd] = (obj, mask)
+			else:
+				self.__poll.modify(fd, mask)
+				self.__registered[fd] = (obj, mask)
+
+		if timeout is None:
+			timeout = self.__infiniteTimeout
+		else:
+			#Round up to whole milliseconds, so we don't wake up too early:
+			timeout = math.ceil(1000.0 * timeout) * self.__timeoutScale
+
+		try:
+			return self.__poll.poll(timeout)
+		except (IOError, select.error) as e:
+			if e.args[0] == errno.EINTR:
+				return []
+			raise
+
+
+	def close(self):
+		if hasattr(self.__poll, 'close'):
+			self.__poll.close()
+		self.__registered = {}
+		self.__changed = set()
+
+
+	def __unregister(self, fd):
+		del self.__registered[fd]
+		try:
+			self.__poll.unregister(fd)
+		except (IOError, OSError, KeyError):
+			pass #was already removed when its file descriptor was closed
+
+
+
 class Network:
-	def __init__(self, host, port, callback):
-		self.channelMap = {}
+	#Maximum amount of data received in one read operation:
+	readChunkSize = 65536
+
+	#Maximum number of received messages processed per connection,
+	#per call of processNetworkEvents:
+	maxMessagesPerRead = 100
+
+
+	def __init__(self, host, port, callback, binaryFormat=True,
+		maxMessageSize=1048576, ackCount=1, ackDelay=0.0,
+		maxSendBuffer=262144):
+		"""
+		Constructor.
+
+		Arguments:
+		host:           host name to listen on
+		port:           port number to listen on
+		callback:       object whose handleMessage method receives the messages
+		binaryFormat:   whether to use the binary format, on connections where
+		                the peer supports it
+		maxMessageSize: maximum size (in bytes) of a received message.
+		                Connections on which larger messages are received are
+		                closed.
+		ackCount:       maximum number of received messages that are not yet
+		                confirmed
+		ackDelay:       maximum time (float, in seconds) a received message
+		                stays unconfirmed
+		maxSendBuffer:  amount of data (in bytes) waiting to be sent, above
+		                which no new messages should be sent on a connection
+		"""
+		self.channelMap = ChannelMap()
+		self.poller = Poller()
 		self.listener = Listener(host, port, self)
 		self.callback = callback
-		self.connections = []
+		self.binaryFormat = binaryFormat
+		self.maxMessageSize = maxMessageSize
+		self.ackCount = ackCount
+		self.ackDelay = ackDelay
+		self.maxSendBuffer = maxSendBuffer
+
+		#All open connections:
+		self.connections = set()
+
+		#localID -> connection, for connections whose localID is known:
+		self.interfaces = {}
+
+		#Connections with received messages that are not processed yet:
+		self.backloggedConnections = set()
 
+		#Connections with received messages that are not confirmed yet:
+		self.pendingAckConnections = set()
 
-	def processNetworkEvents(self, timeout):
-		asyncore.loop(timeout=timeout, count=1, map=self.channelMap)
+		#Local IDs of interfaces that were added or removed, or whose send
+		#buffer is no longer full, since the last call of
+		#popChangedInterfaces:
+		self.changedInterfaces = set()
+
+		self.waker = Waker(self)
+
+
+	def processNetworkEvents(self, timeout=None):
+		"""
+		Waits for network events, and handles them.
+
+		Arguments:
+		timeout: maximum waiting time (float, in seconds), or None to wait
+		         until a network event occurs or wakeUp is called
+		"""
+
+		if len(self.backloggedConnections) > 0:
+			timeout = 0.0 #there is work to do: don't wait
+
+		for fd, flags in self.poller.poll(self.channelMap, timeout):
+			obj = self.channelMap.get(fd)
+			if obj is not None: #could have been closed in this loop
+				asyncore.readwrite(obj, flags)
+
+		#Continue processing messages that were received earlier:
+		for c in list(self.backloggedConnections):
+			if c.hasBacklog:
+				c.processReadBuffer()
+
+		#Send delayed confirmations:
+		if len(self.pendingAckConnections) > 0:
+			now = time.time()
+			for c in list(self.pendingAckConnections):
+				if c.pendingAckDeadline <= now:
+					c.sendPendingAck()
+
+
+	def getNextDeadline(self):
+		"""
+		Return value:
+		The time (float, as in time.time()) at which processNetworkEvents
+		needs to be called for sending delayed confirmations, or None if
+		there are none.
+		"""
+
+		if len(self.pendingAckConnections) == 0:
+			return None
+		return min(c.pendingAckDeadline for c in self.pendingAckConnections)
+
+
+	def close(self):
+		"""
+		Closes the listener, all connections and all other resources.
+		"""
+
+		for c in self.connections:
+			c.close()
+		self.connections = set()
+		self.interfaces = {}
+		self.backloggedConnections = set()
+		self.pendingAckConnections = set()
+		self.changedInterfaces = set()
+		self.listener.close()
+		self.waker.close()
+		self.poller.close()
+
+
+	def wakeUp(self):
+		"""
+		Makes a waiting (or the next) processNetworkEvents call return as soon
+		as possible.
+		May be called from any thread.
+		"""
+
+		self.waker.wakeUp()
 
 
 	def sendOutboundMessage(self, index, msg):
@@ -152,19 +665,36 @@ class Network:
 
 
 	def interfaceExists(self, localID):
-		return not (self.getInterface(localID) is None)
+		return localID in self.interfaces
+
+
+	def isSendBufferFull(self, localID):
+		"""
+		Return value:
+		bool, indicating whether the data waiting to be sent on the connection
+		with the given localID has reached maxSendBuffer.
+		"""
+
+		return len(self.interfaces[localID].out_buffer) >= self.maxSendBuffer
 
 
 	def getInterface(self, localID):
-		for i in range(len(self.connections)):
-			if self.connections[i].localID == localID:
-				if self.connections[i].isClosed:
-					log.log('Connection %s was closed remotely' % localID)
-					del self.connections[i] #old reference -> remove it
-					return None
-				return self.connections[i]
+		return self.interfaces.get(localID)
+
 
-		return None
+	def popChangedInterfaces(self):
+		"""
+		Return value:
+		set of the local IDs of interfaces that were added or removed, or
+		whose send buffer is no longer full, since the previous call of this
+		method.
+		Only for these interfaces, the possibility to send messages has
+		changed.
+		"""
+
+		ret = self.changedInterfaces
+		self.changedInterfaces = set()
+		return ret
 
 
 	def makeConnection(self, address, localID, connectMessage):
@@ -184,42 +714,66 @@ class Network:
 		connection = self.makeConnectionFromSocket(sock)
 		connection.localID = localID
 		connection.dice = randomsource.getNonSecureRandom(numBytes=4)
+		self.interfaces[localID] = connection
+		self.changedInterfaces.add(localID)
 
 		connectMessage.dice = connection.dice
-		connection.sendMessage(None, connectMessage)
+		connection.sendMessage(None, connectMessage, offerFormats=True)
 
 		return connection
 
 
 	def makeConnectionFromSocket(self, sock):
 		connection = Connection(sock, self)
-		self.connections.append(connection)
+		self.connections.add(connection)
 		return connection
 
 
-	def checkForDuplicateConnections(self, localID):
-		connections = [c for c in self.connections if c.localID == localID]
-		if len(connections) < 2:
+	def setInterface(self, connection):
+		"""
+		Makes connection the interface for its localID.
+		If there already is a connection for that localID, only one of the two
+		is kept: the one with the largest dice value, or the existing one if
+		the values are equal. The other one is closed.
+		"""
+
+		localID = connection.localID
+		self.changedInterfaces.add(localID)
+		existing = self.interfaces.get(localID)
+		if existing is None:
+			self.interfaces[localID] = connection
 			return
 
-		keepConnection = connections[0]
-		for c in connections:
-			if c.dice > keepConnection.dice: #'alphabetical': big endian
-				keepConnection = c
+		if connection.dice > existing.dice: #'alphabetical': big endian
+			keepConnection, closeConnection = connection, existing
+		else:
+			keepConnection, closeConnection = existing, connection
+
+		log.log('Closing duplicate connection for %s' % localID)
+		self.removeConnection(closeConnection)
+		closeConnection.close()
+		self.interfaces[localID] = keepConnection
+
 
-		for c in connections:
-			if c != keepConnection:
-				i = self.connections.index(c)
-				log.log('Closing duplicate connection for %s' % localID)
-				self.connections[i].close()
-				del self.connections[i]
+	def removeConnection(self, connection):
+		"""
+		Removes a connection from the administration of this object.
+		This does not close the connection.
+		"""
+
+		if self.interfaces.get(connection.localID) is connection:
+			del self.interfaces[connection.localID]
+			self.changedInterfaces.add(connection.localID)
+		self.backloggedConnections.discard(connection)
+		self.pendingAckConnections.discard(connection)
+		self.connections.discard(connection)
 
 
 	def closeInterface(self, localID):
-		for i in range(len(self.connections)):
-			if self.connections[i].localID == localID:
-				log.log('Closing connection %s' % localID)
-				self.connections[i].close()
-				del self.connections[i]
-				break
+		connection = self.interfaces.get(localID)
+		if connection is None:
+			return
 
+		log.log('Closing connection %s' % localID)
+		self.removeConnection(connection)
+		connection.close()
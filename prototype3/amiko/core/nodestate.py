@@ -37,9 +37,11 @@ import payerlink
 import meetingpoint
 import transaction
 import persistentconnection
+import journal
 
 import messages
 import serializable
+import dispatch
 
 
 
@@ -48,51 +50,273 @@ class LinkNotFound(Exception):
 
 
 
+def convertOldPayerLink(nodeState, timeoutMessages):
+	"""
+	Converts the state of old versions, which had a single payerLink attribute
+	instead of payerLinks, so that a payment in progress is kept.
+
+	Arguments:
+	nodeState:       the state of a NodeState object (modified in-place)
+	timeoutMessages: the states of the time-out messages, as list or as
+	                 values of a dictionary (modified in-place)
+
+	Return value:
+	bool, indicating whether the state was converted.
+	"""
+
+	if "payerLink" not in nodeState:
+		return False
+
+	payer = nodeState.pop("payerLink")
+	if payer is None:
+		return True
+
+	#The single payer link used to have this local ID for its connection
+	#and its time-out messages:
+	payerID = messages.payerIDPrefix
+
+	payer["ID"] = payerID
+	nodeState.setdefault("payerLinks", {})[payerID] = payer
+
+	if type(timeoutMessages) == dict:
+		timeoutMessages = timeoutMessages.values()
+	for msg in timeoutMessages:
+		if msg["ID"] == payerID and msg["message"]["_class"] == "Timeout":
+			msg["message"]["ID"] = payerID
+
+	return True
+
+
+
+def getJournalChanges(nodeState, prefix, changes, updates):
+	"""
+	Arguments:
+	nodeState: the NodeState object
+	prefix:    list of dictionary keys, leading to the node state in the
+	           stored state tree
+	changes:   changes of nodeState, as returned by its popChanges method
+	updates:   updates of nodeState, as returned by its popUpdates method
+
+	Return value:
+	list of journal changes, which store the given changes and updates.
+	"""
+
+	ret = []
+
+	for attribute, key in changes:
+		value = getattr(nodeState, attribute)
+		path = prefix + [attribute]
+		if key is None:
+			ret.append((path, serializable.object2State(value)))
+		elif key in value:
+			ret.append((path + [key], serializable.object2State(value[key])))
+		else:
+			ret.append((path + [key],)) #removed
+
+	#Items that record their own changes (like persistent connections)
+	#only store the changes, not the entire item:
+	for (attribute, key), itemChanges in updates.iteritems():
+		if (attribute, key) in changes or (attribute, None) in changes:
+			continue #the entire item is already stored
+		path = prefix + [attribute, key]
+		ret += [journal.prefixChange(path, c) for c in itemChanges]
+
+	return ret
+
+
+
+class ShardLink:
+	"""
+	Stands in for a link that is kept by a shard process (see shard.py).
+	Method calls are turned into Link_Call messages, which are passed to the
+	shard of the link.
+	"""
+
+	def __init__(self, ID):
+		self.ID = ID
+
+
+	def __getattr__(self, name):
+		def call(msg, *args):
+			return [messages.Link_Call(
+				ID=self.ID, method=name, message=msg, arguments=list(args))]
+		return call
+
+
+
 class NodeState(serializable.Serializable):
 	serializableAttributes = \
 	{
 	'links':{},
 	'payeeLinks':{},
-	'payerLink': None,
+	'payerLinks':{},
 	'meetingPoints':{},
 	'transactions':{},
 	'connections':{}
 	}
 
 
-	def handleMessage(self, msg):
-		return \
-		{
-		messages.PaymentRequest : self.msg_request,
-		messages.MakePayer      : self.msg_makePayer,
-		messages.MakeLink       : self.msg_makeLink,
-		messages.MakeRoute      : self.msg_makeRoute,
-		messages.Lock           : self.msg_lock,
-		messages.Commit         : self.msg_commit,
-		messages.SettleCommit   : self.msg_settleCommit,
-
-		messages.HavePayerRoute : self.msg_passToAnyone,
-		messages.HavePayeeRoute : self.msg_passToAnyone,
-
-		messages.Pay    : self.msg_passToPayee,
-		messages.Confirm: self.msg_passToPayee,
-		messages.Cancel : self.msg_passToPayee,
+	def __init__(self, **kwargs):
+		serializable.Serializable.__init__(self, **kwargs)
+
+		#Set of IDs of the links that are kept by shard processes, in
+		#sharded execution mode (see shard.py). Not part of the state.
+		self.shardLinkIDs = set()
+
+		#Set of (attribute, key) of the parts of the state that were changed
+		#since the last call of popChanges:
+		self.__changes = set()
+
+		#(attribute, key) -> (exists, state, object) of the parts of the state
+		#before they were changed in the current transaction. For dictionary
+		#items, object is the original item, which is restored in-place.
+		#None if there is no transaction.
+		self.__undoLog = None
+
+		#Set of (attribute, key) of the items that record their own changes,
+		#and that were updated since the last call of popUpdates:
+		self.__updates = set()
+
+		#(attribute, key) -> object, of the items that record their own
+		#changes, and that were updated in the current transaction.
+		#None if there is no transaction.
+		self.__updatedObjects = None
+
+
+	def markChanged(self, attribute, key=None):
+		"""
+		Marks part of the state as changed.
+		This must be called before changing the part of the state.
+
+		Arguments:
+		attribute: name of the changed attribute
+		key:       for dictionary attributes, the key of the changed item.
+		           None indicates a change of the attribute itself.
+		"""
+		self.__changes.add((attribute, key))
+
+		if self.__undoLog is None or (attribute, key) in self.__undoLog:
+			return
+
+		#Keep a copy of the original, in case we need to roll back:
+		value = getattr(self, attribute)
+		if (attribute, key) in self.__updatedObjects:
+			#The object undoes its own changes, so it only needs to be put
+			#back:
+			self.__undoLog[(attribute, key)] = \
+				(True, None, self.__updatedObjects[(attribute, key)])
+		elif key is None:
+			self.__undoLog[(attribute, key)] = \
+				(True, serializable.object2State(value), None)
+		elif key in value:
+			self.__undoLog[(attribute, key)] = \
+				(True, serializable.object2State(value[key]), value[key])
+		else:
+			self.__undoLog[(attribute, key)] = (False, None, None)
+
+
+	def markUpdated(self, attribute, key):
+		"""
+		Marks an item of a dictionary attribute as changed, for items that
+		record their own changes (like PersistentConnection).
+		Unlike markChanged, this does not copy the item: the item itself
+		records how to undo its changes, and which changes need to be stored.
+		Inside a transaction, this must be called before changing the item.
+
+		Arguments:
+		attribute: name of the dictionary attribute
+		key:       the key of the changed item
+		"""
+		self.__updates.add((attribute, key))
+
+		if self.__updatedObjects is None:
+			return
+		if (attribute, key) in self.__updatedObjects:
+			return
+
+		obj = getattr(self, attribute)[key]
+		obj.beginTransaction()
+		self.__updatedObjects[(attribute, key)] = obj
+
+
+	def beginTransaction(self):
+		"""
+		Starts a transaction: from now on, changed parts of the state are
+		copied before they are changed, so that the changes can be undone
+		with rollbackTransaction.
+		"""
+		self.__undoLog = {}
+		self.__updatedObjects = {}
+
+
+	def commitTransaction(self):
+		"""
+		Ends a transaction, keeping all changes.
+		"""
+		for obj in self.__updatedObjects.itervalues():
+			obj.commitTransaction()
+
+		self.__undoLog = None
+		self.__updatedObjects = None
+
+
+	def rollbackTransaction(self):
+		"""
+		Ends a transaction, undoing all changes made since beginTransaction.
+		"""
+		undoLog = self.__undoLog
+		self.__undoLog = None
+
+		for obj in self.__updatedObjects.itervalues():
+			obj.rollbackTransaction()
+		self.__updatedObjects = None
+
+		for (attribute, key), (exists, state, obj) in undoLog.iteritems():
+			if key is None:
+				setattr(self, attribute, serializable.state2Object(state))
+			elif exists:
+				#Restore the original object, instead of a copy: other code
+				#(like API Payment objects) may still refer to it.
+				if state is not None:
+					serializable.restoreState(obj, state)
+				getattr(self, attribute)[key] = obj
+			else:
+				getattr(self, attribute).pop(key, None)
+
+
+	def popChanges(self):
+		"""
+		Return value:
+		set of (attribute, key) of the parts of the state that were changed
+		since the previous call of this method.
+		"""
+		ret = self.__changes
+		self.__changes = set()
+		return ret
 
-		messages.Timeout          : self.msg_passToPayer,
-		messages.Receipt          : self.msg_passToPayer,
-		messages.PayerLink_Confirm: self.msg_passToPayer,
 
-		messages.ConnectLink: self.msg_connectLink,
+	def popUpdates(self):
+		"""
+		Return value:
+		dictionary of (attribute, key) -> list of changes, of the items that
+		were marked with markUpdated since the previous call of this method,
+		and that still exist. The changes are as returned by the popChanges
+		method of the items.
+		"""
+		ret = {}
+		for attribute, key in self.__updates:
+			obj = getattr(self, attribute).get(key)
+			if obj is not None:
+				ret[(attribute, key)] = obj.popChanges()
+		self.__updates = set()
+		return ret
 
-		messages.OutboundMessage: self.msg_passToConnection,
-		messages.Confirmation   : self.msg_passToConnection,
 
-		messages.Link_Deposit  : self.msg_passToLink,
-		messages.ChannelMessage: self.msg_passToLink,
-		messages.Deposit       : self.msg_passToLink
-		}[msg.__class__](msg)
+	def handleMessage(self, msg):
+		return self.messageHandlers[msg.__class__](self, msg)
 
 
+	@dispatch.handles(messages.PaymentRequest)
 	def msg_request(self, msg):
 		#ID can be nonsecure random:
 		#It only needs to be semi-unique, not secret.
@@ -101,6 +325,9 @@ class NodeState(serializable.Serializable):
 		#Token must be secure random
 		token = randomsource.getSecureRandom(32)
 
+		self.markChanged('payeeLinks', payeeLinkID)
+		self.markChanged('connections', payeeLinkID)
+
 		newPayeeLink = payeelink.PayeeLink(
 			amount=msg.amount, receipt=msg.receipt, token=token)
 
@@ -113,28 +340,47 @@ class NodeState(serializable.Serializable):
 		return [messages.ReturnValue(value=payeeLinkID)]
 
 
+	@dispatch.handles(messages.MakePayer)
 	def msg_makePayer(self, msg):
-		if not (self.payerLink is None):
-			raise Exception("There already is a payment in progress")
-		self.payerLink = payerlink.PayerLink(payeeLinkID=msg.payeeLinkID)
+		#ID can be nonsecure random:
+		#It only needs to be unique, not secret.
+		while True:
+			payerID = messages.payerIDPrefix + \
+				randomsource.getNonSecureRandom(8).encode("hex")
+			if payerID not in self.payerLinks and payerID not in self.connections:
+				break
+
+		self.markChanged('payerLinks', payerID)
+		self.markChanged('connections', payerID)
+
+		newPayerLink = payerlink.PayerLink(
+			ID=payerID, payeeLinkID=msg.payeeLinkID)
 
-		self.connections[messages.payerLocalID] = \
+		self.payerLinks[payerID] = newPayerLink
+
+		self.connections[payerID] = \
 			persistentconnection.PersistentConnection(
 				host=msg.host,
 				port=msg.port,
-				connectMessage=messages.Pay(ID=msg.payeeLinkID)
+				connectMessage=messages.Pay(
+					ID=msg.payeeLinkID,
+					callbackID=payerID
+					)
 				)
 
 		#Returned messages:
 		return [
 			messages.TimeoutMessage(timestamp=time.time()+5.0, message=\
-				self.payerLink.getTimeoutMessage()  #Add time-out for payer
-			)
+				newPayerLink.getTimeoutMessage(),  #Add time-out for payer
+				ID=payerID
+			),
+			messages.ReturnValue(value=payerID)
 			]
 
 
+	@dispatch.handles(messages.MakeLink)
 	def msg_makeLink(self, msg):
-		if msg.localID in self.links.keys():
+		if msg.localID in self.links.keys() or msg.localID in self.shardLinkIDs:
 			raise Exception('A link with ID %s already exists' % msg.localID)
 
 		if msg.localID in self.payeeLinks.keys():
@@ -143,6 +389,9 @@ class NodeState(serializable.Serializable):
 		if msg.localID[0] == '_':
 			raise Exception('Names starting with an underscore are reserved, and can not be used')
 
+		self.markChanged('links', msg.localID)
+		self.markChanged('connections', msg.localID)
+
 		self.links[msg.localID] = link.Link(remoteID=msg.remoteID)
 
 		self.connections[msg.localID] = \
@@ -162,6 +411,7 @@ class NodeState(serializable.Serializable):
 		return []
 
 
+	@dispatch.handles(messages.MakeRoute)
 	def msg_makeRoute(self, msg):
 		transactionSide = \
 		{
@@ -169,6 +419,8 @@ class NodeState(serializable.Serializable):
 		(True, False): transaction.side_payee
 		}[(msg.payerID is None, msg.payeeID is None)]
 
+		self.markChanged('transactions', msg.transactionID)
+
 		if msg.transactionID in self.transactions.keys():
 			#Match with existing transaction
 			tx = self.transactions[msg.transactionID]
@@ -201,7 +453,7 @@ class NodeState(serializable.Serializable):
 			side=transactionSide,
 			payeeID=msg.payeeID,
 			payerID=msg.payerID,
-			remainingLinkIDs=self.links.keys(),
+			remainingLinkIDs=self.links.keys() + list(self.shardLinkIDs),
 			meetingPointID=msg.meetingPointID,
 			amount=msg.amount,
 			startTime=msg.startTime,
@@ -211,6 +463,7 @@ class NodeState(serializable.Serializable):
 		return []
 
 
+	@dispatch.handles(messages.Lock)
 	def msg_lock(self, msg):
 		tx = self.transactions[msg.transactionID]
 		payer = self.__getLinkObject(tx.payerID)
@@ -222,6 +475,7 @@ class NodeState(serializable.Serializable):
 		return ret
 
 
+	@dispatch.handles(messages.Commit)
 	def msg_commit(self, msg):
 		transactionID = settings.hashAlgorithm(msg.token)
 		tx = self.transactions[transactionID]
@@ -235,6 +489,7 @@ class NodeState(serializable.Serializable):
 		return ret
 
 
+	@dispatch.handles(messages.SettleCommit)
 	def msg_settleCommit(self, msg):
 		transactionID = settings.hashAlgorithm(msg.token)
 		tx = self.transactions[transactionID]
@@ -254,56 +509,83 @@ class NodeState(serializable.Serializable):
 			pass #Payment is committed, so payee object may already be deleted
 
 		#Clean up no-longer-needed transaction:
+		self.markChanged('transactions', transactionID)
 		del self.transactions[transactionID]
 
 		return ret
 
 
+	@dispatch.handles(messages.ConnectLink)
 	def msg_connectLink(self, msg):
 		#Update call-back information:
 		if None not in (msg.callbackHost, msg.callbackPort, msg.callbackID):
-			self.connections[msg.ID].host = msg.callbackHost
-			self.connections[msg.ID].port = msg.callbackPort
-			self.connections[msg.ID].connectMessage.ID = msg.callbackID
+			self.markUpdated('connections', msg.ID)
+			self.markChanged('links', msg.ID)
+			self.connections[msg.ID].setConnectTarget(
+				msg.callbackHost, msg.callbackPort, msg.callbackID)
 			self.links[msg.ID].remoteID = msg.callbackID
 
 		#TODO: maybe inform link about creation of the connection?
 		return []
 
 
+	@dispatch.handles(messages.HavePayerRoute, messages.HavePayeeRoute)
 	def msg_passToAnyone(self, msg):
 		return self.__getLinkObject(msg.ID).handleMessage(msg)
 
 
 	def __getLinkObject(self, linkID):
-		if linkID == messages.payerLocalID and not (self.payerLink is None):
-			return self.payerLink
+		if linkID in self.payerLinks.keys():
+			self.markChanged('payerLinks', linkID)
+			return self.payerLinks[linkID]
 		elif linkID in self.payeeLinks.keys():
+			self.markChanged('payeeLinks', linkID)
 			return self.payeeLinks[linkID]
 		elif linkID in self.links.keys():
+			self.markChanged('links', linkID)
 			return self.links[linkID]
+		elif linkID in self.shardLinkIDs:
+			return ShardLink(linkID)
 
 		raise LinkNotFound("Link ID %s not found" % repr(linkID))
 
 
+	@dispatch.handles(messages.Pay, messages.Confirm, messages.Cancel)
 	def msg_passToPayee(self, msg):
 		payee = self.payeeLinks[msg.ID]
+		self.markChanged('payeeLinks', msg.ID)
 		return payee.handleMessage(msg)
 
 
+	@dispatch.handles(messages.Timeout, messages.Receipt, messages.PayerLink_Confirm)
 	def msg_passToPayer(self, msg):
-		if self.payerLink is None:
-			raise Exception("Received message for payer, but there is no payer")
-		return self.payerLink.handleMessage(msg)
+		if msg.ID not in self.payerLinks.keys():
+			raise Exception(
+				"Received message for payer %s, but there is no such payer" % \
+					repr(msg.ID))
+		self.markChanged('payerLinks', msg.ID)
+		return self.payerLinks[msg.ID].handleMessage(msg)
 
 
+	@dispatch.handles(messages.OutboundMessage, messages.Confirmation)
 	def msg_passToConnection(self, msg):
+		self.markUpdated('connections', msg.localID)
 		return self.connections[msg.localID].handleMessage(msg)
 
 
+	@dispatch.handles(messages.Link_Deposit, messages.ChannelMessage, messages.Deposit)
 	def msg_passToLink(self, msg):
+		self.markChanged('links', msg.ID)
 		return self.links[msg.ID].handleMessage(msg)
 
 
+	@dispatch.handles(messages.Link_Call)
+	def msg_callLink(self, msg):
+		self.markChanged('links', msg.ID)
+		method = getattr(self.links[msg.ID], msg.method)
+		return method(msg.message, *msg.arguments)
+
+
 serializable.registerClass(NodeState)
+dispatch.registerHandlers(NodeState)
 
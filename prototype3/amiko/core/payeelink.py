@@ -34,6 +34,7 @@ import settings
 import messages
 
 import serializable
+import dispatch
 
 
 
@@ -49,7 +50,8 @@ class PayeeLink(serializable.Serializable):
 		'amount': 0,
 		'receipt': None,
 		'token': None,
-		'meetingPointID': ''
+		'meetingPointID': '',
+		'payerID': None
 	}
 
 	def __init__(self, **kwargs):
@@ -61,15 +63,10 @@ class PayeeLink(serializable.Serializable):
 
 
 	def handleMessage(self, msg):
-		return \
-		{
-		messages.Pay           : self.msg_pay,
-		messages.Confirm       : self.msg_confirm,
-		messages.Cancel        : self.msg_cancel,
-		messages.HavePayeeRoute: self.msg_havePayeeRoute
-		}[msg.__class__](msg)
+		return self.messageHandlers[msg.__class__](self, msg)
 
 
+	@dispatch.handles(messages.Pay)
 	def msg_pay(self, msg):
 		if self.state != self.states.initial:
 			raise Exception(
@@ -77,8 +74,13 @@ class PayeeLink(serializable.Serializable):
 					self.state
 				)
 
+		#The ID of the payer link on the payer side, to which we address
+		#our messages:
+		self.payerID = msg.callbackID
+
 		return [messages.OutboundMessage(localID = msg.ID, message = \
 			messages.Receipt(
+				ID=self.payerID,
 				amount=self.amount,
 				receipt=self.receipt,
 				transactionID=self.transactionID,
@@ -86,6 +88,7 @@ class PayeeLink(serializable.Serializable):
 			))]
 
 
+	@dispatch.handles(messages.Confirm)
 	def msg_confirm(self, msg):
 		if self.state != self.states.initial:
 			raise Exception(
@@ -112,6 +115,7 @@ class PayeeLink(serializable.Serializable):
 		]
 
 
+	@dispatch.handles(messages.Cancel)
 	def msg_cancel(self, msg):
 		if self.state != self.states.initial:
 			raise Exception(
@@ -125,12 +129,13 @@ class PayeeLink(serializable.Serializable):
 		return []
 
 
+	@dispatch.handles(messages.HavePayeeRoute)
 	def msg_havePayeeRoute(self, msg):
 		#Simply pass it to the payer, who keeps track of whether the route is complete
 		return \
 		[
 		messages.OutboundMessage(localID = msg.ID, message = \
-			messages.HavePayeeRoute(ID=messages.payerLocalID, transactionID=None)
+			messages.HavePayeeRoute(ID=self.payerID, transactionID=None)
 			)
 		]
 
@@ -160,4 +165,5 @@ class PayeeLink(serializable.Serializable):
 
 
 serializable.registerClass(PayeeLink)
+dispatch.registerHandlers(PayeeLink)
 
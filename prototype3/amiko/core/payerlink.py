@@ -36,6 +36,7 @@ import messages
 import log
 
 import serializable
+import dispatch
 
 
 
@@ -48,6 +49,8 @@ class PayerLink(serializable.Serializable):
 
 	serializableAttributes = \
 	{
+		'ID':             '',
+
 		'payeeHost':      None,
 		'payeePort':      None,
 		'payeeLinkID':    None,
@@ -75,10 +78,10 @@ class PayerLink(serializable.Serializable):
 
 
 	def __deepcopy__(self, memo):
-		#This is called indirectly from serializable.py.
-		#It overrides default deepcopy behavior to work around a problem with
+		#Overrides default deepcopy behavior to work around a problem with
 		#threading.Event objects
 		return PayerLink(
+			ID             = self.ID,
 			payeeHost      = self.payeeHost,
 			payeePort      = self.payeePort,
 			payeeLinkID    = self.payeeLinkID,
@@ -92,7 +95,7 @@ class PayerLink(serializable.Serializable):
 
 
 	def getTimeoutMessage(self):
-		return messages.Timeout(state=self.state)
+		return messages.Timeout(ID=self.ID, state=self.state)
 
 
 	def waitForReceipt(self):
@@ -105,16 +108,10 @@ class PayerLink(serializable.Serializable):
 
 
 	def handleMessage(self, msg):
-		return \
-		{
-		messages.Timeout          : self.msg_timeout,
-		messages.Receipt          : self.msg_receipt,
-		messages.PayerLink_Confirm: self.msg_confirm,
-		messages.HavePayerRoute   : self.msg_havePayerRoute,
-		messages.HavePayeeRoute   : self.msg_havePayeeRoute
-		}[msg.__class__](msg)
+		return self.messageHandlers[msg.__class__](self, msg)
 
 
+	@dispatch.handles(messages.Timeout)
 	def msg_timeout(self, msg):
 		if self.state == self.states.initial and msg.state == self.states.initial:
 			#Receipt time-out
@@ -133,6 +130,7 @@ class PayerLink(serializable.Serializable):
 		return []
 
 
+	@dispatch.handles(messages.Receipt)
 	def msg_receipt(self, msg):
 		log.log("PayerLink: Received payment receipt")
 
@@ -146,6 +144,7 @@ class PayerLink(serializable.Serializable):
 		return []
 
 
+	@dispatch.handles(messages.PayerLink_Confirm)
 	def msg_confirm(self, msg):
 		log.log("PayerLink: Received confirm: %s" % str(msg.agreement))
 
@@ -162,7 +161,7 @@ class PayerLink(serializable.Serializable):
 
 			ret = \
 			[
-			messages.OutboundMessage(localID = messages.payerLocalID, message = \
+			messages.OutboundMessage(localID = self.ID, message = \
 				messages.Confirm(ID=self.payeeLinkID, meetingPointID=self.meetingPointID)
 			),
 			messages.MakeRoute( #This will start the transaction routing
@@ -171,7 +170,7 @@ class PayerLink(serializable.Serializable):
 				startTime=None, #Will be received from the payee side
 				endTime=None, #Will be received from the payee side
 				meetingPointID=self.meetingPointID,
-				payerID=messages.payerLocalID,
+				payerID=self.ID,
 				payeeID=None
 				)
 			]
@@ -183,7 +182,7 @@ class PayerLink(serializable.Serializable):
 
 			ret = \
 			[
-			messages.OutboundMessage(localID = messages.payerLocalID, message = \
+			messages.OutboundMessage(localID = self.ID, message = \
 				messages.Cancel(ID=self.payeeLinkID)
 			)
 			]
@@ -191,6 +190,7 @@ class PayerLink(serializable.Serializable):
 		return ret
 
 
+	@dispatch.handles(messages.HavePayerRoute)
 	def msg_havePayerRoute(self, msg):
 		log.log("Payer: HavePayerRoute received")
 
@@ -211,6 +211,7 @@ class PayerLink(serializable.Serializable):
 		return ret
 
 
+	@dispatch.handles(messages.HavePayeeRoute)
 	def msg_havePayeeRoute(self, msg):
 		log.log("Payer: HavePayeeRoute received")
 
@@ -247,7 +248,8 @@ class PayerLink(serializable.Serializable):
 		return \
 		[
 		messages.TimeoutMessage(timestamp=time.time()+1.0, message=\
-			self.getTimeoutMessage()  #Add time-out to go to commit
+			self.getTimeoutMessage(),  #Add time-out to go to commit
+			ID=self.ID
 		)
 		]
 
@@ -263,4 +265,5 @@ class PayerLink(serializable.Serializable):
 
 
 serializable.registerClass(PayerLink)
+dispatch.registerHandlers(PayerLink)
 
@@ -26,6 +26,9 @@
 #    such a combination shall include the source code for the parts of the
 #    OpenSSL library used as well as that of the covered work.
 
+from collections import deque
+import itertools
+
 import messages
 
 import serializable
@@ -51,6 +54,27 @@ class PersistentConnection(serializable.Serializable):
 	}
 
 
+	def __init__(self, **kwargs):
+		serializable.Serializable.__init__(self, **kwargs)
+
+		#The outbox is stored as a list, but used as a deque.
+		#The indices of the messages in the outbox are consecutive (modulo
+		#the wrap-around).
+		self.messages = deque(self.messages)
+
+		#Changes since the last call of popChanges, as journal changes
+		#relative to the state of this object.
+		#This way, storing a change does not require storing the outbox.
+		self.__changes = []
+
+		#Undo entries of the current transaction, in the order in which the
+		#changes were made, or None if there is no transaction:
+		self.__undoLog = None
+
+		#Number of entries in self.__changes from before the transaction:
+		self.__numChangesBeforeTransaction = 0
+
+
 	def handleMessage(self, msg):
 		if msg.__class__ == messages.OutboundMessage:
 			self.addMessage(msg)
@@ -70,27 +94,58 @@ class PersistentConnection(serializable.Serializable):
 		#The value wrap-around is artificially shortened to 16 bits.
 		#The reason is to make wrap-around more common, so we're more likely
 		#to find related bugs in an early stage of development.
-		self.lastIndex = (self.lastIndex + 1) & 0xffff
+		self.__setAttribute(self, ['lastIndex'], 'lastIndex',
+			(self.lastIndex + 1) & 0xffff)
 
-		self.messages.append(PersistentConnectionMessage(
-			message=msg, index=self.lastIndex))
-		self.notYetTransmitted += 1
+		newMessage = PersistentConnectionMessage(
+			message=msg, index=self.lastIndex)
+		self.messages.append(newMessage)
+		self.__changes.append(('append', ['messages'], newMessage))
+		if self.__undoLog is not None:
+			self.__undoLog.append(('pop',))
+
+		self.__setAttribute(self, ['notYetTransmitted'], 'notYetTransmitted',
+			self.notYetTransmitted + 1)
 
 
 	def processConfirmation(self, confirmation):
 		#A confirmation confirms all earlier messages as well.
-		confirmationIndex = confirmation.index
-		for i in range(len(self.messages)):
-			if self.messages[i].index == confirmationIndex:
-				self.messages = self.messages[i+1:]
-				return
+		if len(self.messages) == 0:
+			return
+
+		#Position of the confirmed message in the outbox, if it is in there:
+		numConfirmed = ((confirmation.index - self.messages[0].index) & 0xffff) + 1
+		if numConfirmed > len(self.messages):
+			return #not in the outbox (e.g. it was confirmed earlier)
+
+		self.__popMessages(numConfirmed)
+
+		#The peer may confirm messages that were not yet transmitted (e.g.
+		#after a re-connect, or in case of a misbehaving peer):
+		if self.notYetTransmitted > len(self.messages):
+			self.__setAttribute(self, ['notYetTransmitted'], 'notYetTransmitted',
+				len(self.messages))
+
+
+	def transmit(self, network, windowSize=None):
+		"""
+		Sends not-yet-transmitted messages, as far as the window and the send
+		buffer of the network connection allow.
 
+		Arguments:
+		network:    the network object
+		windowSize: maximum number of transmitted, not yet confirmed messages,
+		            or None for no maximum
+
+		Return value:
+		bool, indicating whether the state of this object was changed.
+		"""
 
-	def transmit(self, network):
 		if len(self.messages) == 0:
 			return False
 
-		if not network.interfaceExists(self.messages[0].message.localID):
+		localID = self.messages[0].message.localID
+		if not network.interfaceExists(localID):
 			#We are not connected.
 
 			changed = False
@@ -98,34 +153,151 @@ class PersistentConnection(serializable.Serializable):
 			#If we are closing, just forget about sending the remaining messages:
 			if self.closing:
 				changed = True
-				self.messages = []
+				self.__popMessages(len(self.messages))
 
 			#We are not connected (anymore):
-			#Assume all not-yet-confirmed messages were lost
-			changed = changed or self.notYetTransmitted != len(self.messages)
-			self.notYetTransmitted = len(self.messages)
+			#Assume all not-yet-confirmed messages were lost.
+			#After re-connecting, they are transmitted again, starting with
+			#the first not-yet-confirmed message.
+			if self.notYetTransmitted != len(self.messages):
+				changed = True
+				self.__setAttribute(self, ['notYetTransmitted'],
+					'notYetTransmitted', len(self.messages))
 
 			return changed
 
-		#Prevents a problem in the following lines:
-		#self.messages[-0:] would incorrectly select all messages for retransmission
-		if self.notYetTransmitted == 0:
+		#We are connected -> send not-yet-transmitted messages.
+		#They come after the transmitted, not yet confirmed messages.
+		numInFlight = max(0, len(self.messages) - self.notYetTransmitted)
+		numToBeSent = self.notYetTransmitted
+		if windowSize is not None:
+			numToBeSent = min(numToBeSent, windowSize - numInFlight)
+		if numToBeSent <= 0:
 			return False
 
-		#We are connected -> send all not-yet-transmitted messages
-		for msg in self.messages[-self.notYetTransmitted:]:
+		numSent = 0
+		for msg in itertools.islice(
+			self.messages, numInFlight, numInFlight + numToBeSent):
+
+			#Don't fill up memory if the peer doesn't keep up:
+			if network.isSendBufferFull(localID):
+				break
+
 			network.sendOutboundMessage(msg.index, msg.message)
-		self.notYetTransmitted = 0
+			numSent += 1
+
+		if numSent == 0:
+			return False
+
+		self.__setAttribute(self, ['notYetTransmitted'], 'notYetTransmitted',
+			self.notYetTransmitted - numSent)
 		return True
 
 
 	def close(self):
-		self.closing = True
+		self.__setAttribute(self, ['closing'], 'closing', True)
+
+
+	def setConnectTarget(self, host, port, ID):
+		"""
+		Changes where (re-)connecting is done to.
+
+		Arguments:
+		host: the host name
+		port: the port number
+		ID:   the ID of the remote interface, as sent in the connect message
+		"""
+
+		self.__setAttribute(self, ['host'], 'host', host)
+		self.__setAttribute(self, ['port'], 'port', port)
+		self.__setAttribute(self.connectMessage, ['connectMessage', 'ID'],
+			'ID', ID)
 
 
 	def canBeClosed(self):
 		return self.closing and len(self.messages) == 0
 
 
+	def popChanges(self):
+		"""
+		Return value:
+		list of changes made since the previous call of this method.
+		The changes have the format of journal changes, with paths relative
+		to the state of this object.
+		"""
+		ret = self.__changes
+		self.__changes = []
+		self.__numChangesBeforeTransaction = 0
+		return ret
+
+
+	def beginTransaction(self):
+		"""
+		Starts a transaction: from now on, changes are recorded, so that they
+		can be undone with rollbackTransaction.
+		"""
+		self.__undoLog = []
+		self.__numChangesBeforeTransaction = len(self.__changes)
+
+
+	def commitTransaction(self):
+		"""
+		Ends a transaction, keeping all changes.
+		"""
+		self.__undoLog = None
+
+
+	def rollbackTransaction(self):
+		"""
+		Ends a transaction, undoing all changes made since beginTransaction.
+		"""
+		undoLog = self.__undoLog
+		self.__undoLog = None
+
+		#The undone changes don't need to be stored:
+		del self.__changes[self.__numChangesBeforeTransaction:]
+
+		for entry in reversed(undoLog):
+			if entry[0] == 'set':
+				obj, name, oldValue = entry[1:]
+				setattr(obj, name, oldValue)
+			elif entry[0] == 'pop':
+				self.messages.pop()
+			else: #extendleft
+				self.messages.extendleft(reversed(entry[1]))
+
+
+	def __setAttribute(self, obj, path, name, value):
+		"""
+		Sets an attribute of this object, or of an object inside it, and
+		records the change.
+
+		Arguments:
+		obj:   the object whose attribute is set
+		path:  the path of the attribute in the state of this object
+		name:  the name of the attribute
+		value: the new value; must be a str, int, bool or None
+		"""
+
+		if self.__undoLog is not None:
+			self.__undoLog.append(('set', obj, name, getattr(obj, name)))
+		setattr(obj, name, value)
+		self.__changes.append((path, value))
+
+
+	def __popMessages(self, count):
+		"""
+		Removes messages from the start of the outbox, and records the change.
+		"""
+
+		if self.__undoLog is None:
+			for i in xrange(count):
+				self.messages.popleft()
+		else:
+			popped = [self.messages.popleft() for i in xrange(count)]
+			self.__undoLog.append(('extendleft', popped))
+		self.__changes.append(('popleft', ['messages'], count))
+
+
 serializable.registerClass(PersistentConnection)
 
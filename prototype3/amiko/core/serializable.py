@@ -26,13 +26,22 @@
 #    such a combination shall include the source code for the parts of the
 #    OpenSSL library used as well as that of the covered work.
 
+from collections import deque
 import copy
 import json
+import re
 
 
 
 registeredClasses = {}
 
+#class -> function, generated for each registered class:
+stateEncoders = {}  #object -> state
+stateDecoders = {}  #state -> object
+dataEncoders = {}   #object -> json-compatible data with encoded strings
+dataDecoders = {}   #json-compatible data with encoded strings -> object
+
+
 def registerClass(c):
 	"""
 	c: class
@@ -41,93 +50,159 @@ def registerClass(c):
 		raise Exception("Multiple serializable classes with the same name: " + c.__name__)
 	registeredClasses[c.__name__] = c
 
+	stateEncoders[c] = compileEncoder(c, object2State)
+	stateDecoders[c] = compileDecoder(c, state2Object)
+	dataEncoders[c] = compileEncoder(c, encodeStrings)
+	dataDecoders[c] = compileDecoder(c, decodeData)
 
-def applyRecursively(selectFunction, transformFunction, obj):
-	#For these iterables, process the items recursively:
-	if type(obj) == dict:
-		obj = \
-		{
-		applyRecursively(selectFunction, transformFunction, k):
-			applyRecursively(selectFunction, transformFunction, v)
-		for k,v in obj.iteritems()
-		}
-	if type(obj) == list:
-		obj = \
-		[
-		applyRecursively(selectFunction, transformFunction, x)
-		for x in obj
-		]
 
-	#Apply the transformation for selected objects:
-	if selectFunction(obj):
-		return transformFunction(obj)
+isIdentifier = re.compile('^[A-Za-z_][A-Za-z0-9_]*$').match
 
-	return obj
+def compileEncoder(c, convert):
+	"""
+	Generates a function that converts an instance of c to a dictionary,
+	by applying convert on the values of all serializable attributes.
+	"""
 
+	items = []
+	for name in sorted(c.serializableAttributes.keys()):
+		if not isIdentifier(name):
+			raise Exception("Invalid serializable attribute name: " + repr(name))
+		items.append("%r: convert(obj.%s)" % (name, name))
+	items.append("'_class': %r" % c.__name__)
 
-def state2Object(s):
-	def transformFunction(attribs):
-		c = registeredClasses[attribs["_class"]]
-		return c(**attribs)
+	source = "def encode(obj):\n\treturn {%s}\n" % ", ".join(items)
+	namespace = {'convert': convert}
+	exec source in namespace
+	return namespace['encode']
+
+
+def compileDecoder(c, convert):
+	"""
+	Generates a function that makes an instance of c out of a dictionary,
+	by applying convert on the values of all serializable attributes.
+	Attributes that are missing in the dictionary get their default value.
+	"""
 
-	return applyRecursively(
-		lambda obj: type(obj) == dict and "_class" in obj.keys(),
-		transformFunction,
-		s)
+	lines = ["def decode(attribs):", "\tkwargs = {}"]
+	for name in sorted(c.serializableAttributes.keys()):
+		lines.append("\tif %r in attribs: kwargs[%r] = convert(attribs[%r])" % \
+			(name, name, name))
+	lines.append("\treturn c(**kwargs)")
 
+	source = "\n".join(lines) + "\n"
+	namespace = {'convert': convert, 'c': c}
+	exec source in namespace
+	return namespace['decode']
 
-def object2State(s):
-	def transformFunction(obj):
-		className = obj.__class__.__name__
-		c = registeredClasses[className]
-		attributes = c.serializableAttributes
-		obj = \
-		{
-			name: object2State(getattr(obj, name))
-			for name in attributes.keys()
-		}
-		obj["_class"] = className
-		return obj
-
-	return applyRecursively(
-		lambda obj: isinstance(obj, Serializable),
-		transformFunction,
-		s)
 
+def state2Object(s):
+	t = type(s)
+	if t == dict:
+		if "_class" in s:
+			c = registeredClasses[s["_class"]]
+			return stateDecoders[c](s)
+		return {state2Object(k): state2Object(v) for k,v in s.iteritems()}
+	if t == list:
+		return [state2Object(x) for x in s]
+	return s
+
+
+def restoreState(obj, s):
+	"""
+	Sets the serializable attributes of obj to the values in state s, as
+	returned by object2State for an object of the same class.
+	Unlike state2Object, this keeps the identity of obj, so references to it
+	stay valid. Attributes that are not serializable are not changed.
+	"""
+	restored = state2Object(s)
+	for name in obj.serializableAttributes.iterkeys():
+		setattr(obj, name, getattr(restored, name))
 
-def encodeStrings(s):
-	def transformFunction(obj):
-		nonReadableChars = [c for c in obj if ord(c) < 32 or ord(c) >= 128]
-		isHumanReadable = len(nonReadableChars) == 0
-		if isHumanReadable:
-			if len(obj) > 0 and obj[0] == '!':
-				obj = '!' + obj
+
+def object2State(s):
+	t = type(s)
+	if t == dict:
+		return {object2State(k): object2State(v) for k,v in s.iteritems()}
+	if t == list or t == deque: #deques are stored as lists
+		return [object2State(x) for x in s]
+	if isinstance(s, Serializable):
+		c = registeredClasses[s.__class__.__name__]
+		return stateEncoders[c](s)
+	return s
+
+
+hasNonReadableChars = re.compile('[^\x20-\x7f]').search
+
+def encodeString(s):
+	if hasNonReadableChars(s) is None:
+		if len(s) > 0 and s[0] == '!':
+			s = '!' + s
+	else:
+		s = '!x' + s.encode('hex')
+	return s
+
+
+def decodeString(s):
+	s = str(s)
+	if len(s) >= 2 and s[0] == '!':
+		if s[1] == 'x':
+			return s[2:].decode('hex')
+		elif s[1] == '!':
+			return s[1:]
 		else:
-			obj = '!x' + obj.encode('hex')
-		return obj
+			raise Exception('Formatting error')
+	return s
 
-	return applyRecursively(
-		lambda obj: type(obj) == str,
-		transformFunction,
-		s)
+
+def encodeStrings(s):
+	"""
+	Converts a state or an object to json-compatible data, in which
+	non-human-readable strings are encoded.
+	"""
+	t = type(s)
+	if t == str:
+		return encodeString(s)
+	if t == dict:
+		return {encodeStrings(k): encodeStrings(v) for k,v in s.iteritems()}
+	if t == list or t == deque:
+		return [encodeStrings(x) for x in s]
+	if isinstance(s, Serializable):
+		c = registeredClasses[s.__class__.__name__]
+		return dataEncoders[c](s)
+	return s
 
 
 def decodeStrings(s):
-	def transformFunction(obj):
-		obj = str(obj)
-		if len(obj) >= 2 and obj[0] == '!':
-			if obj[1] == 'x':
-				return obj[2:].decode('hex')
-			elif obj[1] == '!':
-				return obj[1:]
-			else:
-				raise Exception('Formatting error')
-		return obj
+	"""
+	Converts json-compatible data to a state, by decoding its strings.
+	"""
+	t = type(s)
+	if t == unicode or t == str:
+		return decodeString(s)
+	if t == dict:
+		return {decodeStrings(k): decodeStrings(v) for k,v in s.iteritems()}
+	if t == list:
+		return [decodeStrings(x) for x in s]
+	return s
+
 
-	return applyRecursively(
-		lambda obj: type(obj) in (unicode, str),
-		transformFunction,
-		s)
+def decodeData(s):
+	"""
+	Converts json-compatible data to an object, by decoding its strings and
+	constructing instances of serializable classes.
+	"""
+	t = type(s)
+	if t == unicode or t == str:
+		return decodeString(s)
+	if t == dict:
+		if "_class" in s:
+			c = registeredClasses[decodeString(s["_class"])]
+			return dataDecoders[c](s)
+		return {decodeData(k): decodeData(v) for k,v in s.iteritems()}
+	if t == list:
+		return [decodeData(x) for x in s]
+	return s
 
 
 def deserializeState(s):
@@ -135,7 +210,7 @@ def deserializeState(s):
 
 
 def deserialize(s):
-	return state2Object(deserializeState(s))
+	return decodeData(json.loads(s))
 
 
 def serializeState(s):
@@ -143,20 +218,28 @@ def serializeState(s):
 
 
 def serialize(obj):
-	return serializeState(object2State(obj))
+	return json.dumps(encodeStrings(obj))
 
 
 
 class Serializable:
 	def __init__(self, **kwargs):
+		"""
+		Constructor.
+
+		The new object takes ownership of the values passed as keyword
+		arguments: they are not copied, so the caller must not modify them
+		afterwards. Attributes that are not passed get their default value;
+		mutable default values (dictionaries and lists) are copied.
+		"""
 		c = registeredClasses[self.__class__.__name__]
-		attributes = c.serializableAttributes
-		for name in attributes.keys():
-			setattr(self, name, copy.deepcopy(
-					kwargs[name]
-				if name in kwargs else
-					attributes[name] #default value
-				))
+		for name, default in c.serializableAttributes.iteritems():
+			if name in kwargs:
+				setattr(self, name, kwargs[name])
+			elif type(default) in (dict, list):
+				setattr(self, name, copy.deepcopy(default))
+			else:
+				setattr(self, name, default)
 
 
 	def getState(self):
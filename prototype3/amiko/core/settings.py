@@ -64,12 +64,36 @@ class Settings:
 			"network", "advertizedHost", self.listenHost)
 		self.advertizedPort = int(self.__get(
 			"network", "advertizedPort", self.listenPort))
+		self.wireFormat = self.__get(
+			"network", "wireFormat", "binary")
+		if self.wireFormat not in ("json", "binary"):
+			raise Exception("Unknown wire format: " + self.wireFormat)
+		self.maxMessageSize = int(self.__get(
+			"network", "maxMessageSize", 1048576))
+		self.ackCount = int(self.__get(
+			"network", "ackCount", 16))
+		self.ackDelay = float(self.__get(
+			"network", "ackDelay", 0.01))
+		self.sendWindow = int(self.__get(
+			"network", "sendWindow", 256))
+		self.maxSendBuffer = int(self.__get(
+			"network", "maxSendBuffer", 262144))
 
 		#files
 		self.stateFile = self.__get(
 			"files", "statefile", "amikopay.dat")
 		self.payLogFile = self.__get(
 			"files", "paylogfile", "payments.log")
+		self.stateJournalSize = int(self.__get(
+			"files", "statejournalsize", 1000))
+		self.stateSyncInterval = float(self.__get(
+			"files", "statesyncinterval", 0.05))
+		self.stateBatchDelay = float(self.__get(
+			"files", "statebatchdelay", 0.01))
+
+		#node
+		self.shards = int(self.__get(
+			"node", "shards", 0))
 
 		#escrow services
 		self.acceptedEscrowKeys = self.__get(
@@ -0,0 +1,680 @@
+#    shard.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+from collections import deque
+import multiprocessing
+import os
+import re
+import signal
+import time
+import zlib
+
+import log
+import journal
+import messages
+import nodestate
+import serializable
+
+
+
+__doc__ = """
+Sharded execution mode: the links of a node, together with their persistent
+connections, are partitioned over a number of worker processes (shards), so
+that the processing of link traffic is spread over multiple processor cores.
+
+The node process keeps everything else: payers, payees, transactions,
+time-out messages and the network. Messages for a link are passed to the
+shard of the link once the transaction that produced them is committed.
+Messages produced by a shard that are not for one of its own links are
+passed back to the node process. Calls of link methods by transactions (e.g.
+for locking and committing) are passed to the shards as Link_Call messages.
+
+Every shard stores its part of the state in its own state file and journal.
+Note that each process commits its own part of the work, so a step that
+involves multiple processes is not atomic.
+"""
+
+
+
+#Message class -> name of the attribute that contains the ID of the link or
+#connection the message is for. Only these messages are processed by shards.
+linkMessageAttributes = \
+{
+messages.Link_Deposit   : 'ID',
+messages.ChannelMessage : 'ID',
+messages.Deposit        : 'ID',
+messages.ConnectLink    : 'ID',
+messages.Link_Call      : 'ID',
+messages.OutboundMessage: 'localID',
+messages.Confirmation   : 'localID'
+}
+
+
+def getMessageTarget(msg):
+	"""
+	Return value:
+	The ID of the link or connection msg is for, or None if msg can not be
+	processed by a shard.
+	"""
+
+	attribute = linkMessageAttributes.get(msg.__class__)
+	if attribute is None:
+		return None
+	return getattr(msg, attribute)
+
+
+def getShardIndex(linkID, numShards):
+	"""
+	Return value:
+	The index (int, 0 <= index < numShards) of the shard that keeps the link
+	with the given ID. This does not change between runs.
+	"""
+
+	return (zlib.crc32(linkID) & 0xffffffff) % numShards
+
+
+def getShardFilename(stateFile, index):
+	return "%s.shard%d" % (stateFile, index)
+
+
+def findShardFiles(stateFile):
+	"""
+	Return value:
+	dictionary of index -> file name, of the shard state files that exist
+	for the given node state file.
+	"""
+
+	directory, name = os.path.split(stateFile)
+	pattern = re.compile(re.escape(name) + r'\.shard(\d+)(\.old)?$')
+
+	ret = {}
+	for f in os.listdir(directory or os.curdir):
+		match = pattern.match(f)
+		if match is not None:
+			index = int(match.group(1))
+			ret[index] = getShardFilename(stateFile, index)
+	return ret
+
+
+def removeShardFile(filename):
+	for f in [filename, filename + ".journal", filename + ".old", filename + ".new"]:
+		if os.access(f, os.F_OK):
+			os.remove(f)
+
+
+
+class ShardNetwork:
+	"""
+	Stands in for the network inside a shard process.
+	Transmitted messages are collected, so that they can be sent by the node
+	process. The state of the network interfaces is as last reported by the
+	node process.
+	"""
+
+	def __init__(self):
+		self.connected = set()
+		self.fullSendBuffers = set()
+		self.sentMessages = []
+
+
+	def setInterfaceStatus(self, localID, exists, isFull):
+		for s, value in ((self.connected, exists), (self.fullSendBuffers, isFull)):
+			if value:
+				s.add(localID)
+			else:
+				s.discard(localID)
+
+
+	def interfaceExists(self, localID):
+		return localID in self.connected
+
+
+	def isSendBufferFull(self, localID):
+		return localID in self.fullSendBuffers
+
+
+	def sendOutboundMessage(self, index, msg):
+		self.sentMessages.append((index, serializable.object2State(msg)))
+
+
+	def popSentMessages(self):
+		ret = self.sentMessages
+		self.sentMessages = []
+		return ret
+
+
+
+class ShardWorker:
+	"""
+	The part of a shard that runs inside the shard process.
+	Requests of the node process are handled by the request_* methods.
+	"""
+
+	def __init__(self, index, settings):
+		self.index = index
+		self.settings = settings
+		self.network = ShardNetwork()
+
+		self.__journal = journal.Journal(
+			getShardFilename(settings.stateFile, index),
+			syncInterval=settings.stateSyncInterval)
+
+		try:
+			state = self.__journal.load()
+			self.node = serializable.state2Object(state["Node"])
+		except IOError:
+			log.log("Starting shard %d with empty state" % index)
+			self.node = nodestate.NodeState()
+			self.__writeSnapshot()
+
+		#Local IDs of persistent connections that were changed since they
+		#were last transmitted:
+		self.__changedConnections = set(self.node.connections.keys())
+
+
+	def handleRequest(self, request):
+		return getattr(self, "request_" + request[0])(*request[1:])
+
+
+	def request_getLinks(self, numShards):
+		"""
+		Return value:
+		tuple (IDs, strayLinks):
+		IDs:        list of the IDs of all links in this shard
+		strayLinks: the links that belong to another shard (after a change of
+		            the number of shards), in the format of adoptLinks
+		"""
+
+		strayLinks = {}
+		for ID in self.node.links.keys():
+			if getShardIndex(ID, numShards) != self.index:
+				strayLinks[ID] = self.__getLinkStates(ID)
+		return self.node.links.keys(), strayLinks
+
+
+	def request_adoptLinks(self, links):
+		"""
+		Arguments:
+		links: dictionary of ID -> (link state, connection state or None).
+		       Links that are already in this shard are skipped: the copy in
+		       this shard is at least as new.
+		"""
+
+		self.node.beginTransaction()
+		try:
+			for ID, (linkState, connectionState) in links.iteritems():
+				if ID in self.node.links:
+					continue
+				self.node.markChanged('links', ID)
+				self.node.links[ID] = serializable.state2Object(linkState)
+				if connectionState is not None:
+					self.node.markChanged('connections', ID)
+					self.node.connections[ID] = \
+						serializable.state2Object(connectionState)
+			self.__saveState()
+			self.node.commitTransaction()
+		except Exception:
+			log.logException()
+			self.node.rollbackTransaction()
+			raise
+
+
+	def request_removeLinks(self, IDs):
+		self.node.beginTransaction()
+		try:
+			for ID in IDs:
+				self.node.markChanged('links', ID)
+				del self.node.links[ID]
+				if ID in self.node.connections:
+					self.node.markChanged('connections', ID)
+					del self.node.connections[ID]
+			self.__saveState()
+			self.node.commitTransaction()
+		except Exception:
+			log.logException()
+			self.node.rollbackTransaction()
+			raise
+
+
+	def request_process(self, msgStates, interfaceStatus):
+		"""
+		Processes messages, and transmits messages on changed connections.
+
+		Arguments:
+		msgStates:       states of the messages to be processed
+		interfaceStatus: dictionary of local ID -> (exists, isFull), of the
+		                 network interfaces that changed
+
+		Return value:
+		tuple (msgStates, sentMessages, closedIDs):
+		msgStates:    states of the resulting messages for the node process
+		sentMessages: list of (index, state of OutboundMessage), of the
+		              messages to be sent on the network
+		closedIDs:    local IDs of the network interfaces to be closed
+		"""
+
+		for localID, (exists, isFull) in interfaceStatus.iteritems():
+			self.network.setInterfaceStatus(localID, exists, isFull)
+			self.__changedConnections.add(localID)
+
+		msgs = [serializable.state2Object(s) for s in msgStates]
+		returnedMessages = self.__processBatch(msgs) if len(msgs) > 0 else []
+
+		closedIDs = self.__transmit()
+
+		return \
+		(
+		[serializable.object2State(msg) for msg in returnedMessages],
+		self.network.popSentMessages(),
+		closedIDs
+		)
+
+
+	def request_getState(self):
+		return serializable.object2State(self.node)
+
+
+	def request_getConnectTarget(self, ID):
+		"""
+		Return value:
+		tuple (host, port, state of connect message) of the connection with
+		the given ID.
+		"""
+
+		c = self.node.connections[ID]
+		return c.host, c.port, serializable.object2State(c.connectMessage)
+
+
+	def request_stop(self):
+		self.__journal.close()
+
+
+	def getSyncDeadline(self):
+		return self.__journal.getSyncDeadline()
+
+
+	def sync(self):
+		self.__journal.sync(force=False)
+
+
+	def __getLinkStates(self, ID):
+		connection = self.node.connections.get(ID)
+		return \
+		(
+		serializable.object2State(self.node.links[ID]),
+		None if connection is None else serializable.object2State(connection)
+		)
+
+
+	def __processBatch(self, msgs):
+		try:
+			return self.__processMessages(msgs)
+		except Exception:
+			#Don't let one bad message undo the other ones:
+			log.log("Shard %d: processing %d messages together failed; processing them one by one" % \
+				(self.index, len(msgs)))
+			returnedMessages = []
+			for msg in msgs:
+				try:
+					returnedMessages += self.__processMessages([msg])
+				except Exception:
+					log.log("Shard %d: processing message %s failed; message is ignored" % \
+						(self.index, str(msg.__class__)))
+			return returnedMessages
+
+
+	def __processMessages(self, msgs):
+		"""
+		Processes messages, together with all resulting messages for this
+		shard, in a single transaction.
+
+		Return value:
+		list of the resulting messages that are not for this shard.
+		"""
+
+		returnedMessages = []
+
+		self.node.beginTransaction()
+		try:
+			messageQueue = deque(msgs)
+			while len(messageQueue) > 0:
+				msg = messageQueue.popleft()
+				target = getMessageTarget(msg)
+				if target not in self.node.links and \
+					target not in self.node.connections:
+						returnedMessages.append(msg)
+						continue
+
+				log.log("Shard %d: processing message %s" % \
+					(self.index, str(msg.__class__)))
+				messageQueue.extend(self.node.handleMessage(msg))
+
+			self.__saveState()
+			self.node.commitTransaction()
+		except Exception:
+			log.logException()
+			self.node.rollbackTransaction()
+			raise
+
+		return returnedMessages
+
+
+	def __transmit(self):
+		"""
+		Transmits messages on the changed connections, and closes connections
+		whenever requested.
+
+		Return value:
+		list of the local IDs of the closed connections.
+		"""
+
+		changedConnections = self.__changedConnections
+		self.__changedConnections = set()
+
+		closedIDs = []
+		doSaveState = False
+		for localID in changedConnections:
+			c = self.node.connections.get(localID)
+			if c is None:
+				continue
+			#This is outside a transaction, so the connection can be marked
+			#after the change:
+			if c.transmit(self.network, self.settings.sendWindow):
+				self.node.markUpdated('connections', localID)
+				doSaveState = True
+			if c.canBeClosed():
+				log.log('Shard %d: closing persistent connection %s' % \
+					(self.index, localID))
+				self.node.markChanged('connections', localID)
+				del self.node.connections[localID]
+				closedIDs.append(localID)
+				doSaveState = True
+		if doSaveState:
+			self.__saveState()
+
+		return closedIDs
+
+
+	def __saveState(self):
+		changes = self.node.popChanges()
+		updates = self.node.popUpdates()
+
+		for attribute, key in list(changes) + updates.keys():
+			if attribute == 'connections':
+				self.__changedConnections.add(key)
+
+		if self.__journal.numRecords >= self.settings.stateJournalSize:
+			self.__writeSnapshot()
+		else:
+			self.__journal.append(nodestate.getJournalChanges(
+				self.node, ["Node"], changes, updates))
+
+
+	def __writeSnapshot(self):
+		self.__journal.writeSnapshot({"Node": serializable.object2State(self.node)})
+
+
+
+def runShard(connection, index, settings):
+	"""
+	The main function of a shard process: handles requests received on
+	connection, until the stop request.
+	"""
+
+	#Stopping is done by the node process:
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	worker = ShardWorker(index, settings)
+
+	while True:
+		timeout = None
+		deadline = worker.getSyncDeadline()
+		if deadline is not None:
+			timeout = max(0.0, deadline - time.time())
+
+		try:
+			hasRequest = connection.poll(timeout)
+			if hasRequest:
+				request = connection.recv()
+		except EOFError:
+			log.log("Shard %d: node process is gone" % index)
+			break
+
+		if hasRequest:
+			try:
+				reply = (True, worker.handleRequest(request))
+			except Exception as e:
+				log.logException()
+				reply = (False, str(e))
+			connection.send(reply)
+			if request[0] == "stop":
+				break
+
+		worker.sync()
+
+	worker.request_stop()
+	connection.close()
+
+
+
+class Shards:
+	"""
+	The shard processes of a node, as seen from the node process.
+	"""
+
+	def __init__(self, settings):
+		"""
+		Constructor.
+		Starts the shard processes, and moves links that are kept by the
+		wrong shard (after a change of the number of shards).
+
+		Arguments:
+		settings: the settings object. The number of shards is given by
+		          settings.shards.
+		"""
+
+		self.numShards = settings.shards
+
+		#IDs of the links kept by the shards:
+		self.linkIDs = set()
+
+		#Per shard: messages to be processed
+		self.__pendingMessages = [[] for i in range(self.numShards)]
+
+		#Per shard: local ID -> (exists, isFull), of the network interfaces
+		#that changed
+		self.__interfaceStatus = [{} for i in range(self.numShards)]
+
+		self.__processes = []
+		self.__connections = []
+		for index in range(self.numShards):
+			parentConnection, childConnection = multiprocessing.Pipe()
+			process = multiprocessing.Process(
+				target=runShard, args=(childConnection, index, settings))
+			process.daemon = True
+			process.start()
+			childConnection.close()
+			self.__processes.append(process)
+			self.__connections.append(parentConnection)
+
+		strayLinks = []
+		for index in range(self.numShards):
+			IDs, stray = self.__call(index, "getLinks", self.numShards)
+			self.linkIDs.update(IDs)
+			strayLinks.append(stray)
+
+		#First give the links to their new shard, and only then remove them,
+		#so they are not lost if we stop in between:
+		for index, stray in enumerate(strayLinks):
+			if len(stray) == 0:
+				continue
+			self.adoptLinks(stray)
+			self.__call(index, "removeLinks", stray.keys())
+
+
+	def stop(self):
+		for index, process in enumerate(self.__processes):
+			try:
+				self.__call(index, "stop")
+			except (EOFError, IOError):
+				pass #already stopped
+			self.__connections[index].close()
+			process.join()
+
+
+	def adoptLinks(self, links):
+		"""
+		Stores links in their shards.
+
+		Arguments:
+		links: dictionary of ID -> (link state, connection state or None)
+		"""
+
+		perShard = [{} for i in range(self.numShards)]
+		for ID, linkStates in links.iteritems():
+			perShard[getShardIndex(ID, self.numShards)][ID] = linkStates
+
+		for index, shardLinks in enumerate(perShard):
+			if len(shardLinks) > 0:
+				self.__call(index, "adoptLinks", shardLinks)
+
+		self.linkIDs.update(links.keys())
+
+
+	def isShardMessage(self, msg):
+		return getMessageTarget(msg) in self.linkIDs
+
+
+	def addMessages(self, msgs):
+		"""
+		Adds messages to be processed by the shards.
+		All messages must be accepted by isShardMessage.
+		"""
+
+		for msg in msgs:
+			index = getShardIndex(getMessageTarget(msg), self.numShards)
+			self.__pendingMessages[index].append(msg)
+
+
+	def setInterfaceStatus(self, localID, network):
+		"""
+		Passes the status of a changed network interface of a link to its
+		shard.
+		"""
+
+		exists = network.interfaceExists(localID)
+		isFull = exists and network.isSendBufferFull(localID)
+		index = getShardIndex(localID, self.numShards)
+		self.__interfaceStatus[index][localID] = (exists, isFull)
+
+
+	def hasPendingWork(self):
+		return \
+			any(len(x) > 0 for x in self.__pendingMessages) or \
+			any(len(x) > 0 for x in self.__interfaceStatus)
+
+
+	def process(self, network):
+		"""
+		Lets the shards process their pending messages and network interface
+		changes, and sends the messages they transmit on the network.
+		The shards work in parallel.
+
+		Arguments:
+		network: the network object
+
+		Return value:
+		list of the messages returned by the shards, which are to be
+		processed by the node process.
+		"""
+
+		indices = [i for i in range(self.numShards)
+			if len(self.__pendingMessages[i]) > 0 or len(self.__interfaceStatus[i]) > 0]
+
+		for index in indices:
+			msgStates = [serializable.object2State(msg)
+				for msg in self.__pendingMessages[index]]
+			self.__connections[index].send(
+				("process", msgStates, self.__interfaceStatus[index]))
+			self.__pendingMessages[index] = []
+			self.__interfaceStatus[index] = {}
+
+		ret = []
+		for index in indices:
+			msgStates, sentMessages, closedIDs = self.__receive(index)
+
+			ret += [serializable.state2Object(s) for s in msgStates]
+
+			for messageIndex, msgState in sentMessages:
+				msg = serializable.state2Object(msgState)
+				if not network.interfaceExists(msg.localID):
+					#Disconnected in the mean time; the shard hears about it
+					#through setInterfaceStatus, and transmits again later.
+					continue
+				network.sendOutboundMessage(messageIndex, msg)
+				if network.isSendBufferFull(msg.localID):
+					self.__interfaceStatus[index][msg.localID] = (True, True)
+
+			for localID in closedIDs:
+				network.closeInterface(localID)
+
+		return ret
+
+
+	def getStates(self):
+		"""
+		Return value:
+		list of the NodeState states of all shards.
+		"""
+
+		return [self.__call(index, "getState") for index in range(self.numShards)]
+
+
+	def getConnectTarget(self, ID):
+		"""
+		Return value:
+		tuple (host, port, connectMessage) of the connection of the link with
+		the given ID.
+		"""
+
+		host, port, connectMessage = self.__call(
+			getShardIndex(ID, self.numShards), "getConnectTarget", ID)
+		return host, port, serializable.state2Object(connectMessage)
+
+
+	def __call(self, index, *request):
+		self.__connections[index].send(request)
+		return self.__receive(index)
+
+
+	def __receive(self, index):
+		success, value = self.__connections[index].recv()
+		if not success:
+			raise Exception("Request failed in shard %d: %s" % (index, value))
+		return value
+
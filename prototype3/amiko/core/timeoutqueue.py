@@ -0,0 +1,266 @@
+#    timeoutqueue.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+
+import heapq
+
+
+
+class TimeoutQueue:
+	"""
+	The time-out messages of a node, ordered by their time stamp.
+
+	Adding and cancelling a message takes O(log n) time. Every message is
+	stored under a key that is unique within the queue; this key is the
+	handle for cancelling the message, and the state of the queue is a
+	dictionary of key -> TimeoutMessage.
+	"""
+
+	def __init__(self, timeoutMessages={}):
+		"""
+		Constructor.
+
+		Arguments:
+		timeoutMessages: dictionary of key -> TimeoutMessage, as returned by
+		                 getMessages. For compatibility with old state
+		                 files, a list of TimeoutMessage objects is also
+		                 accepted.
+		"""
+
+		if type(timeoutMessages) == list:
+			timeoutMessages = \
+				{str(i): msg for i, msg in enumerate(timeoutMessages)}
+
+		#Heap of (timestamp, sequence number, message) entries.
+		#Cancelled entries are removed lazily.
+		self.__heap = []
+
+		#key -> entry, for all not-cancelled entries:
+		self.__entries = {}
+
+		#ID -> set of keys:
+		self.__IDs = {}
+
+		self.__nextSequenceNumber = 0
+		for key, msg in timeoutMessages.iteritems():
+			self.__nextSequenceNumber = max(self.__nextSequenceNumber, int(key)+1)
+			self.__insert((msg.timestamp, int(key), msg))
+
+		self.__changes = set()
+		self.__undoLog = None
+
+
+	def __len__(self):
+		return len(self.__entries)
+
+
+	def add(self, msg):
+		"""
+		Adds a time-out message.
+
+		Arguments:
+		msg: TimeoutMessage
+
+		Return value:
+		str; the key of the message, which can be passed to cancel.
+		"""
+
+		sequenceNumber = self.__nextSequenceNumber
+		self.__nextSequenceNumber += 1
+		key = str(sequenceNumber)
+
+		self.__markChanged(key)
+		self.__insert((msg.timestamp, sequenceNumber, msg))
+		return key
+
+
+	def cancel(self, key):
+		"""
+		Cancels a time-out message. Cancelling a message that was already
+		cancelled or popped is allowed, and has no effect.
+
+		Arguments:
+		key: the key, as returned by add
+		"""
+
+		entry = self.__entries.get(key)
+		if entry is None:
+			return
+
+		self.__markChanged(key)
+		self.__remove(key, entry)
+
+		#Don't let cancelled entries dominate the heap:
+		if len(self.__heap) > 2 * len(self.__entries) + 64:
+			self.__heap = self.__entries.values()
+			heapq.heapify(self.__heap)
+
+
+	def cancelID(self, ID):
+		"""
+		Cancels all time-out messages with the given ID.
+
+		Arguments:
+		ID: the ID attribute of the messages to be cancelled
+		"""
+
+		for key in list(self.__IDs.get(ID, ())):
+			self.cancel(key)
+
+
+	def getNextTimestamp(self):
+		"""
+		Return value:
+		The time stamp (float) of the first time-out message, or None if the
+		queue is empty.
+		"""
+
+		heap = self.__heap
+		while len(heap) > 0:
+			entry = heap[0]
+			if self.__entries.get(str(entry[1])) is entry:
+				return entry[0]
+			heapq.heappop(heap) #cancelled
+
+		return None
+
+
+	def popDue(self, now):
+		"""
+		Removes the first time-out message, if it is due.
+
+		Arguments:
+		now: the current time (float, as in time.time())
+
+		Return value:
+		The first TimeoutMessage if its time stamp is earlier than now;
+		None otherwise.
+		"""
+
+		timestamp = self.getNextTimestamp()
+		if timestamp is None or timestamp >= now:
+			return None
+
+		entry = heapq.heappop(self.__heap)
+		key = str(entry[1])
+		self.__markChanged(key)
+		self.__remove(key, entry)
+		return entry[2]
+
+
+	def getMessage(self, key):
+		"""
+		Return value:
+		The TimeoutMessage with the given key, or None if there is none.
+		"""
+
+		entry = self.__entries.get(key)
+		if entry is None:
+			return None
+		return entry[2]
+
+
+	def getMessages(self):
+		"""
+		Return value:
+		dictionary of key -> TimeoutMessage, containing all messages.
+		"""
+
+		return {key: entry[2] for key, entry in self.__entries.iteritems()}
+
+
+	def beginTransaction(self):
+		"""
+		Starts a transaction: from now on, changes are recorded, so that they
+		can be undone with rollbackTransaction.
+		"""
+		self.__undoLog = {}
+
+
+	def commitTransaction(self):
+		"""
+		Ends a transaction, keeping all changes.
+		"""
+		self.__undoLog = None
+
+
+	def rollbackTransaction(self):
+		"""
+		Ends a transaction, undoing all changes made since beginTransaction.
+		"""
+		undoLog = self.__undoLog
+		self.__undoLog = None
+
+		for key, oldEntry in undoLog.iteritems():
+			entry = self.__entries.get(key)
+			if entry is not None:
+				self.__remove(key, entry)
+			if oldEntry is not None:
+				self.__insert(oldEntry)
+
+
+	def popChanges(self):
+		"""
+		Return value:
+		set of keys of the messages that were added or removed since the
+		previous call of this method.
+		"""
+		ret = self.__changes
+		self.__changes = set()
+		return ret
+
+
+	def __markChanged(self, key):
+		self.__changes.add(key)
+		if self.__undoLog is not None and key not in self.__undoLog:
+			self.__undoLog[key] = self.__entries.get(key)
+
+
+	def __insert(self, entry):
+		key = str(entry[1])
+		self.__entries[key] = entry
+		ID = entry[2].ID
+		if ID is not None:
+			self.__IDs.setdefault(ID, set()).add(key)
+		heapq.heappush(self.__heap, entry)
+
+
+	def __remove(self, key, entry):
+		"""
+		Removes an entry from the administration; removal from the heap is
+		left to the caller, or is done lazily.
+		"""
+
+		del self.__entries[key]
+		ID = entry[2].ID
+		if ID is not None:
+			keys = self.__IDs[ID]
+			keys.discard(key)
+			if len(keys) == 0:
+				del self.__IDs[ID]
+
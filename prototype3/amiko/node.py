@@ -29,10 +29,13 @@
 
 import threading
 from urlparse import urlparse
-import os
+import copy
 import time
+import Queue
+from collections import deque
 
 from core import log
+from core import journal
 from core import network
 from core import nodestate
 from core import payerlink
@@ -41,6 +44,8 @@ from core import messages
 from core import paylog
 from core import serializable
 from core import settings
+from core import shard
+from core import timeoutqueue
 
 
 
@@ -55,6 +60,55 @@ lastCopyrightYear = "2015"
 
 
 
+class Command:
+	"""
+	A method call, to be run inside the internal thread of a Node object.
+	The calling thread can wait for the result with getResult.
+
+	Intended for internal use by Node.
+	Not intended to be part of the API.
+	"""
+
+	def __init__(self, function, args, kwargs):
+		self.function = function
+		self.args = args
+		self.kwargs = kwargs
+
+		self.__returnValue = None
+		self.__exception = None
+		self.__finished = threading.Event()
+
+
+	def run(self, node):
+		try:
+			self.__returnValue = self.function(node, *self.args, **self.kwargs)
+		except Exception as e:
+			self.__exception = e
+			log.logException()
+		self.__finished.set()
+
+
+	def fail(self, exception):
+		self.__exception = exception
+		self.__finished.set()
+
+
+	def getResult(self):
+		"""
+		Waits until the command is finished.
+
+		Return value:
+		The return value of the command.
+		Exceptions raised by the command are re-raised.
+		"""
+
+		self.__finished.wait()
+		if self.__exception is not None:
+			raise self.__exception
+		return self.__returnValue
+
+
+
 def runInNodeThread(implementationFunc):
 	"""
 	Function decorator, which can be used by Node methods to have them
@@ -66,14 +120,10 @@ def runInNodeThread(implementationFunc):
 	"""
 
 	def remoteCaller(self, *args, **kwargs):
-		with self._commandFunctionLock:
-			self._commandFunction = (implementationFunc, args, kwargs)
-			self._commandProcessed.clear()
-		self._commandProcessed.wait()
-
-		if isinstance(self._commandReturnValue, Exception):
-			raise self._commandReturnValue
-		return self._commandReturnValue
+		command = Command(implementationFunc, args, kwargs)
+		self._commandQueue.put(command)
+		self._wakeUp()
+		return command.getResult()
 
 	remoteCaller.__doc__ = implementationFunc.__doc__
 
@@ -81,6 +131,39 @@ def runInNodeThread(implementationFunc):
 
 
 
+class Payment:
+	"""
+	An outgoing payment, as returned by Node.pay.
+
+	Attributes:
+	ID     : The ID of the payer link of this payment
+	amount : The amount (integer, in Satoshi) to be paid
+	receipt: A receipt for the payment
+	payer  : The PayerLink object of this payment
+	"""
+
+	def __init__(self, node, payer):
+		self.__node = node
+		self.payer = payer
+		self.ID = payer.ID
+		self.amount = payer.amount
+		self.receipt = payer.receipt
+
+
+	def confirm(self, payerAgrees):
+		"""
+		Finish or cancel paying this payment.
+
+		Arguments:
+		payerAgrees: Boolean, indicating whether or not the user agrees to pay
+
+		Return value:
+		str, indicating the final payment state
+		"""
+		return self.__node.confirmPayment(self, payerAgrees)
+
+
+
 class Node(threading.Thread):
 	"""
 	A single Amiko node.
@@ -111,23 +194,52 @@ class Node(threading.Thread):
 		else:
 			self.settings = settings.Settings(conf)
 
-		self.__network = network.Network(
-			self.settings.listenHost, self.settings.listenPort, callback=self)
-
 		#self.bitcoind = bitcoind.Bitcoind(self.settings)
 
 		self.payLog = paylog.PayLog(self.settings)
 
 		self.__stop = False
 
-		self._commandFunctionLock = threading.Lock()
-		self._commandFunction = None
-		self._commandProcessed = threading.Event()
-		self._commandReturnValue = None
+		#Commands from API threads (of type Command):
+		self._commandQueue = Queue.Queue()
+
+		#Messages received from the network in the current network tick, or
+		#None outside network ticks:
+		self.__receivedMessages = None
+		self.__receivedMessagesSince = None
+
+		#Local IDs of persistent connections that were changed since they
+		#were last transmitted, so transmission may be possible now:
+		self.__changedConnections = set()
 
+		self.__journal = journal.Journal(
+			self.settings.stateFile, syncInterval=self.settings.stateSyncInterval)
 		self.__loadState()
+		self.__mergeShardFiles()
 
-		for ID in self.__node.connections.keys():
+		#Sharded execution mode (see shard.py).
+		#The shard processes are started before the network is made, so
+		#they don't inherit its sockets.
+		self.__shards = None
+		if self.settings.shards > 0:
+			self.__shards = shard.Shards(self.settings)
+			self.__node.shardLinkIDs = self.__shards.linkIDs
+			self.__handOverLinks()
+
+		self.__network = network.Network(
+			self.settings.listenHost, self.settings.listenPort, callback=self,
+			binaryFormat=(self.settings.wireFormat == "binary"),
+			maxMessageSize=self.settings.maxMessageSize,
+			ackCount=self.settings.ackCount,
+			ackDelay=self.settings.ackDelay,
+			maxSendBuffer=self.settings.maxSendBuffer)
+
+		self.__changedConnections.update(self.__node.connections.keys())
+
+		connectionIDs = self.__node.connections.keys()
+		if self.__shards is not None:
+			connectionIDs += list(self.__shards.linkIDs)
+		for ID in connectionIDs:
 			try:
 				self.makeConnection(ID)
 			except network.ConnectFailed as e:
@@ -135,21 +247,16 @@ class Node(threading.Thread):
 
 
 	def __loadState(self):
-
-		oldFile = self.settings.stateFile + ".old"
-		if os.access(oldFile, os.F_OK):
-			if os.access(self.settings.stateFile, os.F_OK):
-				#Remove old file if normal state file exists:
-				os.remove(oldFile)
-			else:
-				#Use old file if state file does not exist:
-				os.rename(oldFile, self.settings.stateFile)
-
 		try:
-			with open(self.settings.stateFile, 'rb') as fp:
-				stateData = fp.read()
+			state = self.__journal.load()
+			isOldFormat = type(state["TimeoutMessages"]) == list
+			hadPayerLink = nodestate.convertOldPayerLink(
+				state["Node"], state["TimeoutMessages"])
+			self.setState(state)
 
-			self.setState(serializable.deserializeState(stateData))
+			if isOldFormat or hadPayerLink:
+				#Old state format: replace it, so that the journal can be used
+				self.__writeSnapshot()
 
 		except IOError:
 			log.log("Failed to load from %s" % self.settings.stateFile)
@@ -157,79 +264,214 @@ class Node(threading.Thread):
 
 			#Create a new, empty state:
 			self.__node = nodestate.NodeState()
-			self.__timeoutMessages = []
+			self.__timeoutMessages = timeoutqueue.TimeoutQueue()
 
 			#Store the newly created state
+			self.__writeSnapshot()
+
+
+	def __mergeShardFiles(self):
+		"""
+		Takes over the links of shard state files that are no longer used,
+		because the number of shards was decreased (possibly to zero).
+		"""
+
+		shardFiles = shard.findShardFiles(self.settings.stateFile)
+		for index, filename in sorted(shardFiles.iteritems()):
+			if index < self.settings.shards:
+				continue
+
+			log.log("Taking over the links of " + filename)
+			shardState = journal.Journal(filename).load()
+			shardState = serializable.state2Object(shardState["Node"])
+
+			self.__node.beginTransaction()
+			try:
+				for ID, link in shardState.links.iteritems():
+					if ID in self.__node.links:
+						continue #already taken over
+					self.__node.markChanged('links', ID)
+					self.__node.links[ID] = link
+					if ID in shardState.connections:
+						self.__node.markChanged('connections', ID)
+						self.__node.connections[ID] = shardState.connections[ID]
+				self.__saveState()
+				self.__node.commitTransaction()
+			except Exception:
+				log.logException()
+				self.__node.rollbackTransaction()
+				raise
+
+			shard.removeShardFile(filename)
+
+
+	def __handOverLinks(self):
+		"""
+		Moves the links in the node state, together with their connections,
+		to the shards.
+		"""
+
+		if len(self.__node.links) == 0:
+			return
+
+		links = {}
+		for ID, link in self.__node.links.iteritems():
+			connection = self.__node.connections.get(ID)
+			links[ID] = \
+			(
+			serializable.object2State(link),
+			None if connection is None else serializable.object2State(connection)
+			)
+
+		#First store them in the shards, and only then remove them here,
+		#so they are not lost if we stop in between:
+		self.__shards.adoptLinks(links)
+
+		self.__node.beginTransaction()
+		try:
+			for ID in links.keys():
+				self.__node.markChanged('links', ID)
+				del self.__node.links[ID]
+				if ID in self.__node.connections:
+					self.__node.markChanged('connections', ID)
+					del self.__node.connections[ID]
 			self.__saveState()
+			self.__node.commitTransaction()
+		except Exception:
+			log.logException()
+			self.__node.rollbackTransaction()
+			raise
+
+
+	def __runShards(self):
+		"""
+		Lets the shards process pending messages and network interface
+		changes, and processes the messages they return, until there is
+		nothing left to do.
+		"""
+
+		if self.__shards is None:
+			return
+
+		self.__handOverLinks()
+
+		while self.__shards.hasPendingWork():
+			returnedMessages = self.__shards.process(self.__network)
+			if len(returnedMessages) > 0:
+				self.__processBatch(returnedMessages)
 
 
 	def __saveState(self):
-		stateData = serializable.serializeState(self.getState())
+		"""
+		Stores the changes made since the previous call.
+		The state file is only re-written completely once the journal of
+		changes has grown large enough; otherwise, only the changed parts of
+		the state are appended to the journal.
+		"""
 
-		newFile = self.settings.stateFile + ".new"
-		log.log("Saving in " + newFile)
-		with open(newFile, 'wb') as fp:
-			fp.write(stateData)
+		nodeChanges, nodeUpdates = self.__popNodeChanges()
+		changes = nodestate.getJournalChanges(
+			self.__node, ["Node"], nodeChanges, nodeUpdates)
 
-		oldFile = self.settings.stateFile + ".old"
+		for key in self.__timeoutMessages.popChanges():
+			path = ["TimeoutMessages", key]
+			msg = self.__timeoutMessages.getMessage(key)
+			if msg is None:
+				changes.append((path,)) #removed
+			else:
+				changes.append((path, serializable.object2State(msg)))
 
-		#Replace old data with new data
-		try:
-			os.rename(self.settings.stateFile, oldFile)
-		except OSError:
-			log.log("Got OSError on renaming old state file; probably it didn't exist yet, which is OK in a fresh installation.")
-		os.rename(newFile, self.settings.stateFile)
-		try:
-			os.remove(oldFile)
-		except OSError:
-			log.log("Got OSError on removing old state file; probably it didn't exist, which is OK in a fresh installation.")
+		if self.__journal.numRecords >= self.settings.stateJournalSize:
+			self.__writeSnapshot()
+		else:
+			self.__journal.append(changes)
+
+
+	def __writeSnapshot(self):
+		#These are included in the snapshot:
+		self.__popNodeChanges()
+		self.__timeoutMessages.popChanges()
+		self.__journal.writeSnapshot(self.__getOwnState())
+
+
+	def __popNodeChanges(self):
+		"""
+		Pops the changes of the node state, and remembers which persistent
+		connections were changed.
+
+		Return value:
+		tuple (changes, updates), as returned by the popChanges and
+		popUpdates methods of the node state.
+		"""
+
+		changes = self.__node.popChanges()
+		updates = self.__node.popUpdates()
+		for attribute, key in changes:
+			if attribute == 'connections':
+				if key is None:
+					self.__changedConnections.update(self.__node.connections.keys())
+				else:
+					self.__changedConnections.add(key)
+		for attribute, key in updates.iterkeys():
+			if attribute == 'connections':
+				self.__changedConnections.add(key)
+		return changes, updates
 
 
 	def getState(self):
+		"""
+		Return value:
+		The state of the node, including the links kept by shards.
+		"""
+
+		state = self.__getOwnState()
+		if self.__shards is not None:
+			for shardState in self.__shards.getStates():
+				state["Node"]["links"].update(shardState["links"])
+				state["Node"]["connections"].update(shardState["connections"])
+		return state
+
+
+	def __getOwnState(self):
 		return serializable.object2State(
 			{
 			"Node": self.__node,
-			"TimeoutMessages": self.__timeoutMessages
+			"TimeoutMessages": self.__timeoutMessages.getMessages()
 			})
 
 
 	def setState(self, s):
 		s = serializable.state2Object(s)
 		self.__node            = s["Node"]
-		self.__timeoutMessages = s["TimeoutMessages"]
-
-
-	def __addTimeoutMessage(self, msg):
-		"""
-		Note: you should call __saveState afterwards!
-		"""
-
-		self.__timeoutMessages.append(msg)
-		self.__timeoutMessages.sort(
-			cmp = lambda a, b: int(a.timestamp - b.timestamp)
-			)
+		self.__timeoutMessages = timeoutqueue.TimeoutQueue(s["TimeoutMessages"])
 
 
 	def __cleanupState(self):
 		"""
 		Note: you should call __saveState afterwards!
+
+		Return value:
+		tuple (payers, payees), containing lists of the removed payer and
+		payee links. Their payment log entries should only be written once
+		the removal is committed.
 		"""
 
-		#Remove finished payer and related objects:
-		if not (self.__node.payerLink is None) and \
-			self.__node.payerLink.state in [payerlink.PayerLink.states.cancelled, payerlink.PayerLink.states.committed]:
-				log.log('Cleaning up payer')
-				if not (self.__node.payerLink.amount is None):
-					self.payLog.writePayer(self.__node.payerLink)
-				transactionID = self.__node.payerLink.transactionID
-				self.__node.payerLink = None
-				self.__node.connections[messages.payerLocalID].close()
-				self.__timeoutMessages = \
-				[
-					msg
-					for msg in self.__timeoutMessages
-					if msg.message.__class__ != messages.Timeout
-				]
+		removedPayers = []
+		removedPayees = []
+
+		#Remove finished payers and related objects:
+		payerIDs = self.__node.payerLinks.keys()
+		for payerID in payerIDs:
+			payer = self.__node.payerLinks[payerID]
+			if payer.state in [payerlink.PayerLink.states.cancelled, payerlink.PayerLink.states.committed]:
+				log.log('Cleaning up payer ' + payerID)
+				removedPayers.append(payer)
+				transactionID = payer.transactionID
+				self.__node.markChanged('payerLinks', payerID)
+				del self.__node.payerLinks[payerID]
+				self.__node.markUpdated('connections', payerID)
+				self.__node.connections[payerID].close()
+				self.__timeoutMessages.cancelID(payerID)
 
 		#Remove finished payee and related objects:
 		payeeIDs = self.__node.payeeLinks.keys()
@@ -237,22 +479,105 @@ class Node(threading.Thread):
 			payee = self.__node.payeeLinks[payeeID]
 			if payee.state in [payeelink.PayeeLink.states.cancelled, payeelink.PayeeLink.states.committed]:
 				log.log('Cleaning up payee ' + payeeID)
-				self.payLog.writePayee(payee)
+				removedPayees.append(payee)
 				transactionID = payee.transactionID
+				self.__node.markChanged('payeeLinks', payeeID)
 				del self.__node.payeeLinks[payeeID]
+				self.__node.markUpdated('connections', payeeID)
 				self.__node.connections[payeeID].close()
 
+		return removedPayers, removedPayees
+
 
 	def handleMessage(self, msg):
+		"""
+		Processes a message, and stores the resulting state changes.
+
+		Messages received from the network during a network tick are not
+		processed immediately: they are processed together, in a single
+		transaction, at the end of the tick, or once the oldest of them has
+		waited settings.stateBatchDelay seconds.
+
+		Arguments:
+		msg: the message
+
+		Return value:
+		The value of the ReturnValue message resulting from msg, if any
+		"""
+
+		if not (self.__receivedMessages is None):
+			if len(self.__receivedMessages) == 0:
+				self.__receivedMessagesSince = time.time()
+			self.__receivedMessages.append(msg)
+			if time.time() - self.__receivedMessagesSince >= self.settings.stateBatchDelay:
+				self.__processReceivedMessages()
+			return None
+
+		return self.__processMessages([msg])
+
+
+	def __processReceivedMessages(self):
+		batch = self.__receivedMessages
+		if len(batch) == 0:
+			return
+		self.__receivedMessages = deque()
+
+		self.__processBatch(batch)
+
+
+	def __processBatch(self, batch):
+		try:
+			self.__processMessages(batch)
+		except Exception:
+			#Don't let one bad message undo the other ones.
+			#The failed attempt was rolled back completely, so each message
+			#is processed exactly once:
+			log.log("Processing %d messages together failed; processing them one by one" % \
+				len(batch))
+			for msg in batch:
+				try:
+					self.__processMessages([msg])
+				except Exception:
+					log.log("Processing message %s failed; message is ignored" % \
+						str(msg.__class__))
+
+
+	def __processMessages(self, msgs):
+		"""
+		Processes messages, together with all messages that result from them,
+		in a single transaction.
+		Cleanup and storing of the state is done once, at the end.
+
+		Arguments:
+		msgs: iterable of messages
+
+		Return value:
+		The value of the ReturnValue message resulting from msgs, if any
+		"""
+
 		returnValue = None
 
-		oldState = self.getState()
+		#Messages for the shards:
+		shardMessages = []
+
+		self.__node.beginTransaction()
+		self.__timeoutMessages.beginTransaction()
 		try:
 
-			messageQueue = [msg]
+			messageQueue = deque(msgs)
 			while len(messageQueue) > 0:
-				msg = messageQueue.pop(0)
-				newMessages = []
+				msg = messageQueue.popleft()
+
+				#Put messages in the right places.
+				#Time-out messages may also be returned by shards, so
+				#they are not only handled when they are produced here.
+				if msg.__class__ == messages.TimeoutMessage:
+					#Add to the time-out messages:
+					self.__timeoutMessages.add(msg)
+					continue
+				elif msg.__class__ == messages.CancelTimeoutMessages:
+					self.__timeoutMessages.cancelID(msg.ID)
+					continue
 
 				log.log("Processing message %s" % str(msg.__class__))
 
@@ -262,42 +587,57 @@ class Node(threading.Thread):
 					#Otherwise, some return values will be forgotten.
 					returnValue = msg.value
 
-				else:
-					#All other messages go to the node:
-					newMessages = self.__node.handleMessage(msg)
+				elif self.__shards is not None and self.__shards.isShardMessage(msg):
+					#Processed by the shard of the link, once this is
+					#committed:
+					shardMessages.append(msg)
 
-				#Put new messages in the right places:
-				for msg in newMessages:
-					if msg.__class__ == messages.TimeoutMessage:
-						#Add to the list of time-out messages:
-						self.__addTimeoutMessage(msg)
-					else:
-						#Process in another iteration of the loop we're in:
-						messageQueue.append(msg)
+				else:
+					#All other messages go to the node.
+					#New messages are processed in another iteration of the
+					#loop we're in:
+					messageQueue.extend(self.__node.handleMessage(msg))
 
-			self.__cleanupState()
+			removedPayers, removedPayees = self.__cleanupState()
 
 			self.__saveState()
-		except Exception as e:
+			self.__node.commitTransaction()
+			self.__timeoutMessages.commitTransaction()
+		except Exception:
 			log.logException()
 			#In case of exception, recover the old state:
-			self.setState(oldState)
+			self.__node.rollbackTransaction()
+			self.__timeoutMessages.rollbackTransaction()
 			raise
 
+		if len(shardMessages) > 0:
+			self.__shards.addMessages(shardMessages)
+
+		#Only log payments whose removal was committed:
+		for payer in removedPayers:
+			if not (payer.amount is None):
+				self.payLog.writePayer(payer)
+		for payee in removedPayees:
+			self.payLog.writePayee(payee)
+
 		return returnValue
 
 
 	def makeConnection(self, ID):
-		persistentConn = self.__node.connections[ID]
+		if self.__shards is not None and ID in self.__shards.linkIDs:
+			host, port, connectMessage = self.__shards.getConnectTarget(ID)
+		else:
+			persistentConn = self.__node.connections[ID]
+			host, port, connectMessage = \
+				persistentConn.host, persistentConn.port, persistentConn.connectMessage
 
-		if None in (persistentConn.host, persistentConn.port, persistentConn.connectMessage):
+		if None in (host, port, connectMessage):
 			log.log(
 				'Not enough information for creating connection %s; skipping' % \
 				ID)
 			return
 
-		self.__network.makeConnection(
-			(persistentConn.host, persistentConn.port), ID, persistentConn.connectMessage)
+		self.__network.makeConnection((host, port), ID, connectMessage)
 
 
 	def stop(self):
@@ -308,9 +648,22 @@ class Node(threading.Thread):
 		"""
 
 		self.__stop = True
+		self._wakeUp()
 		self.join()
 
 
+	def _wakeUp(self):
+		"""
+		Makes the Node thread stop waiting, so it handles API events.
+		May be called from any thread.
+
+		Intended for internal use by Node.
+		Not intended to be part of the API.
+		"""
+
+		self.__network.wakeUp()
+
+
 	@runInNodeThread
 	def request(self, amount, receipt):
 		"""
@@ -334,6 +687,7 @@ class Node(threading.Thread):
 	def pay(self, URL, linkname=None):
 		"""
 		Start paying a payment.
+		Multiple payments can be in progress at the same time.
 
 		Arguments:
 		URL     : The URL of the payment request
@@ -341,20 +695,19 @@ class Node(threading.Thread):
 		          link with the given name.
 
 		Return value:
-		A tuple, containing:
+		A Payment object, containing:
 			amount : The amount (integer, in Satoshi) to be paid
 			receipt: A receipt for the payment
 		"""
 
-		self.__pay(URL, linkname) #implemented in Node thread
-		payer = self.__node.payerLink
+		payer = self.__pay(URL, linkname) #implemented in Node thread
 
 		payer.waitForReceipt() #Must be done in this thread
 
 		if payer.amount is None or payer.receipt is None:
 			raise Exception("Connecting to payee failed")
 
-		return payer.amount, payer.receipt
+		return Payment(self, payer)
 
 
 	@runInNodeThread
@@ -366,36 +719,39 @@ class Node(threading.Thread):
 		port = settings.defaultPort if URL.port == None else URL.port
 		payeeLinkID = URL.path[1:] #remove initial slash
 
-		self.handleMessage(messages.MakePayer(
+		payerID = self.handleMessage(messages.MakePayer(
 			host=host, port=port, payeeLinkID=payeeLinkID
 			))
 
-		self.makeConnection(messages.payerLocalID)
+		self.makeConnection(payerID)
+
+		return self.__node.payerLinks[payerID]
 
 
-	def confirmPayment(self, payerAgrees):
+	def confirmPayment(self, payment, payerAgrees):
 		"""
 		Finish or cancel paying a payment.
 
 		Arguments:
+		payment    : Payment object, as returned by pay
 		payerAgrees: Boolean, indicating whether or not the user agrees to pay
 
 		Return value:
 		str, indicating the final payment state
 		"""
-		self.__confirmPayment(payerAgrees) #implemented in Node thread
-		payer = self.__node.payerLink
+		self.__confirmPayment(payment.ID, payerAgrees) #implemented in Node thread
 
 		if payerAgrees:
-			payer.waitForFinished() #Must be done in this thread
-			return payer.state
+			payment.payer.waitForFinished() #Must be done in this thread
+			return payment.payer.state
 
 		return "cancelled by payer"
 
 
 	@runInNodeThread
-	def __confirmPayment(self, payerAgrees):
-		self.handleMessage(messages.PayerLink_Confirm(agreement=payerAgrees))
+	def __confirmPayment(self, payerID, payerAgrees):
+		self.handleMessage(messages.PayerLink_Confirm(
+			ID=payerID, agreement=payerAgrees))
 
 
 	@runInNodeThread
@@ -459,6 +815,9 @@ class Node(threading.Thread):
 		channel: a new channel object, to be added to the link for the deposit
 		"""
 
+		#Messages take ownership of their contents, so make our own copy:
+		channel = copy.deepcopy(channel)
+
 		self.handleMessage(messages.Link_Deposit(ID=linkname, channel=channel))
 
 
@@ -489,44 +848,109 @@ class Node(threading.Thread):
 
 		self.__stop = False
 		while True:
-			self.__network.processNetworkEvents(timeout=0.01)
+			#Network events; received messages are processed together:
+			self.__receivedMessages = deque()
+			try:
+				self.__network.processNetworkEvents(timeout=self.__getWaitTime())
+				self.__processReceivedMessages()
+			finally:
+				self.__receivedMessages = None
 
 			#API events:
-			with self._commandFunctionLock:
-				s = self._commandFunction
-				if s != None:
-					try:
-						self._commandReturnValue = s[0](self, *s[1], **s[2])
-					except Exception as e:
-						self._commandReturnValue = e
-						log.logException()
-					self._commandProcessed.set()
-					self._commandFunction = None
+			while True:
+				try:
+					command = self._commandQueue.get_nowait()
+				except Queue.Empty:
+					break
+				command.run(self)
 
 			#Time-out events:
-			while len(self.__timeoutMessages) > 0 and self.__timeoutMessages[0].timestamp < time.time():
-				msg = self.__timeoutMessages.pop(0)
+			while True:
+				msg = self.__timeoutMessages.popDue(time.time())
+				if msg is None:
+					break
 				self.handleMessage(msg.message)
 
-			#Connections: data transmission and closing
+			#Connections: data transmission and closing.
+			#Only connections whose state or network interface changed can
+			#have anything new to do, so skip the others:
+			changedConnections = \
+				self.__changedConnections | self.__network.popChangedInterfaces()
+			self.__changedConnections = set()
 			doSaveState = False
-			for localID, c in self.__node.connections.copy().iteritems():
-				#New attempt to send the outbox:
-				if c.transmit(self.__network):
+			for localID in changedConnections:
+				if self.__shards is not None and localID in self.__shards.linkIDs:
+					#Transmission is done by the shard of the link:
+					self.__shards.setInterfaceStatus(localID, self.__network)
+					continue
+				c = self.__node.connections.get(localID)
+				if c is None:
+					continue
+				#New attempt to send the outbox.
+				#This is outside a transaction, so the connection can be
+				#marked after the change:
+				if c.transmit(self.__network, self.settings.sendWindow):
+					self.__node.markUpdated('connections', localID)
 					doSaveState = True
 				#Close interface whenever requested:
 				if c.canBeClosed():
 					log.log('Closing persistent connection ' + localID)
+					self.__node.markChanged('connections', localID)
 					del self.__node.connections[localID]
 					self.__network.closeInterface(localID)
 					doSaveState = True
 			if doSaveState:
 				self.__saveState()
 
+			#Sharded execution mode: links are processed by the shards:
+			self.__runShards()
+
+			#Flush journal data that has waited long enough:
+			self.__journal.sync(force=False)
+
 			if self.__stop:
 				#TODO: stop creation of new transactions
 				#TODO: only break once there are no more open transactions
 				break
 
+		self.__network.close()
+		self.__journal.close()
+		if self.__shards is not None:
+			self.__shards.stop()
+
+		#Don't let API threads wait forever:
+		while True:
+			try:
+				command = self._commandQueue.get_nowait()
+			except Queue.Empty:
+				break
+			command.fail(Exception("The node is stopped"))
+
 		log.log("Node thread terminated\n\n")
 
+
+	def __getWaitTime(self):
+		"""
+		Return value:
+		The time (float, in seconds) until the next time-out message, journal
+		flush or delayed network confirmation, or None if there is nothing
+		scheduled.
+		"""
+
+		deadlines = [
+			self.__journal.getSyncDeadline(),
+			self.__timeoutMessages.getNextTimestamp(),
+			self.__network.getNextDeadline()
+			]
+		deadlines = [t for t in deadlines if t is not None]
+
+		#Messages returned by the shards may have changed connections that
+		#were already handled in this iteration:
+		if self.__shards is not None and len(self.__changedConnections) > 0:
+			return 0.0
+
+		if len(deadlines) == 0:
+			return None #API events and network events will wake us up
+
+		return max(0.0, min(deadlines) - time.time())
+
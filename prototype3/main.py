@@ -150,16 +150,16 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 		URL = cmd[1]
 		if len(cmd) < 3:
-			amount, receipt = a.pay(URL)
+			payment = a.pay(URL)
 		else:
 			linkname = cmd[2]
-			amount, receipt = a.pay(URL, linkname)
+			payment = a.pay(URL, linkname)
 
-		print "Receipt: ", repr(receipt)
-		print "Amount: ", amount
+		print "Receipt: ", repr(payment.receipt)
+		print "Amount: ", payment.amount
 		answer = raw_input("Do you want to pay (y/n)? ")
 		OK = answer.lower() == 'y'
-		state = a.confirmPayment(OK)
+		state = payment.confirm(OK)
 		print "Payment is ", state
 
 	elif cmd[0] == "list":
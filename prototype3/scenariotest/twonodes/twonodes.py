@@ -90,9 +90,9 @@ with open(settings1.stateFile, "wb") as f:
 				"transactions": {},
 				"meetingPoints": {},
 				"payeeLinks": {},
-				"payerLink": null
+				"payerLinks": {}
 			},
-			"TimeoutMessages": []
+			"TimeoutMessages": {}
 		}
 		""")
 node1 = node.Node(settings1)
@@ -151,9 +151,9 @@ with open(settings2.stateFile, "wb") as f:
 				"transactions": {},
 				"meetingPoints": {},
 				"payeeLinks": {},
-				"payerLink": null
+				"payerLinks": {}
 			},
-			"TimeoutMessages": []
+			"TimeoutMessages": {}
 		}
 		""")
 node2 = node.Node(settings2)
@@ -171,10 +171,10 @@ pprint.pprint(node2.list())
 URL = node2.request(123, "receipt")
 print "Payment URL:", URL
 
-amount, receipt = node1.pay(URL)
-print "Amount: ", amount
-print "Receipt: ", receipt
-paymentState = node1.confirmPayment(True)
+payment = node1.pay(URL)
+print "Amount: ", payment.amount
+print "Receipt: ", payment.receipt
+paymentState = payment.confirm(True)
 print "Payment is ", paymentState
 
 #Allow paylink to disconnect
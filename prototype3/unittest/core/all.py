@@ -31,8 +31,12 @@ import unittest
 
 import testenvironment
 
+from test_binaryserializable   import Test as test_binaryserializable
+from test_dispatch             import Test as test_dispatch
+from test_journal              import Test as test_journal
 from test_log                  import Test as test_log
 from test_network              import Test as test_network
+from test_node                 import Test as test_node
 from test_nodestate            import Test as test_nodestate
 from test_payeelink            import Test as test_payeelink
 from test_payerlink            import Test as test_payerlink
@@ -40,6 +44,8 @@ from test_paylog               import Test as test_paylog
 from test_persistentconnection import Test as test_persistentconnection
 from test_serializable         import Test as test_serializable
 from test_settings             import Test as test_settings
+from test_shard                import Test as test_shard
+from test_timeoutqueue         import Test as test_timeoutqueue
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#    benchmark_loadstate.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import copy
+import os
+import time
+
+import testenvironment
+
+from amiko.core import serializable
+from amiko.core import journal
+
+from benchmark_serializable import makeNodeState
+
+
+
+def deepCopyingInit(self, **kwargs):
+	"""
+	The original constructor of Serializable, which makes a deep copy of
+	all attribute values. It is kept here as a reference for comparison.
+	"""
+	c = serializable.registeredClasses[self.__class__.__name__]
+	attributes = c.serializableAttributes
+	for name in attributes.keys():
+		setattr(self, name, copy.deepcopy(
+				kwargs[name]
+			if name in kwargs else
+				attributes[name] #default value
+			))
+
+
+def loadState(filename):
+	"""
+	Does the same as Node.__loadState.
+
+	Return value:
+	time (in seconds) needed for loading
+	"""
+	t0 = time.time()
+	j = journal.Journal(filename)
+	s = serializable.state2Object(j.load())
+	node = s["Node"]
+	timeoutMessages = s["TimeoutMessages"]
+	j.close()
+	return time.time() - t0
+
+
+def compare(numLinks, outboxSize):
+	filename = "benchmark_loadstate.dat"
+
+	j = journal.Journal(filename)
+	j.writeSnapshot(serializable.object2State(
+		{
+		"Node": makeNodeState(numLinks, outboxSize),
+		"TimeoutMessages": {}
+		}))
+	j.close()
+	fileSize = os.path.getsize(filename)
+
+	ownershipTransferInit = serializable.Serializable.__init__
+	serializable.Serializable.__init__ = deepCopyingInit
+	try:
+		oldTime = loadState(filename)
+	finally:
+		serializable.Serializable.__init__ = ownershipTransferInit
+	newTime = loadState(filename)
+
+	os.remove(filename)
+	os.remove(filename + ".journal")
+
+	print "%6d %6d %10d %9.3f %9.3f %6.2fx" % \
+		(numLinks, outboxSize, fileSize, oldTime, newTime, oldTime / newTime)
+
+
+
+if __name__ == "__main__":
+	print "Load time (in seconds) of a state file"
+	print "%6s %6s %10s %9s %9s" % ("links", "outbox", "file size", "old", "new")
+
+	compare(10, 10)
+	compare(1000, 10)
+	compare(10, 1000)
+	compare(1, 32768)
+
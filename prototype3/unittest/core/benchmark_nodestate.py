@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#    benchmark_nodestate.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import testenvironment
+
+from amiko.core import nodestate
+from amiko.core import link
+from amiko.core import messages
+
+from amiko.channels import plainchannel
+
+from benchmark_serializable import makeNodeState, measure
+
+
+
+#The original implementations of message dispatching, which make a
+#dictionary of bound methods on every call. They are kept here as a
+#reference for comparison.
+
+def legacy_nodeStateHandleMessage(self, msg):
+	return \
+	{
+	messages.PaymentRequest : self.msg_request,
+	messages.MakePayer      : self.msg_makePayer,
+	messages.MakeLink       : self.msg_makeLink,
+	messages.MakeRoute      : self.msg_makeRoute,
+	messages.Lock           : self.msg_lock,
+	messages.Commit         : self.msg_commit,
+	messages.SettleCommit   : self.msg_settleCommit,
+
+	messages.HavePayerRoute : self.msg_passToAnyone,
+	messages.HavePayeeRoute : self.msg_passToAnyone,
+
+	messages.Pay    : self.msg_passToPayee,
+	messages.Confirm: self.msg_passToPayee,
+	messages.Cancel : self.msg_passToPayee,
+
+	messages.Timeout          : self.msg_passToPayer,
+	messages.Receipt          : self.msg_passToPayer,
+	messages.PayerLink_Confirm: self.msg_passToPayer,
+
+	messages.ConnectLink: self.msg_connectLink,
+
+	messages.OutboundMessage: self.msg_passToConnection,
+	messages.Confirmation   : self.msg_passToConnection,
+
+	messages.Link_Deposit  : self.msg_passToLink,
+	messages.ChannelMessage: self.msg_passToLink,
+	messages.Deposit       : self.msg_passToLink
+	}[msg.__class__](msg)
+
+
+def legacy_linkHandleMessage(self, msg):
+	return \
+	{
+	messages.Link_Deposit: self.msg_ownDeposit,
+	messages.Deposit: self.msg_peerDeposit,
+	messages.ChannelMessage: self.continueChannelConversation
+	}[msg.__class__](msg)
+
+
+
+def makeWorkload(name):
+	"""
+	Return value:
+	list of messages that can be handled repeatedly by the node state made
+	by makeNodeState(10, 0)
+	"""
+
+	if name == "Confirmation":
+		return [messages.Confirmation(localID="link%d" % i, index=0)
+			for i in range(10)]
+
+	if name == "ChannelMessage":
+		return [messages.ChannelMessage(
+				ID="link%d" % i, channelIndex=0,
+				message=plainchannel.PlainChannel_Deposit(amount=1))
+			for i in range(10)]
+
+	raise Exception("Unknown workload")
+
+
+def handleMessages(args):
+	state, workload = args
+	for msg in workload:
+		state.handleMessage(msg)
+
+
+def compare(name):
+	state = makeNodeState(10, 0)
+	workload = makeWorkload(name)
+	args = state, workload
+
+	newFunctions = nodestate.NodeState.handleMessage, link.Link.handleMessage
+	nodestate.NodeState.handleMessage, link.Link.handleMessage = \
+		legacy_nodeStateHandleMessage, legacy_linkHandleMessage
+	try:
+		oldRate = measure(handleMessages, args) * len(workload)
+	finally:
+		nodestate.NodeState.handleMessage, link.Link.handleMessage = \
+			newFunctions
+	newRate = measure(handleMessages, args) * len(workload)
+
+	print "%-16s %10.0f %10.0f %6.2fx" % \
+		(name, oldRate, newRate, newRate / oldRate)
+
+
+
+if __name__ == "__main__":
+	print "Throughput in messages per second through NodeState.handleMessage"
+	print "%-16s %10s %10s" % ("", "old", "new")
+
+	compare("Confirmation")
+	compare("ChannelMessage")
+
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#    benchmark_persistentconnection.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+from collections import deque
+import random
+import time
+
+import testenvironment
+
+from amiko.core import serializable
+from amiko.core import persistentconnection
+from amiko.core import messages
+
+from benchmark_serializable import makeMessage
+
+
+
+#The original, list-based implementation of the outbox.
+#It is kept here as a reference for comparison.
+
+def legacy_init(self, **kwargs):
+	serializable.Serializable.__init__(self, **kwargs)
+
+
+def legacy_addMessage(self, msg):
+	self.lastIndex = (self.lastIndex + 1) & 0xffff
+	self.messages.append(persistentconnection.PersistentConnectionMessage(
+		message=msg, index=self.lastIndex))
+	self.notYetTransmitted += 1
+
+
+def legacy_popChanges(self):
+	#The legacy implementation did not record changes:
+	return []
+
+
+def legacy_processConfirmation(self, confirmation):
+	confirmationIndex = confirmation.index
+	for i in range(len(self.messages)):
+		if self.messages[i].index == confirmationIndex:
+			self.messages = self.messages[i+1:]
+			return
+
+
+def legacy_transmit(self, network, windowSize=None):
+	#Note: windowSize is ignored
+	if len(self.messages) == 0:
+		return False
+
+	if not network.interfaceExists(self.messages[0].message.localID):
+		changed = False
+		if self.closing:
+			changed = True
+			self.messages = []
+		changed = changed or self.notYetTransmitted != len(self.messages)
+		self.notYetTransmitted = len(self.messages)
+		return changed
+
+	if self.notYetTransmitted == 0:
+		return False
+
+	for msg in self.messages[-self.notYetTransmitted:]:
+		network.sendOutboundMessage(msg.index, msg.message)
+	self.notYetTransmitted = 0
+	return True
+
+
+
+class FlakyNetwork:
+	"""
+	A network interface to a peer which processes a limited number of
+	messages per tick, and which is disconnected every now and then.
+	Messages in transit are lost on disconnection.
+	"""
+
+	def __init__(self, peerSpeed, disconnectRate):
+		self.random = random.Random(42) #same sequence for all measurements
+		self.peerSpeed = peerSpeed
+		self.disconnectRate = disconnectRate
+		self.connected = True
+		self.inTransit = deque()
+
+
+	def interfaceExists(self, localID):
+		return self.connected
+
+
+	def isSendBufferFull(self, localID):
+		return False
+
+
+	def sendOutboundMessage(self, index, msg):
+		self.inTransit.append(index)
+
+
+	def tick(self):
+		"""
+		Return value:
+		The index to be confirmed by the peer, or None.
+		"""
+
+		if not self.connected:
+			self.connected = True
+			return None
+
+		if self.random.random() < self.disconnectRate:
+			self.connected = False
+			self.inTransit = deque()
+			return None
+
+		ret = None
+		for i in range(min(self.peerSpeed, len(self.inTransit))):
+			ret = self.inTransit.popleft()
+		return ret
+
+
+#Window size, as in the default settings:
+windowSize = 256
+
+
+def run(numMessages, batchSize, peerSpeed, disconnectRate):
+	"""
+	Pushes numMessages messages through a PersistentConnection, in batches
+	of batchSize messages per tick, until all of them are confirmed.
+	The peer processes and confirms peerSpeed messages per tick.
+
+	Return value:
+	time (in seconds) needed
+	"""
+
+	network = FlakyNetwork(peerSpeed, disconnectRate)
+	connection = persistentconnection.PersistentConnection()
+	msg = makeMessage(0)
+
+	t0 = time.time()
+	numAdded = 0
+	while numAdded < numMessages or len(connection.messages) > 0:
+		for i in range(batchSize):
+			if numAdded == numMessages or len(connection.messages) >= 32768:
+				break
+			connection.handleMessage(msg)
+			numAdded += 1
+
+		connection.transmit(network, windowSize)
+
+		index = network.tick()
+		if index is not None:
+			connection.handleMessage(messages.Confirmation(index=index))
+
+		#Changes are stored once per tick:
+		connection.popChanges()
+
+	return time.time() - t0
+
+
+def compare(numMessages, batchSize, peerSpeed, disconnectRate):
+	c = persistentconnection.PersistentConnection
+	newFunctions = c.__init__, c.addMessage, c.processConfirmation, \
+		c.transmit, c.popChanges
+	c.__init__, c.addMessage, c.processConfirmation, c.transmit, c.popChanges = \
+		legacy_init, legacy_addMessage, legacy_processConfirmation, \
+		legacy_transmit, legacy_popChanges
+	try:
+		oldTime = run(numMessages, batchSize, peerSpeed, disconnectRate)
+	finally:
+		c.__init__, c.addMessage, c.processConfirmation, c.transmit, \
+			c.popChanges = newFunctions
+	newTime = run(numMessages, batchSize, peerSpeed, disconnectRate)
+
+	print "%8d %6d %6d %11.4f %10.0f %10.0f %6.2fx" % \
+		(numMessages, batchSize, peerSpeed, disconnectRate,
+		numMessages / oldTime, numMessages / newTime, oldTime / newTime)
+
+
+
+if __name__ == "__main__":
+	print "Throughput in messages per second through a flaky connection"
+	print "%8s %6s %6s %11s %10s %10s" % \
+		("messages", "batch", "peer", "disconnect", "old", "new")
+
+	compare(50000, 10, 10, 0.0)
+	compare(50000, 20, 10, 0.0)
+	compare(50000, 20, 10, 0.001)
+	compare(50000, 100, 50, 0.001)
+
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#    benchmark_serializable.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import json
+import time
+
+import testenvironment
+
+from amiko.core import serializable
+from amiko.core import nodestate
+from amiko.core import link
+from amiko.core import persistentconnection
+from amiko.core import transaction
+from amiko.core import messages
+
+from amiko.channels import plainchannel
+
+
+
+#The original, generic implementation of serialization, which walks the
+#data structure once for every conversion step. It is kept here as a
+#reference for comparison.
+
+def legacy_applyRecursively(selectFunction, transformFunction, obj):
+	if type(obj) == dict:
+		obj = \
+		{
+		legacy_applyRecursively(selectFunction, transformFunction, k):
+			legacy_applyRecursively(selectFunction, transformFunction, v)
+		for k,v in obj.iteritems()
+		}
+	if type(obj) == list:
+		obj = \
+		[
+		legacy_applyRecursively(selectFunction, transformFunction, x)
+		for x in obj
+		]
+
+	if selectFunction(obj):
+		return transformFunction(obj)
+
+	return obj
+
+
+def legacy_state2Object(s):
+	def transformFunction(attribs):
+		c = serializable.registeredClasses[attribs["_class"]]
+		return c(**attribs)
+
+	return legacy_applyRecursively(
+		lambda obj: type(obj) == dict and "_class" in obj.keys(),
+		transformFunction,
+		s)
+
+
+def legacy_object2State(s):
+	def transformFunction(obj):
+		className = obj.__class__.__name__
+		c = serializable.registeredClasses[className]
+		attributes = c.serializableAttributes
+		obj = \
+		{
+			name: legacy_object2State(getattr(obj, name))
+			for name in attributes.keys()
+		}
+		obj["_class"] = className
+		return obj
+
+	return legacy_applyRecursively(
+		lambda obj: isinstance(obj, serializable.Serializable),
+		transformFunction,
+		s)
+
+
+def legacy_encodeStrings(s):
+	def transformFunction(obj):
+		nonReadableChars = [c for c in obj if ord(c) < 32 or ord(c) >= 128]
+		isHumanReadable = len(nonReadableChars) == 0
+		if isHumanReadable:
+			if len(obj) > 0 and obj[0] == '!':
+				obj = '!' + obj
+		else:
+			obj = '!x' + obj.encode('hex')
+		return obj
+
+	return legacy_applyRecursively(
+		lambda obj: type(obj) == str,
+		transformFunction,
+		s)
+
+
+def legacy_decodeStrings(s):
+	def transformFunction(obj):
+		obj = str(obj)
+		if len(obj) >= 2 and obj[0] == '!':
+			if obj[1] == 'x':
+				return obj[2:].decode('hex')
+			elif obj[1] == '!':
+				return obj[1:]
+			else:
+				raise Exception('Formatting error')
+		return obj
+
+	return legacy_applyRecursively(
+		lambda obj: type(obj) in (unicode, str),
+		transformFunction,
+		s)
+
+
+def legacy_serialize(obj):
+	return json.dumps(legacy_encodeStrings(legacy_object2State(obj)))
+
+
+def legacy_deserialize(s):
+	return legacy_state2Object(legacy_decodeStrings(json.loads(s)))
+
+
+
+def makeMessage(i):
+	"""
+	A typical wire message: a channel message inside an outbound message.
+	"""
+	return messages.OutboundMessage(
+		localID="link%d" % i,
+		message=messages.ChannelMessage(
+			ID="remote%d" % i,
+			channelIndex=0,
+			message=plainchannel.PlainChannel_Deposit(amount=1000+i)
+			)
+		)
+
+
+def makeNodeState(numLinks, outboxSize):
+	links = {}
+	connections = {}
+	transactions = {}
+	for i in range(numLinks):
+		ID = "link%d" % i
+		links[ID] = link.Link(remoteID="remote%d" % i, channels=[
+			plainchannel.PlainChannel(
+				state="ready", amountLocal=1000, amountRemote=2000)
+			])
+		connections[ID] = persistentconnection.PersistentConnection(
+			host="localhost", port=4321,
+			connectMessage=messages.ConnectLink(ID="remote%d" % i),
+			messages=[
+				persistentconnection.PersistentConnectionMessage(
+					index=j, message=makeMessage(i))
+				for j in range(outboxSize)
+				],
+			lastIndex=outboxSize-1
+			)
+		transactionID = ("%020d" % i).decode("hex") #binary
+		transactions[transactionID] = transaction.Transaction(
+			side=transaction.side_payer, payerID=ID, amount=i,
+			remainingLinkIDs=[ID])
+
+	return nodestate.NodeState(
+		links=links, connections=connections, transactions=transactions)
+
+
+def measure(function, arg, minTime=1.0):
+	"""
+	Return value:
+	number of calls per second
+	"""
+	count = 0
+	t0 = time.time()
+	while True:
+		function(arg)
+		count += 1
+		t = time.time() - t0
+		if t >= minTime:
+			return count / t
+
+
+def compare(name, obj):
+	legacyData = legacy_serialize(obj)
+	newData = serializable.serialize(obj)
+	assert json.loads(legacyData) == json.loads(newData)
+
+	rates = \
+	(
+	measure(legacy_serialize, obj),
+	measure(serializable.serialize, obj),
+	measure(legacy_deserialize, legacyData),
+	measure(serializable.deserialize, newData)
+	)
+
+	print "%-28s %10.1f %10.1f %6.2fx %10.1f %10.1f %6.2fx" % \
+		(
+		name,
+		rates[0], rates[1], rates[1] / rates[0],
+		rates[2], rates[3], rates[3] / rates[2]
+		)
+
+
+
+if __name__ == "__main__":
+	print "Throughput in calls per second"
+	print "%-28s %10s %10s %7s %10s %10s %7s" % \
+		("", "ser. old", "ser. new", "", "deser. old", "deser. new", "")
+
+	compare("Message", makeMessage(0))
+	compare("Connect message", messages.ConnectLink(
+		ID="remote", dice="\x01\x02\x03\x04", callbackHost="localhost",
+		callbackPort=4321, callbackID="local"))
+	compare("NodeState (10 links)", makeNodeState(10, 10))
+	compare("NodeState (100 links)", makeNodeState(100, 10))
+	compare("NodeState (10 links, 1000 msg)", makeNodeState(10, 1000))
+
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#    test_binaryserializable.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+
+import testenvironment
+
+from amiko.core import serializable
+from amiko.core import binaryserializable
+
+
+class C(serializable.Serializable):
+	serializableAttributes = {'x':1, 'y':2}
+
+
+class D(serializable.Serializable):
+	serializableAttributes = {'a':None}
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		#Other tests need the original classes, so restore them afterwards:
+		self.registeredClasses = serializable.registeredClasses
+
+		serializable.registeredClasses = {}
+		serializable.registerClass(C)
+		serializable.registerClass(D)
+
+
+	def tearDown(self):
+		serializable.registeredClasses = self.registeredClasses
+
+
+	def test_getFormatName(self):
+		"Test getFormatName"
+
+		name = binaryserializable.getFormatName()
+		self.assertTrue(name.startswith("binary2-"))
+		self.assertEqual(binaryserializable.getFormatName(), name)
+
+		#Changing the set of classes changes the name:
+		class E(serializable.Serializable):
+			serializableAttributes = {}
+		serializable.registerClass(E)
+		self.assertNotEqual(binaryserializable.getFormatName(), name)
+
+
+	def test_serialize(self):
+		"Test serialize"
+
+		self.assertEqual(binaryserializable.serialize(None), 'N')
+		self.assertEqual(binaryserializable.serialize(True), 'T')
+		self.assertEqual(binaryserializable.serialize(False), 'F')
+		self.assertEqual(binaryserializable.serialize(258),
+			'i\x00\x00\x00\x00\x00\x00\x01\x02')
+		self.assertEqual(binaryserializable.serialize('\xff\x00'),
+			's\x00\x00\x00\x02\xff\x00')
+		self.assertEqual(binaryserializable.serialize([None, 'a']),
+			'l\x00\x00\x00\x02Ns\x00\x00\x00\x01a')
+		self.assertEqual(binaryserializable.serialize(C(x=None, y=True)),
+			'o\x00\x00NT')
+		self.assertEqual(binaryserializable.serialize(D()),
+			'o\x00\x01N')
+
+		self.assertRaises(Exception, binaryserializable.serialize, set())
+
+
+	def test_roundTrip(self):
+		"Test serialize and deserialize"
+
+		values = \
+		[
+		None, True, False, 0, -1, 2**63-1, -2**63, 2**64, -2**100, 1.5,
+		'', 'foo', '\xff\x00\n', u'\u20ac', [], [1, [2]], {}, {'a': {'\x01': 3}}
+		]
+		for value in values:
+			data = binaryserializable.serialize(value)
+			self.assertEqual(binaryserializable.deserialize(data), value)
+
+		self.assertEqual(binaryserializable.deserialize(
+			binaryserializable.serialize((1, 2))), [1, 2])
+
+		obj = binaryserializable.deserialize(binaryserializable.serialize(
+			{'c': C(x={'a':D(a='\xff'), 'b':3}, y=[C(), 4])}))
+		self.assertEqual(obj.keys(), ['c'])
+		obj = obj['c']
+		self.assertEqual(obj.__class__, C)
+		self.assertEqual(obj.x['a'].__class__, D)
+		self.assertEqual(obj.x['a'].a, '\xff')
+		self.assertEqual(obj.x['b'], 3)
+		self.assertEqual(obj.y[0].__class__, C)
+		self.assertEqual(obj.y[0].x, 1)
+		self.assertEqual(obj.y[0].y, 2)
+		self.assertEqual(obj.y[1], 4)
+
+
+	def test_deserialize_invalid(self):
+		"Test deserialize (invalid data)"
+
+		self.assertRaises(Exception, binaryserializable.deserialize, '')
+		self.assertRaises(Exception, binaryserializable.deserialize, 'X')
+		self.assertRaises(Exception, binaryserializable.deserialize, 'NN')
+		self.assertRaises(Exception, binaryserializable.deserialize, 'i\x00')
+		self.assertRaises(Exception, binaryserializable.deserialize,
+			's\x00\x00\x00\x02\xff')
+		self.assertRaises(Exception, binaryserializable.deserialize,
+			'o\x00\x05')
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#    test_dispatch.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+
+import testenvironment
+
+from amiko.core import dispatch
+
+
+
+class A:
+	pass
+
+class B:
+	pass
+
+class C:
+	pass
+
+
+
+class Base:
+	def handleMessage(self, msg):
+		return self.messageHandlers[msg.__class__](self, msg)
+
+	@dispatch.handles(A)
+	def msg_A(self, msg):
+		return 'Base.msg_A'
+
+	@dispatch.handles(B, C)
+	def msg_BC(self, msg):
+		return 'Base.msg_BC'
+
+dispatch.registerHandlers(Base)
+
+
+class Derived(Base):
+	@dispatch.handles(B)
+	def msg_B(self, msg):
+		return 'Derived.msg_B'
+
+dispatch.registerHandlers(Derived)
+
+
+
+class Test(unittest.TestCase):
+	def test_handleMessage(self):
+		"Test handleMessage"
+
+		obj = Base()
+		self.assertEqual(obj.handleMessage(A()), 'Base.msg_A')
+		self.assertEqual(obj.handleMessage(B()), 'Base.msg_BC')
+		self.assertEqual(obj.handleMessage(C()), 'Base.msg_BC')
+		self.assertRaises(KeyError, obj.handleMessage, obj)
+
+
+	def test_inheritance(self):
+		"Test handleMessage in a derived class"
+
+		obj = Derived()
+		self.assertEqual(obj.handleMessage(A()), 'Base.msg_A')
+		self.assertEqual(obj.handleMessage(B()), 'Derived.msg_B')
+		self.assertEqual(obj.handleMessage(C()), 'Base.msg_BC')
+
+		#The base class is not affected:
+		self.assertEqual(Base().handleMessage(B()), 'Base.msg_BC')
+
+
+	def test_duplicateHandlers(self):
+		"Test registerHandlers with multiple handlers for a message class"
+
+		class D:
+			@dispatch.handles(A)
+			def msg_A1(self, msg):
+				pass
+
+			@dispatch.handles(A)
+			def msg_A2(self, msg):
+				pass
+
+		self.assertRaises(Exception, dispatch.registerHandlers, D)
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
+
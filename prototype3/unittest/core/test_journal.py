@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#    test_journal.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+import os
+
+import testenvironment
+
+from amiko.core import journal
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		self.filename = "test_journal.dat"
+		self.removeFiles()
+		self.journal = journal.Journal(self.filename)
+
+
+	def tearDown(self):
+		self.journal.close()
+		self.removeFiles()
+
+
+	def removeFiles(self):
+		for ext in ("", ".new", ".old", ".journal"):
+			if os.access(self.filename + ext, os.F_OK):
+				os.remove(self.filename + ext)
+
+
+	def test_load_noFile(self):
+		"Test load (no file)"
+
+		self.assertRaises(IOError, self.journal.load)
+
+
+	def test_load_snapshotOnly(self):
+		"Test load (snapshot without journal)"
+
+		with open(self.filename, "wb") as f:
+			f.write('{"Node": {"a": "!xff00"}, "TimeoutMessages": []}')
+
+		state = self.journal.load()
+
+		self.assertEqual(state, {"Node": {"a": "\xff\x00"}, "TimeoutMessages": []})
+		self.assertEqual(self.journal.sequence, 0)
+		self.assertEqual(self.journal.numRecords, 0)
+
+
+	def test_appendAndLoad(self):
+		"Test append and load"
+
+		self.journal.writeSnapshot({"Node": {"a": 1, "b": {"c": 2}}})
+
+		self.journal.append([(["Node", "a"], 3)])
+		self.journal.append([(["Node", "b", "d"], "\x01"), (["Node", "b", "c"],)])
+		self.journal.append([]) #ignored
+		self.assertEqual(self.journal.sequence, 2)
+		self.assertEqual(self.journal.numRecords, 2)
+		self.journal.close()
+
+		j = journal.Journal(self.filename)
+		state = j.load()
+		j.close()
+
+		self.assertEqual(state, {"Node": {"a": 3, "b": {"d": "\x01"}}})
+		self.assertEqual(j.sequence, 2)
+		self.assertEqual(j.numRecords, 2)
+
+
+	def test_listOperations(self):
+		"Test list operations in the journal"
+
+		self.journal.writeSnapshot({"Node": {"a": [1, 2, 3]}})
+
+		self.journal.append([("append", ["Node", "a"], 4)])
+		self.journal.append([("popleft", ["Node", "a"], 2), ("append", ["Node", "a"], "\x05")])
+		self.journal.close()
+
+		state = self.journal.load()
+		self.assertEqual(state, {"Node": {"a": [3, 4, "\x05"]}})
+
+
+	def test_prefixChange(self):
+		"Test prefixChange"
+
+		self.assertEqual(journal.prefixChange(["a", "b"], (["c"], 1)),
+			(["a", "b", "c"], 1))
+		self.assertEqual(journal.prefixChange(["a", "b"], (["c"],)),
+			(["a", "b", "c"],))
+		self.assertEqual(journal.prefixChange(["a", "b"], ("append", ["c"], 1)),
+			("append", ["a", "b", "c"], 1))
+
+
+	def test_writeSnapshot(self):
+		"Test writeSnapshot"
+
+		self.journal.writeSnapshot({"Node": {"a": 1}})
+		self.journal.append([(["Node", "a"], 2)])
+		self.journal.writeSnapshot({"Node": {"a": 2}})
+		self.assertEqual(self.journal.numRecords, 0)
+
+		self.assertEqual(os.path.getsize(self.filename + ".journal"), 0)
+		self.assertFalse(os.access(self.filename + ".new", os.F_OK))
+		self.assertFalse(os.access(self.filename + ".old", os.F_OK))
+
+		state = self.journal.load()
+		self.assertEqual(state, {"Node": {"a": 2}})
+		self.assertEqual(self.journal.sequence, 1)
+
+
+	def test_load_skipsOldEntries(self):
+		"Test load (journal entries already in snapshot)"
+
+		self.journal.writeSnapshot({"Node": {"a": 1}})
+		self.journal.append([(["Node", "a"], 2)])
+		self.journal.append([(["Node", "a"], 3)])
+		self.journal.close()
+
+		#Simulate a crash after writing a snapshot, before emptying the journal:
+		with open(self.filename, "wb") as f:
+			f.write('{"Node": {"a": 4}, "JournalSequence": 1}')
+
+		state = self.journal.load()
+		self.assertEqual(state, {"Node": {"a": 3}})
+		self.assertEqual(self.journal.numRecords, 1)
+
+		with open(self.filename, "wb") as f:
+			f.write('{"Node": {"a": 4}, "JournalSequence": 2}')
+
+		state = self.journal.load()
+		self.assertEqual(state, {"Node": {"a": 4}})
+		self.assertEqual(self.journal.numRecords, 0)
+
+
+	def test_load_incompleteEntry(self):
+		"Test load (incomplete journal entry)"
+
+		self.journal.writeSnapshot({"Node": {"a": 1}})
+		self.journal.append([(["Node", "a"], 2)])
+		self.journal.close()
+
+		with open(self.filename + ".journal", "ab") as f:
+			f.write('{"seq": 2, "changes": [[["Node", "a"], 3]')
+
+		state = self.journal.load()
+		self.assertEqual(state, {"Node": {"a": 2}})
+
+		#The incomplete entry is removed, and new entries can be added:
+		self.journal.append([(["Node", "a"], 5)])
+		self.journal.close()
+
+		state = self.journal.load()
+		self.assertEqual(state, {"Node": {"a": 5}})
+
+
+	def test_load_oldFile(self):
+		"Test load (recovery of .old file)"
+
+		with open(self.filename + ".old", "wb") as f:
+			f.write('{"Node": {"a": 1}}')
+
+		state = self.journal.load()
+		self.assertEqual(state, {"Node": {"a": 1}})
+		self.assertFalse(os.access(self.filename + ".old", os.F_OK))
+
+
+	def test_sync(self):
+		"Test sync"
+
+		self.journal.syncInterval = 1000.0
+		self.assertEqual(self.journal.getSyncDeadline(), None)
+
+		self.journal.append([(["Node"], 1)])
+		deadline = self.journal.getSyncDeadline()
+		self.assertTrue(deadline is not None)
+
+		self.journal.sync(force=False)
+		self.assertEqual(self.journal.getSyncDeadline(), deadline)
+
+		self.journal.sync()
+		self.assertEqual(self.journal.getSyncDeadline(), None)
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
@@ -28,6 +28,9 @@
 #    OpenSSL library used as well as that of the covered work.
 
 import unittest
+import socket
+import threading
+import time
 
 import testenvironment
 
@@ -46,7 +49,7 @@ class Test(unittest.TestCase):
 
 	def tearDown(self):
 		#Clean up the listener, so we can run other tests:
-		self.network.listener.close()
+		self.network.close()
 
 
 	def test_connectionSession(self):
@@ -58,14 +61,14 @@ class Test(unittest.TestCase):
 
 		self.assertEqual(c1.localID, 'localID')
 		self.assertEqual(len(self.network.connections), 1)
-		self.assertEqual(self.network.connections[0], c1)
+		self.assertEqual(self.network.connections, set([c1]))
 		self.assertEqual(self.network.getInterface('localID'), c1)
 		self.assertTrue(self.network.interfaceExists('localID'))
 
 		self.network.processNetworkEvents(timeout=0.01)
 
 		self.assertEqual(len(self.network.connections), 2)
-		c2 = self.network.connections[1]
+		c2 = self.getOtherConnection(c1)
 		self.assertEqual(c2.localID, None)
 
 		self.assertEqual(len(self.messages), 0)
@@ -123,7 +126,7 @@ class Test(unittest.TestCase):
 		self.network.closeInterface('remoteID')
 
 		self.assertEqual(len(self.network.connections), 1)
-		self.assertEqual(self.network.connections[0], c1)
+		self.assertEqual(self.network.connections, set([c1]))
 		self.assertFalse(self.network.interfaceExists('remoteID'))
 		self.assertTrue(self.network.interfaceExists('localID'))
 
@@ -161,6 +164,241 @@ class Test(unittest.TestCase):
 		self.assertEqual(len(stillOpen), 1) #exactly one of the original connections is still open
 		self.assertTrue(self.network.interfaceExists('localID'))
 		self.assertTrue(self.network.interfaceExists('remoteID'))
+		self.assertTrue(self.network.getInterface('localID') in self.network.connections)
+		self.assertTrue(self.network.getInterface('remoteID') in self.network.connections)
+
+
+	def test_remoteClose(self):
+		"Test remote close of a connection"
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		self.network.processNetworkEvents(timeout=0.01) #accept
+		self.network.processNetworkEvents(timeout=0.01) #connect message
+		c2 = self.network.getInterface('remoteID')
+
+		#Close one side; the other side notices it:
+		self.network.removeConnection(c1)
+		c1.close()
+		self.network.processNetworkEvents(timeout=0.01)
+
+		self.assertTrue(c2.isClosed)
+		self.assertFalse(self.network.interfaceExists('remoteID'))
+		self.assertEqual(self.network.connections, set())
+		self.assertEqual(self.network.interfaces, {})
+
+
+	def test_delayedAck(self):
+		"Test delayed and combined confirmations"
+
+		self.network.ackCount = 3
+		self.network.ackDelay = 10.0
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		self.network.processNetworkEvents(timeout=0.01) #accept
+		self.network.processNetworkEvents(timeout=0.01) #connect message
+		self.network.processNetworkEvents(timeout=0.01) #format selection
+		c2 = self.network.getInterface('remoteID')
+		self.assertTrue(c1.sendBinary)
+		self.assertTrue(c2.sendBinary)
+		self.messages = []
+
+		def send(localID, index):
+			self.network.sendOutboundMessage(index, messages.OutboundMessage(
+				localID=localID, message=messages.Cancel(ID=None)))
+			for i in range(3):
+				self.network.processNetworkEvents(timeout=0.01)
+
+		def confirmations():
+			return [m.index for m in self.messages
+				if m.__class__ == messages.Confirmation]
+
+		#Confirmation once ackCount messages are received:
+		send('localID', 0)
+		send('localID', 1)
+		self.assertEqual(len(self.messages), 2)
+		self.assertEqual(confirmations(), [])
+		send('localID', 2)
+		self.assertEqual(confirmations(), [2])
+		self.assertEqual(self.network.getNextDeadline(), None)
+
+		#Confirmation after ackDelay:
+		self.network.ackDelay = 0.05
+		self.messages = []
+		send('localID', 3)
+		self.assertEqual(confirmations(), [])
+		deadline = self.network.getNextDeadline()
+		self.assertNotEqual(deadline, None)
+		while time.time() < deadline + 0.01:
+			self.network.processNetworkEvents(timeout=0.01)
+		self.network.processNetworkEvents(timeout=0.01)
+		self.assertEqual(confirmations(), [3])
+
+		#Confirmation combined with a message:
+		self.network.ackDelay = 10.0
+		self.messages = []
+		send('localID', 4)
+		self.assertEqual(confirmations(), [])
+		send('remoteID', 100)
+		self.assertEqual(confirmations(), [4])
+		self.assertEqual(c2.pendingAck, None)
+		self.assertEqual(self.network.pendingAckConnections, set([c1]))
+
+
+	def test_isSendBufferFull(self):
+		"Test isSendBufferFull"
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		self.assertFalse(self.network.isSendBufferFull('localID'))
+
+		c1.out_buffer = 'x' * self.network.maxSendBuffer
+		self.assertTrue(self.network.isSendBufferFull('localID'))
+		c1.out_buffer = ''
+
+
+	def test_popChangedInterfaces(self):
+		"Test popChangedInterfaces"
+
+		self.assertEqual(self.network.popChangedInterfaces(), set())
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		self.network.processNetworkEvents(timeout=0.01) #accept
+		self.network.processNetworkEvents(timeout=0.01) #connect message
+		self.assertEqual(self.network.popChangedInterfaces(),
+			set(['localID', 'remoteID']))
+		self.assertEqual(self.network.popChangedInterfaces(), set())
+
+		#Send buffer is no longer full:
+		c1.out_buffer = 'x' * self.network.maxSendBuffer
+		c1.handle_write()
+		self.assertFalse(self.network.isSendBufferFull('localID'))
+		self.assertEqual(self.network.popChangedInterfaces(), set(['localID']))
+		c1.out_buffer = ''
+
+		self.network.closeInterface('localID')
+		self.assertEqual(self.network.popChangedInterfaces(), set(['localID']))
+
+
+	def test_formatNegotiation(self):
+		"Test wire format negotiation"
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		self.assertFalse(c1.sendBinary)
+
+		self.network.processNetworkEvents(timeout=0.01) #accept
+		self.network.processNetworkEvents(timeout=0.01) #connect message
+		c2 = self.getOtherConnection(c1)
+		self.assertTrue(c2.sendBinary)
+		self.assertFalse(c1.sendBinary)
+
+		self.network.processNetworkEvents(timeout=0.01) #format acceptance
+		self.assertTrue(c1.sendBinary)
+
+		#Messages in both directions, in binary format:
+		self.messages = []
+		self.network.sendOutboundMessage(3, messages.OutboundMessage(
+			localID='localID', message=messages.Cancel(ID='\xff')))
+		self.network.sendOutboundMessage(4, messages.OutboundMessage(
+			localID='remoteID', message=messages.Cancel(ID='foo')))
+
+		for i in range(3):
+			self.network.processNetworkEvents(timeout=0.01)
+
+		received = [(m.__class__, m.ID if m.__class__ == messages.Cancel else m.index)
+			for m in self.messages]
+		self.assertEqual(sorted(received), sorted([
+			(messages.Cancel, '\xff'),
+			(messages.Cancel, 'foo'),
+			(messages.Confirmation, 3),
+			(messages.Confirmation, 4)
+			]))
+
+
+	def test_formatNegotiation_jsonOnly(self):
+		"Test wire format negotiation (binary format disabled)"
+
+		self.network.binaryFormat = False
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+
+		for i in range(3):
+			self.network.processNetworkEvents(timeout=0.01)
+
+		c2 = self.getOtherConnection(c1)
+		self.assertFalse(c1.sendBinary)
+		self.assertFalse(c2.sendBinary)
+
+
+	def test_receiveBuffer(self):
+		"Test receive buffer"
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		self.network.processNetworkEvents(timeout=0.01) #accept
+		self.network.processNetworkEvents(timeout=0.01) #connect message
+		c2 = self.getOtherConnection(c1)
+		self.messages = []
+
+		#A message split over multiple reads, followed by a complete one:
+		c2.readBuffer.extend('{"index": 1, "message": {"_class": "Can')
+		c2.processReadBuffer()
+		self.assertEqual(self.messages, [])
+		c2.readBuffer.extend('cel"}}\n{"index": 2, "message": {"_class": "Cancel"}}\n{')
+		c2.processReadBuffer()
+		self.assertEqual([m.__class__ for m in self.messages],
+			[messages.Cancel, messages.Cancel])
+		self.assertEqual(c2.readBuffer, bytearray('{'))
+
+		#Backlog of messages:
+		self.messages = []
+		self.network.maxMessagesPerRead = 2
+		c2.readBuffer = bytearray('{"index": 3, "message": {"_class": "Cancel"}}\n' * 5)
+		c2.processReadBuffer()
+		self.assertEqual(len(self.messages), 2)
+		self.assertEqual(self.messages[0].__class__, messages.Cancel)
+		self.assertTrue(c2.hasBacklog)
+		self.assertFalse(c2.readable())
+		self.assertEqual(self.network.backloggedConnections, set([c2]))
+
+		def numCancelMessages():
+			return len([m for m in self.messages if m.__class__ == messages.Cancel])
+
+		self.network.processNetworkEvents(timeout=0.01)
+		self.assertEqual(numCancelMessages(), 4)
+		self.network.processNetworkEvents(timeout=0.01)
+		self.assertEqual(numCancelMessages(), 5)
+		self.assertFalse(c2.hasBacklog)
+		self.assertTrue(c2.readable())
+		self.assertEqual(self.network.backloggedConnections, set())
+
+
+	def test_receiveBuffer_messageTooLarge(self):
+		"Test receive buffer (message too large)"
+
+		self.network.maxMessageSize = 10
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		self.network.processNetworkEvents(timeout=0.01) #accept
+		c2 = self.getOtherConnection(c1)
+		self.network.processNetworkEvents(timeout=0.01) #connect message is too large
+		self.assertTrue(c2.isClosed)
+		self.assertFalse(c2 in self.network.connections)
+		self.assertEqual(self.messages, [])
+		self.assertFalse(self.network.interfaceExists('remoteID'))
+
+		#Binary message:
+		sock1, sock2 = socket.socketpair()
+		c3 = network.Connection(sock1, self.network)
+		c3.readBuffer.extend('\x00\x00\x00\x00\x0b')
+		c3.processReadBuffer()
+		self.assertTrue(c3.isClosed)
+		sock2.close()
 
 
 	def test_acceptError(self):
@@ -178,10 +416,91 @@ class Test(unittest.TestCase):
 		self.network.processNetworkEvents(timeout=0.01)
 
 
+	def test_wakeUp(self):
+		"Test wakeUp"
+
+		#Without events, processNetworkEvents waits until the time-out:
+		t0 = time.time()
+		self.network.processNetworkEvents(timeout=0.05)
+		self.assertTrue(time.time() - t0 >= 0.05)
+
+		#wakeUp ends the waiting, also when called from another thread:
+		timer = threading.Timer(0.05, self.network.wakeUp)
+		timer.start()
+		t0 = time.time()
+		self.network.processNetworkEvents(timeout=10.0)
+		self.assertTrue(time.time() - t0 < 5.0)
+		timer.join()
+
+		#A wakeUp before waiting is not lost:
+		self.network.wakeUp()
+		t0 = time.time()
+		self.network.processNetworkEvents()
+		self.assertTrue(time.time() - t0 < 5.0)
+
+
+	def test_reuseFileDescriptor(self):
+		"Test re-use of file descriptors of closed connections"
+
+		for i in range(3):
+			self.network.makeConnection(
+				('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+			self.network.processNetworkEvents(timeout=0.01) #accept
+			self.network.processNetworkEvents(timeout=0.01) #connect message
+			self.assertTrue(self.network.interfaceExists('remoteID'))
+
+			self.network.closeInterface('localID')
+			self.network.closeInterface('remoteID')
+			self.network.processNetworkEvents(timeout=0.01)
+			self.assertEqual(self.network.connections, set())
+
+		self.assertEqual(len(self.messages), 3)
+
+
+	def test_poller_changedDispatchers(self):
+		"Test that the poller only checks changed dispatchers"
+
+		c1 = self.network.makeConnection(
+			('localhost', 4321), 'localID', messages.Pay(ID='remoteID'))
+		#Connect message, format acceptance:
+		for i in range(5):
+			self.network.processNetworkEvents(timeout=0.01)
+
+		numCalls = [0]
+		def countingReadable():
+			numCalls[0] += 1
+			return Connection.readable(c1)
+		Connection = c1.__class__
+		c1.readable = countingReadable
+
+		#Nothing happens on the connection:
+		for i in range(3):
+			self.network.processNetworkEvents(timeout=0.0)
+		self.assertEqual(numCalls[0], 0)
+
+		#Sending data changes its interest in events:
+		self.messages = []
+		self.network.sendOutboundMessage(0, messages.OutboundMessage(
+			localID='localID', message=messages.Cancel(ID=None)))
+		self.network.processNetworkEvents(timeout=0.01)
+		self.assertTrue(numCalls[0] > 0)
+
+		#The message still arrives:
+		for i in range(3):
+			self.network.processNetworkEvents(timeout=0.01)
+		self.assertTrue(messages.Cancel in [m.__class__ for m in self.messages])
+
+
 	def handleMessage(self, msg):
 		self.messages.append(msg)
 
 
+	def getOtherConnection(self, connection):
+		others = [c for c in self.network.connections if c is not connection]
+		self.assertEqual(len(others), 1)
+		return others[0]
+
+
 
 if __name__ == "__main__":
 	unittest.main(verbosity=2)
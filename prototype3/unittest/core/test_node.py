@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#    test_node.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+import os
+from collections import deque
+
+import testenvironment
+
+from amiko import node
+from amiko.core import journal
+from amiko.core import messages
+from amiko.core import settings
+from amiko.core import shard
+
+from amiko.channels import plainchannel
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		self.stateFile = "test_node.dat"
+		self.payLogFile = "test_node.log"
+		for f in [self.stateFile, self.stateFile + ".journal", self.payLogFile]:
+			if os.access(f, os.F_OK):
+				os.remove(f)
+
+		for f in shard.findShardFiles(self.stateFile).values():
+			shard.removeShardFile(f)
+
+		self.node = self.makeNode(shards=0)
+
+
+	def tearDown(self):
+		self.closeNode()
+
+
+	def makeNode(self, shards):
+		s = settings.Settings()
+		s.listenHost = "localhost"
+		s.listenPort = 4322
+		s.stateFile = self.stateFile
+		s.payLogFile = self.payLogFile
+		s.stateBatchDelay = 100.0 #only process at the end of the batch
+		s.shards = shards
+		return node.Node(s)
+
+
+	def closeNode(self):
+		self.node._Node__network.close()
+		self.node._Node__journal.close()
+		self.node.payLog.close()
+		if self.node._Node__shards is not None:
+			self.node._Node__shards.stop()
+			self.node._Node__shards = None
+
+
+	def processBatch(self, msgs):
+		#This is what happens in a network tick:
+		self.node._Node__receivedMessages = deque()
+		for msg in msgs:
+			self.assertEqual(self.node.handleMessage(msg), None)
+		self.node._Node__processReceivedMessages()
+		self.node._Node__receivedMessages = None
+
+
+	def getPayLogLines(self):
+		with open(self.payLogFile, "rb") as f:
+			return f.readlines()
+
+
+	def checkStoredState(self):
+		storedState = journal.Journal(self.stateFile).load()
+		self.assertEqual(storedState["Node"], self.node.getState()["Node"])
+
+
+	def test_processReceivedMessages(self):
+		"Test processing messages of a network tick together"
+
+		payeeID = self.node.handleMessage(messages.PaymentRequest(
+			amount=1234, receipt="foobar"))
+		numRecords = self.node._Node__journal.numRecords
+
+		self.processBatch([
+			messages.Cancel(ID=payeeID),
+			messages.MakeLink(localID="link1", remoteID="remote1")
+			])
+
+		state = self.node.getState()["Node"]
+		self.assertEqual(state["payeeLinks"], {})
+		self.assertEqual(state["links"].keys(), ["link1"])
+		self.assertEqual(len(self.getPayLogLines()), 1)
+
+		#A single commit for the entire batch:
+		self.assertEqual(self.node._Node__journal.numRecords, numRecords + 1)
+		self.checkStoredState()
+
+
+	def test_processReceivedMessages_failure(self):
+		"Test processing messages of a network tick, with a failing message"
+
+		payeeID = self.node.handleMessage(messages.PaymentRequest(
+			amount=1234, receipt="foobar"))
+		payee = self.node._Node__node.payeeLinks[payeeID]
+
+		self.processBatch([
+			messages.Cancel(ID=payeeID),
+			messages.PayerLink_Confirm(ID="nonexistent", agreement=True),
+			messages.MakeLink(localID="link1", remoteID="remote1")
+			])
+
+		#The other messages are processed exactly once:
+		state = self.node.getState()["Node"]
+		self.assertEqual(state["payeeLinks"], {})
+		self.assertEqual(state["links"].keys(), ["link1"])
+		self.assertEqual(payee.state, "cancelled")
+		self.assertEqual(len(self.getPayLogLines()), 1)
+		self.checkStoredState()
+
+
+	def test_processReceivedMessages_failingCommit(self):
+		"Test processing messages of a network tick, with a failing commit"
+
+		payeeID = self.node.handleMessage(messages.PaymentRequest(
+			amount=1234, receipt="foobar"))
+		payee = self.node._Node__node.payeeLinks[payeeID]
+
+		#Make only the first commit fail:
+		j = self.node._Node__journal
+		originalAppend = j.append
+		def failingAppend(changes):
+			j.append = originalAppend
+			raise Exception("Test exception")
+		j.append = failingAppend
+
+		self.processBatch([
+			messages.Cancel(ID=payeeID),
+			messages.MakeLink(localID="link1", remoteID="remote1")
+			])
+
+		#The failed attempt is undone, without writing to the payment log:
+		state = self.node.getState()["Node"]
+		self.assertEqual(state["payeeLinks"], {})
+		self.assertEqual(state["links"].keys(), ["link1"])
+		self.assertEqual(len(self.getPayLogLines()), 1)
+		self.checkStoredState()
+
+
+	def test_rollbackKeepsObjects(self):
+		"Test that a rollback keeps the objects that are referenced by the API"
+
+		payeeID = self.node.handleMessage(messages.PaymentRequest(
+			amount=1234, receipt="foobar"))
+		payee = self.node._Node__node.payeeLinks[payeeID]
+
+		#The batch is rolled back, and then processed one by one:
+		self.processBatch([
+			messages.Confirm(ID=payeeID, meetingPointID="nonexistent"),
+			messages.PayerLink_Confirm(ID="nonexistent", agreement=True)
+			])
+
+		self.assertTrue(self.node._Node__node.payeeLinks[payeeID] is payee)
+
+
+	def test_shardedMode(self):
+		"Test sharded execution mode"
+
+		for ID in ["link1", "link2", "link3"]:
+			self.node.handleMessage(messages.MakeLink(
+				localID=ID, remoteID="remote_" + ID))
+		self.node.handleMessage(messages.Link_Deposit(ID="link1",
+			channel=plainchannel.PlainChannel.makeForOwnDeposit(100)))
+		state = self.node.getState()["Node"]
+		self.closeNode()
+
+		#The links are moved to the shards:
+		self.node = self.makeNode(shards=2)
+		shards = self.node._Node__shards
+		self.assertEqual(self.node._Node__node.links, {})
+		self.assertEqual(self.node._Node__node.connections, {})
+		self.assertEqual(shards.linkIDs, set(["link1", "link2", "link3"]))
+		self.assertEqual(self.node.getState()["Node"], state)
+		self.assertEqual(sorted(shard.findShardFiles(self.stateFile).keys()),
+			[0, 1])
+
+		#Messages for links are processed by the shards:
+		self.node.handleMessage(messages.Link_Deposit(ID="link2",
+			channel=plainchannel.PlainChannel.makeForOwnDeposit(100)))
+		self.assertEqual(
+			len(self.node.getState()["Node"]["links"]["link2"]["channels"]), 0)
+		self.node._Node__runShards()
+		self.assertEqual(
+			len(self.node.getState()["Node"]["links"]["link2"]["channels"]), 1)
+		self.assertEqual(self.node._Node__node.links, {})
+
+		#New links are moved to the shards as well:
+		self.node.handleMessage(messages.MakeLink(
+			localID="link4", remoteID="remote_link4"))
+		self.assertRaises(Exception, self.node.handleMessage,
+			messages.MakeLink(localID="link4", remoteID="remote_link4"))
+		self.node._Node__runShards()
+		self.assertEqual(self.node._Node__node.links, {})
+		self.assertTrue("link4" in shards.linkIDs)
+		self.assertRaises(Exception, self.node.handleMessage,
+			messages.MakeLink(localID="link4", remoteID="remote_link4"))
+
+		#The links are only stored in the shard files:
+		storedState = journal.Journal(self.stateFile).load()
+		self.assertEqual(storedState["Node"]["links"], {})
+		self.assertEqual(storedState["Node"]["connections"], {})
+
+		state = self.node.getState()["Node"]
+		self.closeNode()
+
+		#Back to non-sharded mode: the links are taken from the shard files:
+		self.node = self.makeNode(shards=0)
+		self.assertEqual(self.node.getState()["Node"], state)
+		self.assertEqual(shard.findShardFiles(self.stateFile), {})
+		self.checkStoredState()
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
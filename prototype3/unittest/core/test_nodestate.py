@@ -33,8 +33,11 @@ import testenvironment
 
 from amiko.utils.crypto import RIPEMD160, SHA256
 
+from amiko.channels import plainchannel
+
 from amiko.core import nodestate
-from amiko.core import payeelink, transaction, messages
+from amiko.core import payeelink, payerlink, transaction, messages
+from amiko.core import serializable
 
 
 
@@ -48,6 +51,7 @@ class Test(unittest.TestCase):
 
 		self.assertEqual(self.nodeState.links, {})
 		self.assertEqual(self.nodeState.payeeLinks, {})
+		self.assertEqual(self.nodeState.payerLinks, {})
 		self.assertEqual(self.nodeState.meetingPoints, {})
 		self.assertEqual(self.nodeState.transactions, {})
 
@@ -69,6 +73,282 @@ class Test(unittest.TestCase):
 		#TODO: test ret
 
 
+	def test_msg_makePayer(self):
+		"Test msg_makePayer"
+
+		ret1 = self.nodeState.handleMessage(messages.MakePayer(
+			host="host1", port=1, payeeLinkID="payee1"))
+		ret2 = self.nodeState.handleMessage(messages.MakePayer(
+			host="host2", port=2, payeeLinkID="payee2"))
+
+		self.assertEqual(len(self.nodeState.payerLinks), 2)
+
+		for ret, payeeLinkID in ((ret1, "payee1"), (ret2, "payee2")):
+			self.assertEqual(len(ret), 2)
+			self.assertTrue(isinstance(ret[1], messages.ReturnValue))
+			payerID = ret[1].value
+			self.assertTrue(payerID.startswith(messages.payerIDPrefix))
+
+			payer = self.nodeState.payerLinks[payerID]
+			self.assertEqual(payer.__class__, payerlink.PayerLink)
+			self.assertEqual(payer.ID, payerID)
+			self.assertEqual(payer.payeeLinkID, payeeLinkID)
+
+			connectMessage = self.nodeState.connections[payerID].connectMessage
+			self.assertTrue(isinstance(connectMessage, messages.Pay))
+			self.assertEqual(connectMessage.ID, payeeLinkID)
+			self.assertEqual(connectMessage.callbackID, payerID)
+
+			self.assertTrue(isinstance(ret[0], messages.TimeoutMessage))
+			self.assertEqual(ret[0].ID, payerID)
+			self.assertEqual(ret[0].message.ID, payerID)
+
+		payerID1 = ret1[1].value
+		payerID2 = ret2[1].value
+		self.assertNotEqual(payerID1, payerID2)
+
+		#Messages are passed to the payer with the given ID:
+		self.nodeState.popChanges()
+		self.nodeState.handleMessage(messages.Receipt(
+			ID=payerID2, amount=123, receipt="receipt", transactionID="txID"))
+		self.assertEqual(self.nodeState.payerLinks[payerID1].amount, None)
+		self.assertEqual(self.nodeState.payerLinks[payerID2].amount, 123)
+		self.assertEqual(self.nodeState.popChanges(),
+			set([('payerLinks', payerID2)]))
+
+		self.assertRaises(Exception, self.nodeState.handleMessage,
+			messages.Receipt(ID="__payer__nonexisting"))
+
+
+	def test_msg_makePayer_uniqueID(self):
+		"Test msg_makePayer (unique ID)"
+
+		values = ["\x01"*8, "\x01"*8, "\x02"*8, "\x01"*8, "\x02"*8, "\x03"*8]
+		def getNonSecureRandom(numBytes):
+			return values.pop(0)
+
+		oldFunction = nodestate.randomsource.getNonSecureRandom
+		nodestate.randomsource.getNonSecureRandom = getNonSecureRandom
+		try:
+			ret1 = self.nodeState.handleMessage(messages.MakePayer(
+				host="host1", port=1, payeeLinkID="payee1"))
+			ret2 = self.nodeState.handleMessage(messages.MakePayer(
+				host="host2", port=2, payeeLinkID="payee2"))
+			ret3 = self.nodeState.handleMessage(messages.MakePayer(
+				host="host3", port=3, payeeLinkID="payee3"))
+		finally:
+			nodestate.randomsource.getNonSecureRandom = oldFunction
+
+		self.assertEqual(values, [])
+		self.assertEqual(ret1[1].value, messages.payerIDPrefix + "01"*8)
+		self.assertEqual(ret2[1].value, messages.payerIDPrefix + "02"*8)
+		self.assertEqual(ret3[1].value, messages.payerIDPrefix + "03"*8)
+		self.assertEqual(len(self.nodeState.payerLinks), 3)
+
+
+	def test_convertOldPayerLink(self):
+		"Test convertOldPayerLink"
+
+		payer = payerlink.PayerLink(payeeLinkID="payee1").getState()
+		del payer["ID"]
+		state = self.nodeState.getState()
+		del state["payerLinks"]
+		state["payerLink"] = payer
+		timeoutMessages = serializable.object2State(
+			{
+			"0": messages.TimeoutMessage(
+				message=messages.Timeout(state="initial"),
+				ID=messages.payerIDPrefix),
+			"1": messages.TimeoutMessage(message=messages.Cancel())
+			})
+
+		self.assertTrue(nodestate.convertOldPayerLink(state, timeoutMessages))
+
+		self.assertFalse("payerLink" in state)
+		nodeState = serializable.state2Object(state)
+		self.assertEqual(nodeState.payerLinks.keys(), [messages.payerIDPrefix])
+		payer = nodeState.payerLinks[messages.payerIDPrefix]
+		self.assertEqual(payer.ID, messages.payerIDPrefix)
+		self.assertEqual(payer.payeeLinkID, "payee1")
+		self.assertEqual(timeoutMessages["0"]["message"]["ID"], messages.payerIDPrefix)
+
+		#Already converted:
+		self.assertFalse(nodestate.convertOldPayerLink(state, timeoutMessages))
+
+		#No payment in progress:
+		state = {"payerLink": None}
+		self.assertTrue(nodestate.convertOldPayerLink(state, []))
+		self.assertEqual(state, {})
+
+
+	def test_popChanges(self):
+		"Test popChanges"
+
+		self.assertEqual(self.nodeState.popChanges(), set())
+
+		request = messages.PaymentRequest(amount=1234, receipt="foobar")
+		self.nodeState.handleMessage(request)
+		linkID = self.nodeState.payeeLinks.keys()[0]
+
+		self.assertEqual(self.nodeState.popChanges(),
+			set([('payeeLinks', linkID), ('connections', linkID)]))
+		self.assertEqual(self.nodeState.popChanges(), set())
+
+		self.nodeState.markChanged('payerLinks')
+		self.assertEqual(self.nodeState.popChanges(), set([('payerLinks', None)]))
+
+
+	def test_commitTransaction(self):
+		"Test commitTransaction"
+
+		self.nodeState.beginTransaction()
+		request = messages.PaymentRequest(amount=1234, receipt="foobar")
+		self.nodeState.handleMessage(request)
+		self.nodeState.commitTransaction()
+
+		self.assertEqual(len(self.nodeState.payeeLinks), 1)
+		self.assertEqual(len(self.nodeState.connections), 1)
+
+
+	def test_rollbackTransaction(self):
+		"Test rollbackTransaction"
+
+		self.nodeState.handleMessage(messages.MakeLink(
+			localID="link1", remoteID="remote1"))
+		self.nodeState.payerLinks = "foo"
+		link = self.nodeState.links["link1"]
+		connection = self.nodeState.connections["link1"]
+		oldLinkState = link.getState()
+		oldConnectionState = connection.getState()
+
+		self.nodeState.beginTransaction()
+
+		request = messages.PaymentRequest(amount=1234, receipt="foobar")
+		self.nodeState.handleMessage(request)
+
+		self.nodeState.markChanged('links', 'link1')
+		self.nodeState.links['link1'].remoteID = "remote2"
+		self.nodeState.markChanged('links', 'link1') #second time has no effect
+		self.nodeState.links['link1'].remoteID = "remote3"
+
+		self.nodeState.markChanged('connections', 'link1')
+		del self.nodeState.connections['link1']
+
+		self.nodeState.markChanged('payerLinks')
+		self.nodeState.payerLinks = None
+
+		self.nodeState.rollbackTransaction()
+
+		self.assertEqual(self.nodeState.payeeLinks, {})
+		self.assertEqual(self.nodeState.connections.keys(), ["link1"])
+		self.assertEqual(self.nodeState.links.keys(), ["link1"])
+		self.assertEqual(self.nodeState.links["link1"].getState(), oldLinkState)
+		self.assertEqual(self.nodeState.connections["link1"].getState(),
+			oldConnectionState)
+		self.assertEqual(self.nodeState.payerLinks, "foo")
+
+		#The original objects are restored, not copies of them:
+		self.assertTrue(self.nodeState.links["link1"] is link)
+		self.assertTrue(self.nodeState.connections["link1"] is connection)
+
+		#Without transaction, changes are not undone:
+		self.nodeState.markChanged('payerLinks')
+		self.nodeState.payerLinks = None
+		self.nodeState.beginTransaction()
+		self.nodeState.rollbackTransaction()
+		self.assertEqual(self.nodeState.payerLinks, None)
+
+
+
+	def test_markUpdated(self):
+		"Test markUpdated"
+
+		self.nodeState.handleMessage(messages.MakeLink(
+			localID="link1", remoteID="remote1"))
+		self.nodeState.handleMessage(messages.MakeLink(
+			localID="link2", remoteID="remote2"))
+		self.nodeState.popChanges()
+		self.nodeState.popUpdates()
+		connection = self.nodeState.connections["link1"]
+		oldConnectionState = connection.getState()
+
+		#Outbound messages only change the outbox, so the connection is
+		#updated, not copied:
+		self.nodeState.handleMessage(messages.OutboundMessage(
+			localID="link1", message=messages.Cancel()))
+		self.assertEqual(self.nodeState.popChanges(), set())
+		updates = self.nodeState.popUpdates()
+		self.assertEqual(updates.keys(), [('connections', 'link1')])
+		self.assertEqual(updates[('connections', 'link1')][1][0], 'append')
+		self.assertEqual(self.nodeState.popUpdates(), {})
+
+		#Rollback of an updated and then removed connection:
+		oldConnectionState = connection.getState()
+		self.nodeState.beginTransaction()
+		self.nodeState.handleMessage(messages.OutboundMessage(
+			localID="link1", message=messages.Cancel()))
+		self.nodeState.handleMessage(messages.OutboundMessage(
+			localID="link2", message=messages.Cancel()))
+		self.nodeState.markChanged('connections', 'link1')
+		del self.nodeState.connections['link1']
+		self.nodeState.rollbackTransaction()
+
+		self.assertTrue(self.nodeState.connections['link1'] is connection)
+		self.assertEqual(connection.getState(), oldConnectionState)
+		self.assertEqual(len(self.nodeState.connections['link2'].messages), 0)
+		self.assertEqual(self.nodeState.popUpdates(),
+			{('connections', 'link1'): [], ('connections', 'link2'): []})
+
+		#Commit:
+		self.nodeState.beginTransaction()
+		self.nodeState.handleMessage(messages.OutboundMessage(
+			localID="link2", message=messages.Cancel()))
+		self.nodeState.commitTransaction()
+		self.assertEqual(len(self.nodeState.connections['link2'].messages), 1)
+		self.assertEqual(len(self.nodeState.popUpdates()[('connections', 'link2')]), 3)
+
+
+	def test_shardLinks(self):
+		"Test links that are kept by shards"
+
+		self.nodeState.shardLinkIDs.add("link1")
+
+		self.assertRaises(Exception, self.nodeState.handleMessage,
+			messages.MakeLink(localID="link1", remoteID="remote1"))
+
+		self.nodeState.handleMessage(messages.MakeRoute(
+			transactionID="tx", payerID="payer", payeeID=None))
+		self.assertEqual(
+			self.nodeState.transactions["tx"].remainingLinkIDs, ["link1"])
+		self.nodeState.popChanges()
+
+		#Link method calls are turned into Link_Call messages:
+		msg = messages.HavePayerRoute(ID="link1", transactionID="tx")
+		ret = self.nodeState.handleMessage(msg)
+		self.assertEqual(len(ret), 1)
+		self.assertEqual(ret[0].__class__, messages.Link_Call)
+		self.assertEqual(ret[0].ID, "link1")
+		self.assertEqual(ret[0].method, "handleMessage")
+		self.assertTrue(ret[0].message is msg)
+		self.assertEqual(ret[0].arguments, [])
+		self.assertEqual(self.nodeState.popChanges(), set())
+
+		#...which are handled by the node state that has the link:
+		shardState = nodestate.NodeState()
+		shardState.handleMessage(messages.MakeLink(
+			localID="link1", remoteID="remote1"))
+		shardState.popChanges()
+		ret = shardState.handleMessage(messages.Link_Call(
+			ID="link1", method="handleMessage",
+			message=messages.Link_Deposit(ID="link1",
+				channel=plainchannel.PlainChannel.makeForOwnDeposit(100))
+			))
+		self.assertEqual([m.__class__ for m in ret],
+			[messages.OutboundMessage, messages.OutboundMessage])
+		self.assertEqual(len(shardState.links["link1"].channels), 1)
+		self.assertEqual(shardState.popChanges(), set([('links', 'link1')]))
+
+
 
 if __name__ == "__main__":
 	unittest.main(verbosity=2)
@@ -53,14 +53,16 @@ class Test(unittest.TestCase):
 		self.assertEqual(self.payeeLink.token, "foo")
 		self.assertEqual(self.payeeLink.transactionID, RIPEMD160(SHA256("foo")))
 		self.assertEqual(self.payeeLink.meetingPointID, "")
+		self.assertEqual(self.payeeLink.payerID, None)
 
 
 	def test_msg_pay(self):
 		"Test msg_pay"
 
-		ret = self.payeeLink.handleMessage(messages.Pay(ID="foobar"))
+		ret = self.payeeLink.handleMessage(messages.Pay(ID="foobar", callbackID="__payer__foo"))
 
 		self.assertEqual(self.payeeLink.state, payeelink.PayeeLink.states.initial)
+		self.assertEqual(self.payeeLink.payerID, "__payer__foo")
 
 		self.assertEqual(len(ret), 1)
 		msg = ret[0]
@@ -68,6 +70,7 @@ class Test(unittest.TestCase):
 		self.assertEqual(msg.localID, "foobar")
 		msg = msg.message
 		self.assertTrue(isinstance(msg, messages.Receipt))
+		self.assertEqual(msg.ID, "__payer__foo")
 		self.assertEqual(msg.amount, self.payeeLink.amount)
 		self.assertEqual(msg.receipt, self.payeeLink.receipt)
 		self.assertEqual(msg.transactionID, self.payeeLink.transactionID)
@@ -117,6 +120,7 @@ class Test(unittest.TestCase):
 	def test_msg_havePayeeRoute(self):
 		"Test msg_havePayeeRoute"
 
+		self.payeeLink.payerID = "__payer__foo"
 		ret = self.payeeLink.handleMessage(
 			messages.HavePayeeRoute(ID="foobar", transactionID="bar"))
 
@@ -126,7 +130,7 @@ class Test(unittest.TestCase):
 		self.assertEqual(msg.localID, "foobar")
 		msg = msg.message
 		self.assertTrue(isinstance(msg, messages.HavePayeeRoute))
-		self.assertEqual(msg.ID, "__payer__")
+		self.assertEqual(msg.ID, "__payer__foo")
 		self.assertEqual(msg.transactionID, None)
 
 
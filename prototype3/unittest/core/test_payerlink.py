@@ -42,12 +42,14 @@ from amiko.core import payerlink
 
 class Test(unittest.TestCase):
 	def setUp(self):
-		self.payerLink = payerlink.PayerLink()
+		self.payerLink = payerlink.PayerLink(ID="__payer__foo")
 
 
 	def test_defaultAttributes(self):
 		"Test default attributes"
 
+		self.payerLink = payerlink.PayerLink()
+		self.assertEqual(self.payerLink.ID, '')
 		self.assertEqual(self.payerLink.payeeHost, None)
 		self.assertEqual(self.payerLink.payeePort, None)
 		self.assertEqual(self.payerLink.payeeLinkID, None)
@@ -63,6 +65,7 @@ class Test(unittest.TestCase):
 		"Test deep copy operator"
 
 		self.payerLink = payerlink.PayerLink(
+			ID             = "ID",
 			payeeHost      = "payeeHost",
 			payeePort      = "payeePort",
 			payeeLinkID    = "payeeLinkID",
@@ -74,6 +77,7 @@ class Test(unittest.TestCase):
 			state          = "state"
 			)
 		payer2 = copy.deepcopy(self.payerLink)
+		self.assertEqual(payer2.ID             , "ID")
 		self.assertEqual(payer2.payeeHost      , "payeeHost")
 		self.assertEqual(payer2.payeePort      , "payeePort")
 		self.assertEqual(payer2.payeeLinkID    , "payeeLinkID")
@@ -90,6 +94,7 @@ class Test(unittest.TestCase):
 
 		msg = self.payerLink.getTimeoutMessage()
 		self.assertTrue(isinstance(msg, messages.Timeout))
+		self.assertEqual(msg.ID, "__payer__foo")
 		self.assertEqual(msg.state, payerlink.PayerLink.states.initial)
 
 		self.payerLink.state = payerlink.PayerLink.states.receivedCommit
@@ -210,7 +215,7 @@ class Test(unittest.TestCase):
 		self.assertEqual(len(ret), 2)
 		msg = ret[0]
 		self.assertTrue(isinstance(msg, messages.OutboundMessage))
-		self.assertEqual(msg.localID, messages.payerLocalID)
+		self.assertEqual(msg.localID, "__payer__foo")
 		msg = msg.message
 		self.assertTrue(isinstance(msg, messages.Confirm))
 		self.assertEqual(msg.ID, None)
@@ -222,7 +227,7 @@ class Test(unittest.TestCase):
 		#self.assertEqual(msg.startTime, None) #TODO
 		#self.assertEqual(msg.endTime, None) #TODO
 		self.assertEqual(msg.meetingPointID, self.payerLink.meetingPointID)
-		self.assertEqual(msg.payerID, messages.payerLocalID)
+		self.assertEqual(msg.payerID, "__payer__foo")
 		self.assertEqual(msg.payeeID, None)
 
 		self.payerLink.state = payerlink.PayerLink.states.hasReceipt
@@ -234,7 +239,7 @@ class Test(unittest.TestCase):
 		self.assertEqual(len(ret), 1)
 		msg = ret[0]
 		self.assertTrue(isinstance(msg, messages.OutboundMessage))
-		self.assertEqual(msg.localID, messages.payerLocalID)
+		self.assertEqual(msg.localID, "__payer__foo")
 		msg = msg.message
 		self.assertTrue(isinstance(msg, messages.Cancel))
 		self.assertEqual(msg.ID, None)
@@ -245,7 +250,7 @@ class Test(unittest.TestCase):
 
 		self.assertRaises(Exception, self.payerLink.handleMessage,
 			messages.HavePayerRoute(
-				ID=messages.payerLocalID,
+				ID="__payer__foo",
 				transactionID=self.payerLink.transactionID
 				))
 
@@ -253,7 +258,7 @@ class Test(unittest.TestCase):
 
 		ret = self.payerLink.handleMessage(
 			messages.HavePayerRoute(
-				ID=messages.payerLocalID,
+				ID="__payer__foo",
 				transactionID=self.payerLink.transactionID
 				))
 
@@ -265,7 +270,7 @@ class Test(unittest.TestCase):
 
 		ret = self.payerLink.handleMessage(
 			messages.HavePayerRoute(
-				ID=messages.payerLocalID,
+				ID="__payer__foo",
 				transactionID=self.payerLink.transactionID
 				))
 
@@ -282,7 +287,7 @@ class Test(unittest.TestCase):
 
 		self.assertRaises(Exception, self.payerLink.handleMessage,
 			messages.HavePayeeRoute(
-				ID=messages.payerLocalID,
+				ID="__payer__foo",
 				transactionID=self.payerLink.transactionID
 				))
 
@@ -290,7 +295,7 @@ class Test(unittest.TestCase):
 
 		ret = self.payerLink.handleMessage(
 			messages.HavePayeeRoute(
-				ID=messages.payerLocalID,
+				ID="__payer__foo",
 				transactionID=self.payerLink.transactionID
 				))
 
@@ -302,7 +307,7 @@ class Test(unittest.TestCase):
 
 		ret = self.payerLink.handleMessage(
 			messages.HavePayeeRoute(
-				ID=messages.payerLocalID,
+				ID="__payer__foo",
 				transactionID=self.payerLink.transactionID
 				))
 
@@ -338,6 +343,7 @@ class Test(unittest.TestCase):
 		self.assertEqual(len(ret), 1)
 		msg = ret[0]
 		self.assertTrue(isinstance(msg, messages.TimeoutMessage))
+		self.assertEqual(msg.ID, "__payer__foo")
 		msg = msg.message
 		self.assertTrue(isinstance(msg, messages.Timeout))
 		self.assertEqual(msg.state, payerlink.PayerLink.states.receivedCommit)
@@ -28,12 +28,15 @@
 #    OpenSSL library used as well as that of the covered work.
 
 import unittest
+from collections import deque
 
 import testenvironment
 
 from dummy_interfaces import DummyNetwork
 
 from amiko.core import messages
+from amiko.core import serializable
+from amiko.core import journal
 
 from amiko.core import persistentconnection
 
@@ -49,12 +52,30 @@ class Test(unittest.TestCase):
 		self.assertEqual(self.connection.host, None)
 		self.assertEqual(self.connection.port, None)
 		self.assertEqual(self.connection.connectMessage, None)
-		self.assertEqual(self.connection.messages, [])
+		self.assertEqual(self.connection.messages, deque())
 		self.assertEqual(self.connection.lastIndex, -1)
 		self.assertEqual(self.connection.notYetTransmitted, 0)
 		self.assertEqual(self.connection.closing, False)
 
 
+	def test_state(self):
+		"Test conversion to and from state"
+
+		self.connection.handleMessage(messages.OutboundMessage(
+			localID="localID", message=messages.Cancel()))
+		state = self.connection.getState()
+		self.assertEqual(type(state["messages"]), list)
+		self.assertEqual(state["messages"][0]["index"], 0)
+
+		connection = serializable.state2Object(state)
+		self.assertEqual(type(connection.messages), deque)
+		self.assertEqual(connection.messages[0].index, 0)
+
+		connection = serializable.deserialize(serializable.serialize(self.connection))
+		self.assertEqual(type(connection.messages), deque)
+		self.assertEqual(connection.messages[0].index, 0)
+
+
 	def test_addMessage_fullOutbox(self):
 		"Test addMessage (full outbox)"
 
@@ -100,7 +121,7 @@ class Test(unittest.TestCase):
 			self.assertEqual(msg.index, i)
 			self.assertEqual(msg.message.getState(), msgInState)
 
-			self.connection.messages = []
+			self.connection.messages = deque()
 			self.connection.notYetTransmitted = 0
 
 		self.connection.handleMessage(msgIn)
@@ -116,31 +137,41 @@ class Test(unittest.TestCase):
 	def test_processConfirmation(self):
 		"Test processConfirmation"
 
-		self.connection.messages = \
+		self.connection.messages = deque(
 		[
-		persistentconnection.PersistentConnectionMessage(index=1000),
-		persistentconnection.PersistentConnectionMessage(index=1001),
-		persistentconnection.PersistentConnectionMessage(index=1002),
+		persistentconnection.PersistentConnectionMessage(index=65533),
+		persistentconnection.PersistentConnectionMessage(index=65534),
+		persistentconnection.PersistentConnectionMessage(index=65535),
+		persistentconnection.PersistentConnectionMessage(index=0),
 		persistentconnection.PersistentConnectionMessage(index=1),
 		persistentconnection.PersistentConnectionMessage(index=2),
 		persistentconnection.PersistentConnectionMessage(index=3),
-		persistentconnection.PersistentConnectionMessage(index=4),
-		persistentconnection.PersistentConnectionMessage(index=0)
-		]
+		persistentconnection.PersistentConnectionMessage(index=4)
+		])
 
-		self.connection.handleMessage(messages.Confirmation(index=2))
+		self.connection.handleMessage(messages.Confirmation(index=1))
 
 		self.assertEqual(len(self.connection.messages), 3)
-		self.assertEqual(self.connection.messages[0].index, 3)
-		self.assertEqual(self.connection.messages[1].index, 4)
-		self.assertEqual(self.connection.messages[2].index, 0)
+		self.assertEqual(self.connection.messages[0].index, 2)
+		self.assertEqual(self.connection.messages[1].index, 3)
+		self.assertEqual(self.connection.messages[2].index, 4)
 
-		self.connection.handleMessage(messages.Confirmation(index=1))
+		#Already confirmed:
+		self.connection.handleMessage(messages.Confirmation(index=65534))
 
 		self.assertEqual(len(self.connection.messages), 3)
-		self.assertEqual(self.connection.messages[0].index, 3)
-		self.assertEqual(self.connection.messages[1].index, 4)
-		self.assertEqual(self.connection.messages[2].index, 0)
+		self.assertEqual(self.connection.messages[0].index, 2)
+		self.assertEqual(self.connection.messages[1].index, 3)
+		self.assertEqual(self.connection.messages[2].index, 4)
+
+		self.connection.handleMessage(messages.Confirmation(index=4))
+
+		self.assertEqual(len(self.connection.messages), 0)
+
+		#Empty outbox:
+		self.connection.handleMessage(messages.Confirmation(index=4))
+
+		self.assertEqual(len(self.connection.messages), 0)
 
 
 	def test_handleMessage_otherMessageType(self):
@@ -164,7 +195,7 @@ class Test(unittest.TestCase):
 		network = DummyNetwork()
 		network.interfaceExistsReturnValue = False
 
-		self.connection.messages = \
+		self.connection.messages = deque(
 		[
 		persistentconnection.PersistentConnectionMessage(
 			index=1,
@@ -178,7 +209,7 @@ class Test(unittest.TestCase):
 			index=3,
 			message=messages.OutboundMessage(localID="localID")
 			)
-		]
+		])
 
 		self.connection.closing = False
 		self.connection.notYetTransmitted = 1
@@ -211,8 +242,9 @@ class Test(unittest.TestCase):
 		"Test transmit (open connection)"
 		network = DummyNetwork()
 		network.interfaceExistsReturnValue = True
+		network.isSendBufferFullReturnValue = False
 
-		self.connection.messages = \
+		self.connection.messages = deque(
 		[
 		persistentconnection.PersistentConnectionMessage(
 			index=1,
@@ -226,7 +258,7 @@ class Test(unittest.TestCase):
 			index=3,
 			message=messages.OutboundMessage(localID="localID")
 			)
-		]
+		])
 
 		self.connection.notYetTransmitted = 0
 
@@ -244,13 +276,91 @@ class Test(unittest.TestCase):
 		self.assertEqual(network.trace,
 			[
 			('interfaceExists', ('localID',), {}),
+			('isSendBufferFull', ('localID',), {}),
 			('sendOutboundMessage', (2, self.connection.messages[1].message), {}),
+			('isSendBufferFull', ('localID',), {}),
 			('sendOutboundMessage', (3, self.connection.messages[2].message), {})
 			])
 		self.assertEqual(len(self.connection.messages), 3)
 		self.assertEqual(self.connection.notYetTransmitted, 0)
 
 
+	def test_transmit_window(self):
+		"Test transmit (window)"
+		network = DummyNetwork()
+		network.interfaceExistsReturnValue = True
+		network.isSendBufferFullReturnValue = False
+
+		for i in range(10):
+			self.connection.handleMessage(messages.OutboundMessage(
+				localID="localID", message=messages.Cancel()))
+
+		def sentIndices():
+			ret = [t[1][0] for t in network.trace if t[0] == 'sendOutboundMessage']
+			network.trace = []
+			return ret
+
+		self.assertTrue(self.connection.transmit(network, windowSize=4))
+		self.assertEqual(sentIndices(), [0, 1, 2, 3])
+		self.assertEqual(self.connection.notYetTransmitted, 6)
+
+		#Window is full:
+		self.assertFalse(self.connection.transmit(network, windowSize=4))
+		self.assertEqual(sentIndices(), [])
+
+		#Confirmation makes room:
+		self.connection.handleMessage(messages.Confirmation(index=1))
+		self.assertTrue(self.connection.transmit(network, windowSize=4))
+		self.assertEqual(sentIndices(), [4, 5])
+
+		#After re-connecting, continue with the first unconfirmed message:
+		network.interfaceExistsReturnValue = False
+		self.assertTrue(self.connection.transmit(network, windowSize=4))
+		self.assertEqual(self.connection.notYetTransmitted, 8)
+		network.interfaceExistsReturnValue = True
+		self.assertTrue(self.connection.transmit(network, windowSize=4))
+		self.assertEqual(sentIndices(), [2, 3, 4, 5])
+
+		#Full send buffer:
+		self.connection.handleMessage(messages.Confirmation(index=5))
+		network.isSendBufferFullReturnValue = True
+		self.assertFalse(self.connection.transmit(network, windowSize=4))
+		self.assertEqual(sentIndices(), [])
+		network.isSendBufferFullReturnValue = False
+		self.assertTrue(self.connection.transmit(network, windowSize=4))
+		self.assertEqual(sentIndices(), [6, 7, 8, 9])
+		self.assertEqual(self.connection.notYetTransmitted, 0)
+
+
+	def test_transmit_confirmNotTransmitted(self):
+		"Test transmit (confirmation of a not yet transmitted message)"
+		network = DummyNetwork()
+		network.interfaceExistsReturnValue = True
+		network.isSendBufferFullReturnValue = False
+
+		for i in range(5):
+			self.connection.handleMessage(messages.OutboundMessage(
+				localID="localID", message=messages.Cancel()))
+
+		def sentIndices():
+			ret = [t[1][0] for t in network.trace if t[0] == 'sendOutboundMessage']
+			network.trace = []
+			return ret
+
+		self.assertTrue(self.connection.transmit(network, windowSize=2))
+		self.assertEqual(sentIndices(), [0, 1])
+		self.assertEqual(self.connection.notYetTransmitted, 3)
+
+		#Message 3 was never transmitted:
+		self.connection.handleMessage(messages.Confirmation(index=3))
+		self.assertEqual(len(self.connection.messages), 1)
+		self.assertEqual(self.connection.notYetTransmitted, 1)
+
+		self.assertTrue(self.connection.transmit(network))
+		self.assertEqual(sentIndices(), [4])
+		self.assertEqual(self.connection.notYetTransmitted, 0)
+
+
 	def test_close(self):
 		"Test close"
 
@@ -263,21 +373,119 @@ class Test(unittest.TestCase):
 		"Test canBeClosed"
 
 		self.connection.closing = False
-		self.connection.messages = []
+		self.connection.messages = deque()
 
 		self.assertFalse(self.connection.canBeClosed())
 
 		self.connection.closing = True
-		self.connection.messages = [1,2,3]
+		self.connection.messages = deque([1,2,3])
 
 		self.assertFalse(self.connection.canBeClosed())
 
 		self.connection.closing = True
-		self.connection.messages = []
+		self.connection.messages = deque()
 
 		self.assertTrue(self.connection.canBeClosed())
 
 
+	def test_popChanges(self):
+		"Test popChanges"
+
+		network = DummyNetwork()
+		network.interfaceExistsReturnValue = True
+		network.isSendBufferFullReturnValue = False
+
+		self.assertEqual(self.connection.popChanges(), [])
+
+		def applyChanges(state, changes):
+			#Same conversion as done by the journal:
+			changes = serializable.deserializeState(
+				serializable.serializeState([list(c) for c in changes]))
+			state = {"c": state}
+			for change in changes:
+				journal.applyChange(state, *journal.prefixChange(["c"], change))
+			return state["c"]
+
+		def getChangeSize(outboxSize):
+			self.connection = persistentconnection.PersistentConnection()
+			for i in range(outboxSize):
+				self.connection.handleMessage(messages.OutboundMessage(
+					localID="localID", message=messages.Cancel()))
+			self.connection.popChanges()
+			oldState = self.connection.getState()
+
+			self.connection.handleMessage(messages.OutboundMessage(
+				localID="localID", message=messages.Cancel()))
+			self.connection.transmit(network)
+			self.connection.handleMessage(messages.Confirmation(index=0))
+			changes = self.connection.popChanges()
+
+			#The changes lead to the new state:
+			self.assertEqual(applyChanges(oldState, changes),
+				self.connection.getState())
+
+			return len(serializable.serializeState([list(c) for c in changes]))
+
+		#The size of the changes does not depend on the size of the outbox
+		#(the sizes are chosen such that the indices have the same length):
+		self.assertEqual(getChangeSize(1000), getChangeSize(5000))
+
+		self.connection.connectMessage = messages.ConnectLink(ID="foo")
+		self.connection.setConnectTarget("host", 1234, "bar")
+		self.connection.close()
+		self.assertEqual(self.connection.popChanges(),
+			[
+			(["host"], "host"),
+			(["port"], 1234),
+			(["connectMessage", "ID"], "bar"),
+			(["closing"], True)
+			])
+
+
+	def test_rollbackTransaction(self):
+		"Test rollbackTransaction"
+
+		network = DummyNetwork()
+		network.interfaceExistsReturnValue = True
+		network.isSendBufferFullReturnValue = False
+
+		self.connection.connectMessage = messages.ConnectLink(ID="foo")
+		for i in range(3):
+			self.connection.handleMessage(messages.OutboundMessage(
+				localID="localID", message=messages.Cancel()))
+		self.connection.transmit(network)
+		changes = self.connection.popChanges()
+		self.connection.handleMessage(messages.OutboundMessage(
+			localID="localID", message=messages.Cancel()))
+		oldState = self.connection.getState()
+
+		self.connection.beginTransaction()
+		self.connection.handleMessage(messages.Confirmation(index=1))
+		for i in range(2):
+			self.connection.handleMessage(messages.OutboundMessage(
+				localID="localID", message=messages.Cancel()))
+		self.connection.transmit(network)
+		self.connection.setConnectTarget("host", 1234, "bar")
+		self.connection.close()
+		self.connection.rollbackTransaction()
+
+		self.assertEqual(self.connection.getState(), oldState)
+		self.assertEqual(type(self.connection.messages), deque)
+
+		#Only the change made before the transaction remains:
+		changes = self.connection.popChanges()
+		self.assertEqual(len(changes), 3)
+		self.assertEqual(changes[1][0], 'append')
+
+		#Commit keeps the changes:
+		self.connection.beginTransaction()
+		self.connection.handleMessage(messages.Confirmation(index=1))
+		self.connection.commitTransaction()
+		self.assertEqual(len(self.connection.messages), 2)
+		self.assertEqual(self.connection.popChanges(),
+			[('popleft', ['messages'], 2)])
+
+
 
 if __name__ == "__main__":
 	unittest.main(verbosity=2)
@@ -42,10 +42,17 @@ class C(serializable.Serializable):
 
 class Test(unittest.TestCase):
 	def setUp(self):
+		#Other tests need the original classes, so restore them afterwards:
+		self.registeredClasses = serializable.registeredClasses
+
 		serializable.registeredClasses = {}
 		serializable.registerClass(C)
 
 
+	def tearDown(self):
+		serializable.registeredClasses = self.registeredClasses
+
+
 	def test_registerClassNameCollision(self):
 		"Test registerClass name collision"
 
@@ -58,6 +65,27 @@ class Test(unittest.TestCase):
 		self.assertEqual(serializable.registeredClasses, {'C': C})
 
 
+	def test_constructor(self):
+		"Test constructor"
+
+		x = {'a': [1, 2]}
+		obj = C(x=x)
+		self.assertTrue(obj.x is x) #ownership is transferred: no copy
+		self.assertEqual(obj.y, 2)
+
+		class D(serializable.Serializable):
+			serializableAttributes = {'x': {}, 'y': []}
+		serializable.registerClass(D)
+
+		obj1 = D()
+		obj2 = D()
+		obj1.x['a'] = 1
+		obj1.y.append(2)
+		self.assertEqual(obj2.x, {}) #mutable defaults are not shared
+		self.assertEqual(obj2.y, [])
+		self.assertEqual(D.serializableAttributes, {'x': {}, 'y': []})
+
+
 	def test_object2State(self):
 		"Test object2State"
 
@@ -95,6 +123,21 @@ class Test(unittest.TestCase):
 		self.assertEqual(obj.y[1], 4)
 
 
+	def test_restoreState(self):
+		"Test restoreState"
+
+		obj = C(x=3, y=4)
+		obj.z = 'other' #not serializable
+		state = serializable.object2State(obj)
+		obj.x = 5
+		obj.y = [6]
+
+		serializable.restoreState(obj, state)
+		self.assertEqual(obj.x, 3)
+		self.assertEqual(obj.y, 4)
+		self.assertEqual(obj.z, 'other')
+
+
 	def test_deserialize(self):
 		"Test deserialize"
 
@@ -114,6 +157,43 @@ class Test(unittest.TestCase):
 		self.assertRaises(Exception, serializable.deserialize, '"!foo"')
 
 
+	def test_registerClass_invalidAttributeName(self):
+		"Test registerClass with invalid attribute name"
+
+		class D(serializable.Serializable):
+			serializableAttributes = {'x y': 1}
+
+		self.assertRaises(Exception, serializable.registerClass, D)
+
+
+	def test_state2Object_unregisteredClass(self):
+		"Test state2Object with unregistered class"
+
+		self.assertRaises(KeyError, serializable.state2Object, {'_class':'D'})
+
+
+	def test_encodeStrings(self):
+		"Test encodeStrings"
+
+		self.assertEqual(serializable.encodeStrings(
+			{'a': ['\xff\x00', '!bar', 'foo', '', u'\xff'], '\x01': 4, 'c': C()}),
+			{'a': ['!xff00', '!!bar', 'foo', '', u'\xff'], '!x01': 4,
+				'c': {'_class': 'C', 'x': 1, 'y': 2}}
+			)
+
+
+	def test_decodeStrings(self):
+		"Test decodeStrings"
+
+		state = serializable.decodeStrings(
+			{u'a': [u'!xff00', u'!!bar', u'foo', u'!'], u'!x01': {u'_class': u'C'}})
+		self.assertEqual(state,
+			{'a': ['\xff\x00', '!bar', 'foo', '!'], '\x01': {'_class': 'C'}})
+		self.assertEqual(type(state['a'][2]), str)
+
+		self.assertRaises(Exception, serializable.decodeStrings, u'!foo')
+
+
 	def test_getState(self):
 		"Test getState"
 
@@ -68,8 +68,18 @@ class Test(unittest.TestCase):
 		self.assertEqual(s.listenPort, 4321)
 		self.assertEqual(s.advertizedHost, '')
 		self.assertEqual(s.advertizedPort, 4321)
+		self.assertEqual(s.wireFormat, 'binary')
+		self.assertEqual(s.maxMessageSize, 1048576)
+		self.assertEqual(s.ackCount, 16)
+		self.assertEqual(s.ackDelay, 0.01)
+		self.assertEqual(s.sendWindow, 256)
+		self.assertEqual(s.maxSendBuffer, 262144)
 		self.assertEqual(s.stateFile, 'amikopay.dat')
 		self.assertEqual(s.payLogFile, 'payments.log')
+		self.assertEqual(s.stateJournalSize, 1000)
+		self.assertEqual(s.stateSyncInterval, 0.05)
+		self.assertEqual(s.stateBatchDelay, 0.01)
+		self.assertEqual(s.shards, 0)
 		self.assertEqual(s.acceptedEscrowKeys, [])
 		self.assertEqual(s.externalMeetingPoints, [])
 		self.assertEqual(s.bitcoinRPCURL, '')
@@ -81,8 +91,18 @@ class Test(unittest.TestCase):
 		self.assertEqual(s.listenPort, 12345)
 		self.assertEqual(s.advertizedHost, 'test_advertized_host')
 		self.assertEqual(s.advertizedPort, 2468)
+		self.assertEqual(s.wireFormat, 'json')
+		self.assertEqual(s.maxMessageSize, 1000)
+		self.assertEqual(s.ackCount, 5)
+		self.assertEqual(s.ackDelay, 0.25)
+		self.assertEqual(s.sendWindow, 7)
+		self.assertEqual(s.maxSendBuffer, 2000)
 		self.assertEqual(s.stateFile, 'test_state_file')
 		self.assertEqual(s.payLogFile, 'test_log_file')
+		self.assertEqual(s.stateJournalSize, 42)
+		self.assertEqual(s.stateSyncInterval, 0.5)
+		self.assertEqual(s.stateBatchDelay, 0.125)
+		self.assertEqual(s.shards, 3)
 		self.assertEqual(s.acceptedEscrowKeys, ['\xde\xad\xbe\xef', '\x01\x23\x45\x67'])
 		self.assertEqual(s.externalMeetingPoints, ['MP1', 'MP2'])
 		self.assertEqual(s.bitcoinRPCURL, 'test_rpc_url')
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#    test_shard.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+
+import unittest
+import os
+
+import testenvironment
+
+from dummy_interfaces import DummyNetwork
+
+from amiko.channels import plainchannel
+
+from amiko.core import messages
+from amiko.core import nodestate
+from amiko.core import serializable
+from amiko.core import settings
+
+from amiko.core import shard
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		self.stateFile = "test_shard.dat"
+		self.removeFiles()
+
+		self.settings = settings.Settings()
+		self.settings.stateFile = self.stateFile
+		self.settings.shards = 2
+
+
+	def tearDown(self):
+		self.removeFiles()
+
+
+	def removeFiles(self):
+		for filename in shard.findShardFiles(self.stateFile).values():
+			shard.removeShardFile(filename)
+
+
+	def makeLinks(self, IDs):
+		"""
+		Return value:
+		links with the given IDs, in the format of adoptLinks
+		"""
+
+		n = nodestate.NodeState()
+		links = {}
+		for ID in IDs:
+			n.handleMessage(messages.MakeLink(
+				localID=ID, remoteID="remote_" + ID,
+				remoteHost="localhost", remotePort=4321))
+			links[ID] = \
+			(
+			serializable.object2State(n.links[ID]),
+			serializable.object2State(n.connections[ID])
+			)
+		return links
+
+
+	def makeDeposit(self, ID):
+		return messages.Link_Deposit(ID=ID,
+			channel=plainchannel.PlainChannel.makeForOwnDeposit(100))
+
+
+	def test_getShardIndex(self):
+		"Test getShardIndex"
+
+		IDs = ["link%d" % i for i in range(100)]
+		indices = [shard.getShardIndex(ID, 4) for ID in IDs]
+		self.assertEqual(set(indices), set([0, 1, 2, 3]))
+
+		#Must be the same in every process and every run:
+		self.assertEqual(shard.getShardIndex("link2", 4), 2)
+		self.assertEqual(shard.getShardIndex("link4", 4), 3)
+
+
+	def test_getMessageTarget(self):
+		"Test getMessageTarget"
+
+		self.assertEqual(shard.getMessageTarget(
+			messages.ChannelMessage(ID="link1")), "link1")
+		self.assertEqual(shard.getMessageTarget(
+			messages.Link_Call(ID="link1", method="lockIncoming")), "link1")
+		self.assertEqual(shard.getMessageTarget(
+			messages.Confirmation(localID="link1", index=3)), "link1")
+		self.assertEqual(shard.getMessageTarget(
+			messages.PaymentRequest(amount=1, receipt="foo")), None)
+
+
+	def test_findShardFiles(self):
+		"Test findShardFiles"
+
+		for f in ["test_shard.dat.shard0", "test_shard.dat.shard3.old",
+			"test_shard.dat.shard1.journal", "test_shard.dat.shardx"]:
+				with open(f, "wb") as fp:
+					pass
+
+		self.assertEqual(shard.findShardFiles(self.stateFile),
+			{0: "test_shard.dat.shard0", 3: "test_shard.dat.shard3"})
+
+		#Also removes the journal of shard 1:
+		for f in ["test_shard.dat.shard1", "test_shard.dat.shardx"]:
+			shard.removeShardFile(f)
+		self.assertFalse(os.access("test_shard.dat.shard1.journal", os.F_OK))
+
+
+	def test_ShardWorker(self):
+		"Test ShardWorker"
+
+		worker = shard.ShardWorker(0, self.settings)
+		worker.request_adoptLinks(self.makeLinks(["link1"]))
+		self.assertEqual(worker.request_getLinks(1), (["link1"], {}))
+
+		#Not connected:
+		returned, sent, closed = worker.request_process(
+			[serializable.object2State(self.makeDeposit("link1"))], {})
+		self.assertEqual((returned, sent, closed), ([], [], []))
+
+		#Send buffer is full:
+		returned, sent, closed = worker.request_process(
+			[], {"link1": (True, True)})
+		self.assertEqual((returned, sent, closed), ([], [], []))
+
+		returned, sent, closed = worker.request_process(
+			[], {"link1": (True, False)})
+		self.assertEqual((returned, closed), ([], []))
+		sent = [(i, serializable.state2Object(s)) for i, s in sent]
+		self.assertEqual([i for i, msg in sent], [0, 1])
+		self.assertEqual([msg.localID for i, msg in sent], ["link1", "link1"])
+		self.assertEqual([msg.message.__class__ for i, msg in sent],
+			[messages.Deposit, messages.ChannelMessage])
+
+		#Messages for other links are returned:
+		msg = messages.Link_Call(ID="link2", method="lockIncoming")
+		returned, sent, closed = worker.request_process(
+			[serializable.object2State(msg)], {})
+		self.assertEqual(returned, [serializable.object2State(msg)])
+
+		#Failing messages are ignored:
+		returned, sent, closed = worker.request_process(
+			[serializable.object2State(messages.Link_Call(
+				ID="link1", method="nonexistent"))],
+			{})
+		self.assertEqual(returned, [])
+
+		state = worker.request_getState()
+		self.assertEqual(len(state["links"]["link1"]["channels"]), 1)
+		self.assertEqual(worker.request_getConnectTarget("link1"),
+			("localhost", 4321, state["connections"]["link1"]["connectMessage"]))
+		worker.request_stop()
+
+		#The state is stored:
+		worker = shard.ShardWorker(0, self.settings)
+		self.assertEqual(worker.request_getState(), state)
+
+		#A link that belongs to another shard:
+		strayID = [ID for ID in state["links"].keys()
+			if shard.getShardIndex(ID, 3) != 0]
+		self.assertEqual(strayID, ["link1"])
+		IDs, strayLinks = worker.request_getLinks(3)
+		self.assertEqual(IDs, ["link1"])
+		self.assertEqual(strayLinks.keys(), ["link1"])
+		self.assertEqual(strayLinks["link1"],
+			(state["links"]["link1"], state["connections"]["link1"]))
+
+		worker.request_removeLinks(["link1"])
+		self.assertEqual(worker.request_getLinks(1), ([], {}))
+		worker.request_stop()
+
+
+	def test_Shards(self):
+		"Test Shards"
+
+		IDs = ["link1", "link2", "link3", "link4", "link5"]
+
+		shards = shard.Shards(self.settings)
+		try:
+			shards.adoptLinks(self.makeLinks(IDs))
+			self.assertEqual(shards.linkIDs, set(IDs))
+
+			self.assertTrue(shards.isShardMessage(self.makeDeposit("link1")))
+			self.assertFalse(shards.isShardMessage(self.makeDeposit("link6")))
+			self.assertFalse(shards.isShardMessage(
+				messages.PaymentRequest(amount=1, receipt="foo")))
+
+			network = DummyNetwork()
+			network.interfaceExistsReturnValue = True
+			network.isSendBufferFullReturnValue = False
+
+			shards.addMessages([self.makeDeposit(ID) for ID in IDs])
+			for ID in IDs:
+				shards.setInterfaceStatus(ID, network)
+			self.assertTrue(shards.hasPendingWork())
+
+			self.assertEqual(shards.process(network), [])
+			self.assertFalse(shards.hasPendingWork())
+
+			sent = [(args[1].localID, args[0], args[1].message.__class__)
+				for name, args, kwargs in network.trace
+				if name == "sendOutboundMessage"]
+			self.assertEqual(sorted(sent),
+				sorted([(ID, 0, messages.Deposit) for ID in IDs] + \
+				[(ID, 1, messages.ChannelMessage) for ID in IDs]))
+
+			states = shards.getStates()
+			for index, state in enumerate(states):
+				for ID in state["links"].keys():
+					self.assertEqual(shard.getShardIndex(ID, 2), index)
+			self.assertEqual(
+				sorted(states[0]["links"].keys() + states[1]["links"].keys()),
+				IDs)
+		finally:
+			shards.stop()
+
+		#Changing the number of shards:
+		self.settings.shards = 3
+		shards = shard.Shards(self.settings)
+		try:
+			self.assertEqual(shards.linkIDs, set(IDs))
+			states = shards.getStates()
+			for index, state in enumerate(states):
+				for ID in state["links"].keys():
+					self.assertEqual(shard.getShardIndex(ID, 3), index)
+			self.assertEqual(
+				sorted(sum([s["links"].keys() for s in states], [])), IDs)
+			for state in states:
+				for link in state["links"].values():
+					self.assertEqual(len(link["channels"]), 1)
+		finally:
+			shards.stop()
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#    test_timeoutqueue.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+
+import testenvironment
+
+from amiko.core import messages
+from amiko.core import timeoutqueue
+
+
+
+def makeMessage(timestamp, ID=None):
+	return messages.TimeoutMessage(
+		timestamp=timestamp, message=messages.Timeout(state=str(timestamp)),
+		ID=ID)
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		self.queue = timeoutqueue.TimeoutQueue()
+
+
+	def popAll(self, now):
+		ret = []
+		while True:
+			msg = self.queue.popDue(now)
+			if msg is None:
+				return ret
+			ret.append(msg.timestamp)
+
+
+	def test_order(self):
+		"Test order of time-out messages"
+
+		for t in [3.5, 1.25, 2.0, 1.5, 10.0, 1.0]:
+			self.queue.add(makeMessage(t))
+		self.assertEqual(len(self.queue), 6)
+		self.assertEqual(self.queue.getNextTimestamp(), 1.0)
+
+		#Sub-second differences are respected; time stamps must be in the past:
+		self.assertEqual(self.popAll(3.5), [1.0, 1.25, 1.5, 2.0])
+		self.assertEqual(len(self.queue), 2)
+		self.assertEqual(self.queue.getNextTimestamp(), 3.5)
+
+		self.assertEqual(self.popAll(100.0), [3.5, 10.0])
+		self.assertEqual(self.queue.getNextTimestamp(), None)
+		self.assertEqual(self.queue.popDue(100.0), None)
+
+
+	def test_cancel(self):
+		"Test cancel"
+
+		key1 = self.queue.add(makeMessage(1.0))
+		key2 = self.queue.add(makeMessage(2.0))
+		self.assertNotEqual(key1, key2)
+
+		self.queue.cancel(key1)
+		self.queue.cancel(key1) #no effect
+		self.assertEqual(len(self.queue), 1)
+		self.assertEqual(self.queue.getMessage(key1), None)
+		self.assertEqual(self.queue.getNextTimestamp(), 2.0)
+		self.assertEqual(self.popAll(100.0), [2.0])
+
+		#Many cancelled messages:
+		keys = [self.queue.add(makeMessage(float(i))) for i in range(1000)]
+		for k in keys[:-1]:
+			self.queue.cancel(k)
+		self.assertEqual(len(self.queue), 1)
+		self.assertEqual(self.popAll(1000.0), [999.0])
+
+
+	def test_cancelID(self):
+		"Test cancelID"
+
+		self.queue.add(makeMessage(1.0, ID='a'))
+		self.queue.add(makeMessage(2.0, ID='b'))
+		self.queue.add(makeMessage(3.0, ID='a'))
+		self.queue.add(makeMessage(4.0))
+
+		self.queue.cancelID('a')
+		self.queue.cancelID('c') #no effect
+		self.assertEqual(self.popAll(100.0), [2.0, 4.0])
+
+
+	def test_getMessages(self):
+		"Test getMessages and construction"
+
+		key1 = self.queue.add(makeMessage(1.0))
+		key2 = self.queue.add(makeMessage(2.0, ID='a'))
+		msgs = self.queue.getMessages()
+		self.assertEqual(set(msgs.keys()), set([key1, key2]))
+		self.assertEqual(msgs[key2].timestamp, 2.0)
+
+		queue = timeoutqueue.TimeoutQueue(msgs)
+		key3 = queue.add(makeMessage(0.5))
+		self.assertFalse(key3 in (key1, key2))
+		queue.cancelID('a')
+		self.assertEqual(queue.popDue(100.0).timestamp, 0.5)
+		self.assertEqual(queue.popDue(100.0).timestamp, 1.0)
+		self.assertEqual(queue.popDue(100.0), None)
+
+		#Old state format:
+		queue = timeoutqueue.TimeoutQueue([makeMessage(2.0), makeMessage(1.0)])
+		self.assertEqual(len(queue), 2)
+		self.assertEqual(queue.getNextTimestamp(), 1.0)
+
+
+	def test_popChanges(self):
+		"Test popChanges"
+
+		key1 = self.queue.add(makeMessage(1.0))
+		key2 = self.queue.add(makeMessage(2.0))
+		self.assertEqual(self.queue.popChanges(), set([key1, key2]))
+		self.assertEqual(self.queue.popChanges(), set())
+
+		self.queue.cancel(key2)
+		self.queue.popDue(100.0)
+		self.assertEqual(self.queue.popChanges(), set([key1, key2]))
+
+
+	def test_transaction(self):
+		"Test commitTransaction and rollbackTransaction"
+
+		key1 = self.queue.add(makeMessage(1.0, ID='a'))
+		key2 = self.queue.add(makeMessage(2.0))
+
+		self.queue.beginTransaction()
+		key3 = self.queue.add(makeMessage(3.0))
+		self.queue.cancel(key2)
+		self.queue.commitTransaction()
+		self.assertEqual(set(self.queue.getMessages().keys()), set([key1, key3]))
+
+		self.queue.beginTransaction()
+		self.queue.add(makeMessage(0.5))
+		self.queue.cancelID('a')
+		self.queue.cancel(key3)
+		self.queue.rollbackTransaction()
+		self.assertEqual(set(self.queue.getMessages().keys()), set([key1, key3]))
+		self.assertEqual(self.popAll(100.0), [1.0, 3.0])
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
+
@@ -148,3 +148,8 @@ class DummyNetwork(Tracer):
 		self.trace.append(('interfaceExists', args, kwargs))
 		return self.interfaceExistsReturnValue
 
+
+	def isSendBufferFull(self, *args, **kwargs):
+		self.trace.append(('isSendBufferFull', args, kwargs))
+		return self.isSendBufferFullReturnValue
+
@@ -49,8 +49,9 @@ class MultiSigTransaction:
 	Attributes:
 	transaction: Transaction; the "withdraw" transaction that spends the
 	             multi-signature output of the deposit transaction.
-	TCDlist: list of TCD; The Transaction Conditions Documents that apply to this
-	         transaction.
+	TCDlist: TCDTable; The Transaction Conditions Documents that apply to this
+	         transaction. A list of TCD can also be assigned to it; it is
+	         converted to a TCDTable.
 	"""
 
 	@staticmethod
@@ -103,7 +104,7 @@ class MultiSigTransaction:
 		transaction = bitcointransaction.Transaction.deserialize(
 			binascii.unhexlify(state["tx"])
 			)
-		TCDlist = tcd.deserializeList(
+		TCDlist = tcd.TCDTable.deserialize(
 			binascii.unhexlify(state["TCDs"])
 			)
 		return MultiSigTransaction(transaction, TCDlist)
@@ -127,7 +128,7 @@ class MultiSigTransaction:
 		"""
 
 		length = struct.unpack('!I', data[:4])[0] #uint32_t
-		TCDlist = tcd.deserializeList(data[4:4+length])
+		TCDlist = tcd.TCDTable.deserialize(data[4:4+length])
 		transaction = bitcointransaction.Transaction.deserialize(data[4+length:])
 		return MultiSigTransaction(transaction, TCDlist)
 
@@ -139,14 +140,24 @@ class MultiSigTransaction:
 		Arguments:
 		transaction: Transaction; the "withdraw" transaction that spends the
 			         multi-signature output of the deposit transaction.
-		TCDlist: list of TCD; The Transaction Conditions Documents that apply to
-		         this transaction.
+		TCDlist: list of TCD or TCDTable; The Transaction Conditions Documents
+		         that apply to this transaction.
+
+		Exceptions:
+		Exception: multiple TCDs have the same token hash
 		"""
 
 		self.transaction = transaction
 		self.TCDlist = TCDlist
 
 
+	def __setattr__(self, name, value):
+		#Keep TCDlist a TCDTable, also when a list is assigned to it:
+		if name == "TCDlist" and not isinstance(value, tcd.TCDTable):
+			value = tcd.TCDTable(value)
+		self.__dict__[name] = value
+
+
 	def serialize(self):
 		"""
 		Serializes the MultiSigTransaction.
@@ -155,7 +166,7 @@ class MultiSigTransaction:
 		str; the serialized MultiSigTransaction.
 		"""
 
-		serializedList = tcd.serializeList(self.TCDlist)
+		serializedList = self.TCDlist.serialize()
 		return struct.pack('!I', len(serializedList)) + \
 			serializedList + self.transaction.serialize()
 
@@ -181,7 +192,7 @@ class MultiSigTransaction:
 			ret["ID"] = self.transaction.getTransactionID()[::-1].encode("hex")
 		else:
 			ret["tx"] = self.transaction.serialize().encode("hex")
-			ret["TCDs"] = tcd.serializeList(self.TCDlist).encode("hex")
+			ret["TCDs"] = self.TCDlist.serialize().encode("hex")
 		return ret
 
 
@@ -197,8 +208,7 @@ class MultiSigTransaction:
 		or not (False).
 		"""
 
-		hashes = [tcd.tokenHash for tcd in self.TCDlist]
-		return tokenHash in hashes
+		return self.TCDlist.exists(tokenHash)
 
 
 	def addTCD(self, tcd):
@@ -211,16 +221,13 @@ class MultiSigTransaction:
 		Exceptions:
 		Exception: another TCD with the same token hash already exists.
 
-		Note that a *reference* to tcd will be added: any future change in the
-		tcd object will also be visible inside this object.
+		Note that a *reference* to tcd will be added, but its serialized data
+		is stored at the moment of adding: tcd must not be changed afterwards.
 		"""
 
-		#Note: the reason this is not supported is that otherwise the behavior
-		#of removeTCD would become ambiguous.
-		if self.TCDExists(tcd.tokenHash):
-			raise Exception("Can not process multiple payments with the same token hash")
-
-		self.TCDlist.append(tcd)
+		#Note: TCDTable refuses duplicate token hashes, since otherwise the
+		#behavior of removeTCD would become ambiguous.
+		self.TCDlist.add(tcd)
 
 
 	def removeTCD(self, tokenHash):
@@ -235,10 +242,7 @@ class MultiSigTransaction:
 		Exception: There is no TCD with the given token hash.
 		"""
 
-		if not self.TCDExists(tokenHash):
-			raise Exception("Can not remove TCD: the token hash is unknown")
-
-		self.TCDlist = [tcd for tcd in self.TCDlist if tcd.tokenHash != tokenHash]
+		self.TCDlist.remove(tokenHash)
 
 
 	def setOutputs(self, ownPubKey, peerPubKey, escrowPubKey,
@@ -258,12 +262,12 @@ class MultiSigTransaction:
 		ownKeyHash = RIPEMD160(SHA256(ownPubKey))
 		peerKeyHash = RIPEMD160(SHA256(peerPubKey))
 
-		lockedAmount = sum([doc.amount for doc in self.TCDlist])
+		lockedAmount = self.TCDlist.getAmount()
 
 		self.transaction.tx_out = []
 
 		if len(self.TCDlist) > 0:
-			serializedList = tcd.serializeList(self.TCDlist)
+			serializedList = self.TCDlist.serialize()
 			hashValue = RIPEMD160(SHA256(serializedList))
 			self.transaction.tx_out.append(bitcointransaction.TxOut(
 				0, #Don't send any funds here: they're unspendable.
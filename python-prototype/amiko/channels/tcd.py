@@ -30,6 +30,12 @@ import struct
 
 
 
+#startTime, endTime, amount: uint64_t
+#tokenHash, commitAddress, rollbackAddress: 20-byte strings
+TCDStruct = struct.Struct('!QQQ20s20s20s')
+
+
+
 class TCD:
 	"""
 	A Transaction Conditions Document structure, for Lightning HTLC emulation
@@ -65,15 +71,7 @@ class TCD:
 		"""
 		if len(data) != TCD.getSerializedSize():
 			raise Exception("TCD de-serialization failed: incorrect data length")
-		startTime = struct.unpack('!Q', data[:8])[0] #uint64_t
-		endTime = struct.unpack('!Q', data[8:16])[0] #uint64_t
-		amount = struct.unpack('!Q', data[16:24])[0] #uint64_t
-		data = data[24:]
-		tokenHash = data[:20]
-		commitAddress = data[20:40]
-		rollbackAddress = data[40:60]
-		return TCD(startTime, endTime, amount,
-			tokenHash, commitAddress, rollbackAddress)
+		return TCD(*TCDStruct.unpack(data))
 
 
 	@staticmethod
@@ -86,7 +84,7 @@ class TCD:
 		Return value:
 		int; the size
 		"""
-		return 24 + 60
+		return TCDStruct.size
 
 
 	def __init__(self, startTime, endTime, amount,
@@ -121,11 +119,8 @@ class TCD:
 		Return value:
 		str; the serialized Transaction Conditions Document
 		"""
-		startTime = struct.pack('!Q', self.startTime) #uint64_t
-		endTime = struct.pack('!Q', self.endTime) #uint64_t
-		amount = struct.pack('!Q', self.amount) #uint64_t
-		return startTime + endTime + amount + \
-			self.tokenHash + self.commitAddress + self.rollbackAddress
+		return TCDStruct.pack(self.startTime, self.endTime, self.amount,
+			self.tokenHash, self.commitAddress, self.rollbackAddress)
 
 
 
@@ -139,7 +134,11 @@ def serializeList(TCDlist):
 		Return value:
 		str; the serialized list
 		"""
-		return ''.join([TCD.serialize() for TCD in TCDlist])
+		pack = TCDStruct.pack
+		return ''.join([
+			pack(doc.startTime, doc.endTime, doc.amount,
+				doc.tokenHash, doc.commitAddress, doc.rollbackAddress)
+			for doc in TCDlist])
 
 
 def deserializeList(data):
@@ -156,11 +155,157 @@ def deserializeList(data):
 		Exception: deserialization failed
 		"""
 
-		s = TCD.getSerializedSize()
+		s = TCDStruct.size
 		length = len(data) / s
 		if length*s != len(data):
 			raise Exception(
 				"List de-serialization failed: data length is not a multiple of the TCD data size")
 
-		return [TCD.deserialize(data[s*i:s*(i+1)]) for i in range(length)]
+		unpack_from = TCDStruct.unpack_from
+		return [TCD(*unpack_from(data, s*i)) for i in range(length)]
+
+
+
+class TCDTable:
+	"""
+	An ordered table of Transaction Conditions Documents, indexed by token hash.
+
+	Next to the TCD objects, the table keeps their serialized data in a single
+	array, so serializing the table does not require serializing every TCD.
+	For reading, the table behaves like a list of TCD objects.
+	"""
+
+	@staticmethod
+	def deserialize(data):
+		"""
+		De-serializes a table of Transaction Conditions Documents.
+		This is a static method: it can be called without having an instance,
+		as an alternative to calling the constructor directly.
+
+		Arguments:
+		data: str; the serialized table, as returned by serialize().
+
+		Return value:
+		TCDTable; the de-serialized table
+
+		Exceptions:
+		Exception: deserialization failed
+		"""
+		return TCDTable(deserializeList(data))
+
+
+	def __init__(self, TCDlist=()):
+		"""
+		Constructor.
+
+		Arguments:
+		TCDlist: list of TCD; the initial contents of the table (default: empty)
+
+		Exceptions:
+		Exception: multiple TCDs have the same token hash
+		"""
+		self.__TCDs = []
+		self.__index = {} #tokenHash -> TCD
+		self.__data = bytearray()
+		self.__amount = 0
+
+		for doc in TCDlist:
+			self.add(doc)
+
+
+	def __len__(self):
+		return len(self.__TCDs)
+
+
+	def __iter__(self):
+		return iter(self.__TCDs)
+
+
+	def __getitem__(self, i):
+		return self.__TCDs[i]
+
+
+	def __eq__(self, other):
+		return list(self) == list(other)
+
+
+	def __ne__(self, other):
+		return not (self == other)
+
+
+	def exists(self, tokenHash):
+		"""
+		Checks whether a TCD with a given token hash exists in the table.
+
+		Arguments:
+		tokenHash: str; the SHA256- and RIPEMD160-hashed commit token.
+
+		Return value:
+		bool; indicates whether a TCD with a given token hash exists (True)
+		or not (False).
+		"""
+		return tokenHash in self.__index
+
+
+	def add(self, doc):
+		"""
+		Add a Transaction Conditions Document to the end of the table.
+
+		Arguments:
+		doc: TCD; the to-be-added TCD.
+
+		Exceptions:
+		Exception: another TCD with the same token hash already exists.
+		"""
+		if doc.tokenHash in self.__index:
+			raise Exception("Can not process multiple payments with the same token hash")
+
+		self.__index[doc.tokenHash] = doc
+		self.__TCDs.append(doc)
+		self.__data += doc.serialize()
+		self.__amount += doc.amount
+
+
+	def remove(self, tokenHash):
+		"""
+		Remove a Transaction Conditions Document from the table.
+
+		Arguments:
+		tokenHash: str; the SHA256- and RIPEMD160-hashed commit token, as
+		           listed in the to-be-removed TCD.
+
+		Exceptions:
+		Exception: There is no TCD with the given token hash.
+		"""
+		if tokenHash not in self.__index:
+			raise Exception("Can not remove TCD: the token hash is unknown")
+
+		doc = self.__index.pop(tokenHash)
+
+		#Note: TCD has no __eq__, so this searches for the object itself:
+		i = self.__TCDs.index(doc)
+
+		del self.__TCDs[i]
+		s = TCDStruct.size
+		del self.__data[s*i:s*(i+1)]
+		self.__amount -= doc.amount
+
+
+	def getAmount(self):
+		"""
+		Return value:
+		int; the total amount (in Satoshi) locked by the TCDs in the table
+		"""
+		return self.__amount
+
+
+	def serialize(self):
+		"""
+		Serializes the table.
+		The result is equal to serializeList(list(table)).
+
+		Return value:
+		str; the serialized table
+		"""
+		return str(self.__data)
 
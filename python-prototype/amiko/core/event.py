@@ -26,8 +26,11 @@
 #    such a combination shall include the source code for the parts of the
 #    OpenSSL library used as well as that of the covered work.
 
+import os
 import select
 import time
+import heapq
+import itertools
 
 from ..utils import utils
 
@@ -48,14 +51,6 @@ signals = utils.Enum([
 
 class Context:
 
-	class EventConnection:
-		# For network signals, sender must be the socket object
-		# sender == None: common place-holder
-		def __init__(self, sender, signal, handler):
-			self.sender = sender
-			self.signal = signal
-			self.handler = handler
-
 	class Timer:
 		def __init__(self, timestamp, handler):
 			self.timestamp = timestamp
@@ -63,53 +58,154 @@ class Context:
 
 
 	def __init__(self):
-		# Each element is an EventConnection
-		self.__eventConnections = []
-		self.__postEventConnections = []
+		# For network signals, sender must be the socket object
+		# sender == None: common place-holder
+
+		# (sender, signal) -> list of handlers
+		self.__eventConnections = {}
+		# handler -> set of (sender, signal)
+		self.__handlerKeys = {}
+		# sender -> set of signals
+		self.__senderSignals = {}
 
-		# Each element is a Timer
+		# signal -> list of handlers
+		self.__postEventConnections = {}
+
+		# Sockets that have read / write handlers
+		self.__readSockets = set([])
+		self.__writeSockets = set([])
+
+		# Heap of (timestamp, sequence number, Timer)
+		# Cancelled timers stay in the heap (with handler None) until they
+		# expire; the sequence number keeps timers with equal timestamps in
+		# the order in which they were set.
 		self.__timers = []
+		self.__timerSequence = itertools.count()
+		# handler -> set of Timer
+		self.__handlerTimers = {}
+
+		# Pipe for waking up dispatchNetworkEvents from other threads:
+		# (read end, write end)
+		self.__wakeUpPipe = os.pipe()
+
+
+	def close(self):
+		for fd in self.__wakeUpPipe:
+			os.close(fd)
+
+
+	def wakeUp(self):
+		"""
+		Makes a waiting dispatchNetworkEvents call return.
+		May be called from any thread.
+		"""
+		os.write(self.__wakeUpPipe[1], 'x')
 
 
 	def connect(self, sender, signal, handler):
-		self.__eventConnections.append(
-			Context.EventConnection(sender, signal, handler))
+		key = (sender, signal)
+		self.__eventConnections.setdefault(key, []).append(handler)
+		self.__handlerKeys.setdefault(handler, set([])).add(key)
+		self.__senderSignals.setdefault(sender, set([])).add(signal)
+
+		if signal == signals.readyForRead:
+			self.__readSockets.add(sender)
+		elif signal == signals.readyForWrite:
+			self.__writeSockets.add(sender)
 
 
 	def connectPost(self, signal, handler):
-		self.__postEventConnections.append(
-			Context.EventConnection(None, signal, handler))
+		self.__postEventConnections.setdefault(signal, []).append(handler)
 
 
 	def setTimer(self, dt, handler):
-		self.__timers.append(Context.Timer(time.time() + dt, handler))
+		timer = Context.Timer(time.time() + dt, handler)
+		heapq.heappush(self.__timers,
+			(timer.timestamp, next(self.__timerSequence), timer))
+		self.__handlerTimers.setdefault(handler, set([])).add(timer)
+		return timer
+
+
+	def cancelTimer(self, timer):
+		# Already expired or cancelled:
+		if timer.handler is None:
+			return
+
+		timers = self.__handlerTimers[timer.handler]
+		timers.remove(timer)
+		if len(timers) == 0:
+			del self.__handlerTimers[timer.handler]
+		timer.handler = None
+
+
+	def getNextDeadline(self):
+		# Drop cancelled timers:
+		while len(self.__timers) > 0 and self.__timers[0][2].handler is None:
+			heapq.heappop(self.__timers)
+
+		if len(self.__timers) == 0:
+			return None
+		return self.__timers[0][0]
 
 
 	def removeConnectionsBySender(self, sender):
-		self.__eventConnections = filter(lambda c: c.sender != sender,
-			self.__eventConnections)
+		for signal in self.__senderSignals.pop(sender, []):
+			key = (sender, signal)
+			for handler in set(self.__eventConnections.pop(key)):
+				keys = self.__handlerKeys[handler]
+				keys.remove(key)
+				if len(keys) == 0:
+					del self.__handlerKeys[handler]
+			self.__removeSocket(key)
 
 
 	def removeConnectionsByHandler(self, handler):
-		self.__eventConnections = filter(lambda c: c.handler != handler,
-			self.__eventConnections)
-		self.__postEventConnections = filter(lambda c: c.handler != handler,
-			self.__postEventConnections)
-		self.__timers = filter(lambda c: c.handler != handler,
-			self.__timers)
-
-
-	def dispatchNetworkEvents(self):
-		rlist = set([c.sender for c in self.__eventConnections
-			if c.signal == signals.readyForRead])
-		wlist = set([c.sender for c in self.__eventConnections
-			if c.signal == signals.readyForWrite])
-
-		# wait for network events, with 0.01 s timeout:
-		#print "select.select(%s, %s, [], 0.01)" % (str(rlist), str(wlist))
-		rlist, wlist, xlist = select.select(rlist, wlist, [], 0.01)
+		for key in self.__handlerKeys.pop(handler, []):
+			handlers = [h for h in self.__eventConnections[key] if h != handler]
+			if len(handlers) > 0:
+				self.__eventConnections[key] = handlers
+				continue
+
+			del self.__eventConnections[key]
+			sender, signal = key
+			senderSignals = self.__senderSignals[sender]
+			senderSignals.remove(signal)
+			if len(senderSignals) == 0:
+				del self.__senderSignals[sender]
+			self.__removeSocket(key)
+
+		for signal, handlers in self.__postEventConnections.items():
+			if handler in handlers:
+				self.__postEventConnections[signal] = \
+					[h for h in handlers if h != handler]
+
+		for timer in list(self.__handlerTimers.get(handler, [])):
+			self.cancelTimer(timer)
+
+
+	def dispatchNetworkEvents(self, maxTimeout=None):
+		# wait for network events, until the next timer expires or wakeUp is
+		# called, with maxTimeout as maximum (None = no maximum):
+		timeout = maxTimeout
+		deadline = self.getNextDeadline()
+		if deadline != None:
+			timeout = deadline - time.time()
+			if maxTimeout != None:
+				timeout = min(timeout, maxTimeout)
+			timeout = max(0.0, timeout)
+
+		wakeUpFD = self.__wakeUpPipe[0]
+
+		#print "select.select(%s, %s, [], %s)" % (str(rlist), str(wlist), timeout)
+		rlist, wlist, xlist = select.select(
+			list(self.__readSockets) + [wakeUpFD], self.__writeSockets, [],
+			timeout)
 		#print " = %s, %s, %s" % (rlist, wlist, xlist)
 
+		if wakeUpFD in rlist:
+			rlist.remove(wakeUpFD)
+			os.read(wakeUpFD, 4096)
+
 		#Call write handlers:
 		for w in wlist:
 			self.sendSignal(w, signals.readyForWrite)
@@ -121,24 +217,38 @@ class Context:
 
 	def dispatchTimerEvents(self):
 		now = time.time()
-		for t in self.__timers:
-			if not (t.timestamp > now):
-				t.handler()
-		self.__timers = filter(lambda t: t.timestamp > now, self.__timers)
+		expired = []
+		while len(self.__timers) > 0 and self.__timers[0][0] <= now:
+			expired.append(heapq.heappop(self.__timers)[2])
+
+		for t in expired:
+			#Note: a handler may have cancelled one of the later timers
+			handler = t.handler
+			if handler is None:
+				continue
+			self.cancelTimer(t)
+			handler()
 
 
 	def sendSignal(self, sender, signal, *args, **kwargs):
-		handlers = [c.handler for c in self.__eventConnections
-			if c.sender == sender and c.signal == signal]
+		#Note: copy the lists, since handlers may (dis)connect handlers
+		handlers = list(self.__eventConnections.get((sender, signal), []))
 		for h in handlers:
 			h(*args, **kwargs)
 
-		handlers = [c.handler for c in self.__postEventConnections
-			if c.signal == signal]
+		handlers = list(self.__postEventConnections.get(signal, []))
 		for h in handlers:
 			h(*args, **kwargs)
 
 
+	def __removeSocket(self, key):
+		sender, signal = key
+		if signal == signals.readyForRead:
+			self.__readSockets.discard(sender)
+		elif signal == signals.readyForWrite:
+			self.__writeSockets.discard(sender)
+
+
 
 class Handler:
 	def __init__(self, context):
@@ -163,7 +273,11 @@ class Handler:
 
 
 	def setTimer(self, dt, handler):
-		self.context.setTimer(dt, handler)
 		self.__handlers.add(handler)
+		return self.context.setTimer(dt, handler)
+
+
+	def cancelTimer(self, timer):
+		self.context.cancelTimer(timer)
 
 
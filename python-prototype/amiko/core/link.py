@@ -71,9 +71,11 @@ class Link(event.Handler):
 			else:
 				raise Exception("Unrecognized channel type \"%s\"" % \
 					c["type"])
+		self.routingContext.updateLinkBalance(self)
 
 		self.connection = None
 		self.dice = random.randint(0, 0xffffffff) #for connect collision decision
+		self.__reconnectTimer = None
 
 		#After the time-out, we'll try to establish a connection.
 		#The reason for not connecting immediately is that, in the case of a
@@ -118,6 +120,7 @@ class Link(event.Handler):
 		newChannel = multisigchannel.constructFromDeposit(
 			self.bitcoind, newID, amount, escrowKey)
 		self.channels.append(newChannel)
+		self.routingContext.updateLinkBalance(self)
 		self.connection.sendMessage(newChannel.makeDepositMessage(None))
 		self.context.sendSignal(None, event.signals.save)
 
@@ -132,6 +135,7 @@ class Link(event.Handler):
 
 		channel = self.channels[existingIDs.index(channelID)]
 		msg = channel.makeWithdrawMessage(None)
+		self.routingContext.updateLinkBalance(self)
 		if msg != None:
 			self.connection.sendMessage(msg)
 		self.context.sendSignal(None, event.signals.save)
@@ -157,6 +161,7 @@ class Link(event.Handler):
 
 		log.log("Link: Connection established (received)")
 		self.connection = connection
+		self.__cancelReconnectTimeoutHandler()
 		self.__registerConnectionHandlers()
 
 		# Send URLs
@@ -185,6 +190,8 @@ class Link(event.Handler):
 
 
 	def __handleReconnectTimeout(self):
+		self.__reconnectTimer = None
+
 		# Timeout was pointless if we're already connected:
 		if self.isConnected():
 			return
@@ -226,10 +233,20 @@ class Link(event.Handler):
 		if self.remoteURL == "":
 			return
 
-		self.setTimer(timeout, self.__handleReconnectTimeout)
+		#Replace an already pending reconnect timeout:
+		self.__cancelReconnectTimeoutHandler()
+
+		self.__reconnectTimer = \
+			self.setTimer(timeout, self.__handleReconnectTimeout)
 		log.log("Link: set reconnect timeout to %f s" % timeout)
 
 
+	def __cancelReconnectTimeoutHandler(self):
+		if self.__reconnectTimer != None:
+			self.cancelTimer(self.__reconnectTimer)
+			self.__reconnectTimer = None
+
+
 	def msg_makeRoute(self, transaction):
 		log.log("Link %s: makeRoute" % self.name)
 
@@ -238,6 +255,11 @@ class Link(event.Handler):
 			if not self.isConnected():
 				raise channel.CheckFail("Not connected")
 
+			#With parallel routing, the same transaction can arrive here
+			#through different routes:
+			if transaction.hash in self.openTransactions:
+				raise channel.CheckFail("Transaction is already routed over this link")
+
 			startTime = transaction.startTime
 			endTime = transaction.endTime
 			#End time is incremented on the outward link, but only on the payee
@@ -256,6 +278,7 @@ class Link(event.Handler):
 				transaction.isPayerSide,
 				transaction.hash, startTime, endTime,
 				transaction.amount)
+			self.routingContext.updateLinkBalance(self)
 
 			#Remember link to transaction object:
 			self.openTransactions[transaction.hash] = transaction
@@ -271,7 +294,7 @@ class Link(event.Handler):
 			log.log("Route refused by link: " + str(f))
 
 			#Send back a have no route immediately
-			transaction.msg_haveNoRoute()
+			transaction.msg_haveNoRoute(self)
 
 
 	def msg_haveNoRoute(self, transaction):
@@ -282,6 +305,8 @@ class Link(event.Handler):
 		#INCOMING transaction.
 		#TODO: use multiple channels
 		self.channels[0].unreserve(not transaction.isPayerSide, transaction.hash)
+		self.routingContext.updateLinkBalance(self)
+		del self.openTransactions[transaction.hash]
 		self.connection.sendMessage(messages.HaveNoRoute(transaction.hash))
 
 
@@ -303,6 +328,18 @@ class Link(event.Handler):
 			transaction.hash, startTime, endTime))
 
 
+	def msg_endRoute(self, transaction):
+		log.log("Link %s: endRoute" % self.name)
+
+		#TODO: use multiple channels
+		self.channels[0].unreserve(transaction.isPayerSide, transaction.hash)
+		self.routingContext.updateLinkBalance(self)
+		del self.openTransactions[transaction.hash]
+
+		if self.isConnected():
+			self.connection.sendMessage(messages.CancelRoute(transaction.hash))
+
+
 	#TODO: msg_cancelRoute handling
 
 
@@ -332,6 +369,7 @@ class Link(event.Handler):
 		#TODO: check whether we're still connected
 		#TODO: use multiple channels
 		message = self.channels[0].commitOutgoing(transaction.hash, transaction.token)
+		self.routingContext.updateLinkBalance(self)
 
 		self.context.sendSignal(None, event.signals.save)
 
@@ -341,6 +379,34 @@ class Link(event.Handler):
 		del self.openTransactions[transaction.hash]
 
 
+	def __isReceivedOnOtherLink(self, hash, isPayerSide):
+		"""
+		Check whether a routing attempt of a transaction was already received
+		from the same (payer/payee) side on another link of this node.
+
+		Arguments:
+		hash: str; the hash of the transaction
+		isPayerSide: bool; indicates whether the routing attempt comes from
+		             the payer side (True) or from the payee side (False)
+
+		Return value:
+		bool; indicates whether such a routing attempt was received (True)
+		      or not (False)
+		"""
+
+		for lnk in self.routingContext.links:
+			if lnk is self or hash not in lnk.openTransactions:
+				continue
+			tx = lnk.openTransactions[hash]
+			if tx.isPayerSide != isPayerSide:
+				continue
+			sourceLink = tx.payerLink if isPayerSide else tx.payeeLink
+			if sourceLink is lnk:
+				return True
+
+		return False
+
+
 	def __handleMessage(self, message):
 		log.log("Link received message (%s -> %s): %s" % \
 			(str(self.remoteID), str(self.localID), str(message) ))
@@ -362,6 +428,18 @@ class Link(event.Handler):
 
 		elif message.__class__ == messages.MakeRoute:
 			try:
+				#With parallel routing, the same transaction can arrive here
+				#through different routes:
+				if message.hash in self.openTransactions:
+					raise channel.CheckFail(
+						"Transaction is already routed over this link")
+				#In a network with cycles, it can also arrive here through
+				#different links:
+				if self.__isReceivedOnOtherLink(
+					message.hash, message.isPayerSide):
+					raise channel.CheckFail(
+						"Transaction is already routed through this node")
+
 				#TODO: do all sorts of checks to see if it makes sense to perform
 				#the transaction over this link.
 				#For instance, check the responsiveness of the other side, etc. etc.
@@ -374,6 +452,7 @@ class Link(event.Handler):
 					not message.isPayerSide,
 					message.hash, message.startTime, message.endTime,
 					message.amount)
+				self.routingContext.updateLinkBalance(self)
 
 				#TODO: exception handling for the above
 
@@ -381,7 +460,7 @@ class Link(event.Handler):
 				log.log("Route refused by link: " + str(f))
 
 				#Send back a have no route immediately
-				#TODO
+				self.connection.sendMessage(messages.HaveNoRoute(message.hash))
 
 				return
 
@@ -403,12 +482,36 @@ class Link(event.Handler):
 			self.openTransactions[message.hash].msg_makeRoute(self.localID)
 
 		elif message.__class__ == messages.HaveNoRoute:
+			if message.value not in self.openTransactions:
+				log.log("Link: ignoring HaveNoRoute of an ended route")
+				return
+
 			#TODO: use multiple channels
-			tx = self.openTransactions[message.value]
+			tx = self.openTransactions.pop(message.value)
 			self.channels[0].unreserve(tx.isPayerSide, tx.hash)
-			tx.msg_haveNoRoute()
+			self.routingContext.updateLinkBalance(self)
+			tx.msg_haveNoRoute(self)
+
+		elif message.__class__ == messages.CancelRoute:
+			if message.value not in self.openTransactions:
+				log.log("Link: ignoring CancelRoute of an ended route")
+				return
+
+			#Note: isPayerSide is inverted: on the payer side, we have to cancel
+			#an INCOMING transaction.
+			#TODO: use multiple channels
+			tx = self.openTransactions.pop(message.value)
+			self.channels[0].unreserve(not tx.isPayerSide, tx.hash)
+			self.routingContext.updateLinkBalance(self)
+
+			#This will cancel the routing further on:
+			tx.msg_endRoute()
 
 		elif message.__class__ == messages.HaveRoute:
+			if message.hash not in self.openTransactions:
+				log.log("Link: ignoring HaveRoute of an ended route")
+				return
+
 			tx = self.openTransactions[message.hash]
 
 			startTime, endTime = message.startTime, message.endTime
@@ -448,6 +551,7 @@ class Link(event.Handler):
 
 				#TODO: use multiple channels
 				message = self.channels[0].commitOutgoing(hash, token)
+				self.routingContext.updateLinkBalance(self)
 
 				self.context.sendSignal(None, event.signals.save)
 
@@ -469,6 +573,7 @@ class Link(event.Handler):
 			#TODO: use multiple channels
 			self.channels[0].commitIncoming(hash, message)
 			#TODO: exception handling for the above
+			self.routingContext.updateLinkBalance(self)
 
 			self.context.sendSignal(None, event.signals.save)
 
@@ -497,13 +602,15 @@ class Link(event.Handler):
 						self.bitcoind, message)
 					self.channels.append(newChannel)
 					reply = newChannel.makeDepositMessage(message)
+					self.routingContext.updateLinkBalance(self)
 					if reply != None:
 						self.connection.sendMessage(reply)
 					self.context.sendSignal(None, event.signals.save)
 			else:
 				try:
-					channel = self.channels[existingIDs.index(message.channelID)]
-					reply = channel.makeDepositMessage(message)
+					chn = self.channels[existingIDs.index(message.channelID)]
+					reply = chn.makeDepositMessage(message)
+					self.routingContext.updateLinkBalance(self)
 					if reply != None:
 						self.connection.sendMessage(reply)
 					self.context.sendSignal(None, event.signals.save)
@@ -515,8 +622,9 @@ class Link(event.Handler):
 			existingIDs = [c.ID for c in self.channels]
 
 			try:
-				channel = self.channels[existingIDs.index(message.channelID)]
-				reply = channel.makeWithdrawMessage(message)
+				chn = self.channels[existingIDs.index(message.channelID)]
+				reply = chn.makeWithdrawMessage(message)
+				self.routingContext.updateLinkBalance(self)
 				if reply != None:
 					self.connection.sendMessage(reply)
 				self.context.sendSignal(None, event.signals.save)
@@ -92,6 +92,11 @@ class MeetingPoint:
 		amount), call msg_cancelRoute on the transaction objects on both sides,
 		and forget the transaction.
 
+		If a msg_makeRoute was already received from the same side (e.g. a
+		parallel routing attempt that arrived over a different route), call
+		msg_haveNoRoute on the transaction object that called this method,
+		and keep the already received one.
+
 		Arguments:
 		transaction: Transaction; the transaction object that called this
                      method.
@@ -106,20 +111,11 @@ class MeetingPoint:
 				pair[1] = transaction
 			else:
 				#Apparently, we received the transaction twice from the same
-				#side. This can be an outside error.
-				#For now, respond to it by sending msg_cancelRoute to both:
-				#TODO: send a message that won't confuse the routing algorithms
-				#of peers.
+				#side. With parallel routing, this happens when routing
+				#attempts reach us over different routes.
+				#Keep the first one, and refuse the new one:
 				log.log("Received twice from the same side: " + str(pair))
-
-				#We don't need this anymore:
-				del self.transactionPairs[transaction.hash]
-
-				otherSide = pair[1]
-				if transaction.isPayerSide:
-					otherSide = pair[0]
-				transaction.msg_cancelRoute()
-				otherSide.msg_cancelRoute()
+				transaction.msg_haveNoRoute(self)
 				return
 
 			#Check whether transaction amounts match:
@@ -48,6 +48,23 @@ ID_MYURLS        = 12
 ID_DEPOSIT       = 13
 ID_WITHDRAW      = 14
 ID_REQUESTCOMMIT = 15
+ID_CANCELROUTE   = 16
+
+
+
+#Pre-compiled binary formats:
+# 4-byte unsigned int in network byte order:
+uint32Struct = struct.Struct("!I")
+# 8-byte unsigned int in network byte order:
+uint64Struct = struct.Struct("!Q")
+# 1-byte unsigned int:
+uint8Struct = struct.Struct("!B")
+#MakeRoute: amount, isPayerSide, startTime, endTime:
+makeRouteStruct = struct.Struct("!Q?QQ")
+#HaveRoute: startTime, endTime:
+haveRouteStruct = struct.Struct("!QQ")
+#ChannelMessage: channelID, stage:
+channelMessageStruct = struct.Struct("!IB")
 
 
 
@@ -61,20 +78,23 @@ def serializeBinList(binList):
 	Return value:
 	str; the serialized data.
 	"""
+	pack = uint32Struct.pack
 	return "".join([
 		#length: 4-byte unsigned int in network byte order:
-		struct.pack("!I", len(s)) + s
+		pack(len(s)) + s
 
 		for s in binList
 		])
 
 
-def deserializeBinList(data):
+def deserializeBinList(data, offset=0):
 	"""
 	Deserializes a list of binary strings.
 
 	Arguments:
 	data: str; the to-be-deserialized data.
+	offset: int; the position in data where the list starts (default: 0).
+	        The list continues until the end of data.
 
 	Return value:
 	list of str; the deserialized data.
@@ -82,14 +102,19 @@ def deserializeBinList(data):
 	Exceptions:
 	Exception: the serialized data did not conform to the expected format.
 	"""
+	unpack_from = uint32Struct.unpack_from
+	dataLen = len(data)
 	ret = []
-	while len(data) > 0:
+	while offset < dataLen:
 		#length: 4-byte unsigned int in network byte order:
-		length = struct.unpack("!I", data[:4])[0]
-		if length+4 > len(data):
+		if offset+4 > dataLen:
 			raise Exception("Binlist deserialization error")
-		ret.append(data[4:4+length])
-		data = data[4+length:]
+		length = unpack_from(data, offset)[0]
+		offset += 4
+		if offset+length > dataLen:
+			raise Exception("Binlist deserialization error")
+		ret.append(data[offset:offset+length])
+		offset += length
 
 	return ret
 
@@ -121,7 +146,7 @@ class Message:
 		"""
 
 		# 4-byte unsigned int in network byte order:
-		ID = struct.pack("!I", self.__typeID)
+		ID = uint32Struct.pack(self.__typeID)
 		return ID + self.serializeAttributes()
 
 
@@ -138,7 +163,7 @@ class Message:
 		return ""
 
 
-	def deserializeAttributes(self, s):
+	def deserializeAttributes(self, s, offset=0):
 		"""
 		De-serializes the attributes.
 		This method should be overridden by Message-derived classes.
@@ -147,6 +172,8 @@ class Message:
 
 		Arguments:
 		s: str; the serialized message attribute data.
+		offset: int; the position in s where the attribute data starts
+		        (default: 0). The attribute data continues until the end of s.
 
 		Exceptions:
 		Exception: the serialized data did not conform to the expected format.
@@ -181,34 +208,17 @@ def deserialize(s):
 	"""
 
 	# 4-byte unsigned int in network byte order:
-	ID = struct.unpack("!I", s[:4])[0]
+	ID = uint32Struct.unpack_from(s)[0]
 
 	try:
-		clss = \
-		{
-		ID_STRING: String,
-		ID_LINK: Link,
-		ID_PAY: Pay,
-		ID_RECEIPT: Receipt,
-		ID_CONFIRM: Confirm,
-		ID_MAKEROUTE: MakeRoute,
-		ID_HAVEROUTE: HaveRoute,
-		ID_HAVENOROUTE: HaveNoRoute,
-		ID_LOCK: Lock,
-		ID_CANCEL: Cancel,
-		ID_COMMIT: Commit,
-		ID_MYURLS: MyURLs,
-		ID_DEPOSIT: Deposit,
-		ID_WITHDRAW: Withdraw,
-		ID_REQUESTCOMMIT: RequestCommit
-		}[ID]
+		clss = messageClasses[ID]
 	except KeyError:
 		raise Exception("Deserialize failed: unknown type ID")
 
 	obj = clss()
 
 	# Remaining bytes contain attribute data
-	obj.deserializeAttributes(s[4:])
+	obj.deserializeAttributes(s, 4)
 
 	return obj
 
@@ -243,8 +253,8 @@ class String(Message):
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
-		self.value = s
+	def deserializeAttributes(self, s, offset=0):
+		self.value = s[offset:]
 
 
 	@inheritDocString(Message)
@@ -310,6 +320,25 @@ class HaveNoRoute(String):
 
 
 
+class CancelRoute(String):
+	"""
+	Cancel route message (sent from payer/payee side to meeting point side)
+
+	Attributes:
+	value: str; the transaction hash
+	"""
+
+	def __init__(self, value=""):
+		"""
+		Constructor.
+
+		Arguments:
+		value: str; the transaction hash
+		"""
+		String.__init__(self, value, ID_CANCELROUTE)
+
+
+
 class Cancel(Message):
 	"""
 	Cancel message (sent from payer to payee on pay link)
@@ -378,17 +407,17 @@ class Link(Message):
 	@inheritDocString(Message)
 	def serializeAttributes(self):
 		# 4-byte unsigned int in network byte order:
-		dice = struct.pack("!I", self.dice)
+		dice = uint32Struct.pack(self.dice)
 
 		return dice + self.ID
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
+	def deserializeAttributes(self, s, offset=0):
 		# 4-byte unsigned int in network byte order:
-		self.dice = struct.unpack("!I", s[:4])[0]
+		self.dice = uint32Struct.unpack_from(s, offset)[0]
 
-		self.ID = s[4:]
+		self.ID = s[offset+4:]
 
 
 	@inheritDocString(Message)
@@ -439,15 +468,11 @@ class MakeRoute(Message):
 
 	@inheritDocString(Message)
 	def serializeAttributes(self):
-		# 8-byte unsigned int in network byte order:
-		ret = struct.pack("!Q", self.amount)
-
-		# 1-byte bool:
-		ret += struct.pack("!?", self.isPayerSide)
-
-		# 8-byte unsigned int in network byte order:
-		ret += struct.pack("!Q", self.startTime)
-		ret += struct.pack("!Q", self.endTime)
+		# amount: 8-byte unsigned int in network byte order
+		# isPayerSide: 1-byte bool
+		# startTime, endTime: 8-byte unsigned int in network byte order
+		ret = makeRouteStruct.pack(
+			self.amount, self.isPayerSide, self.startTime, self.endTime)
 
 		#Variable-length data:
 		ret += serializeBinList([self.hash, self.meetingPoint])
@@ -456,22 +481,15 @@ class MakeRoute(Message):
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
-		# 8-byte unsigned int in network byte order:
-		self.amount = struct.unpack("!Q", s[:8])[0]
-		s = s[8:]
-
-		# 1-byte bool:
-		self.isPayerSide = struct.unpack("!?", s[0])[0]
-		s = s[1:]
-
-		# 8-byte unsigned int in network byte order:
-		self.startTime = struct.unpack("!Q", s[:8])[0]
-		s = s[8:]
-		self.endTime = struct.unpack("!Q", s[:8])[0]
-		s = s[8:]
+	def deserializeAttributes(self, s, offset=0):
+		# amount: 8-byte unsigned int in network byte order
+		# isPayerSide: 1-byte bool
+		# startTime, endTime: 8-byte unsigned int in network byte order
+		self.amount, self.isPayerSide, self.startTime, self.endTime = \
+			makeRouteStruct.unpack_from(s, offset)
 
-		self.hash, self.meetingPoint = deserializeBinList(s)
+		self.hash, self.meetingPoint = deserializeBinList(
+			s, offset + makeRouteStruct.size)
 
 
 	@inheritDocString(Message)
@@ -517,8 +535,7 @@ class HaveRoute(Message):
 	@inheritDocString(Message)
 	def serializeAttributes(self):
 		# 8-byte unsigned int in network byte order:
-		ret = struct.pack("!Q", self.startTime)
-		ret += struct.pack("!Q", self.endTime)
+		ret = haveRouteStruct.pack(self.startTime, self.endTime)
 
 		#Variable-length data:
 		ret += self.hash
@@ -527,14 +544,11 @@ class HaveRoute(Message):
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
+	def deserializeAttributes(self, s, offset=0):
 		# 8-byte unsigned int in network byte order:
-		self.startTime = struct.unpack("!Q", s[:8])[0]
-		s = s[8:]
-		self.endTime = struct.unpack("!Q", s[:8])[0]
-		s = s[8:]
+		self.startTime, self.endTime = haveRouteStruct.unpack_from(s, offset)
 
-		self.hash = s
+		self.hash = s[offset + haveRouteStruct.size:]
 
 
 	@inheritDocString(Message)
@@ -578,7 +592,7 @@ class Receipt(Message):
 	@inheritDocString(Message)
 	def serializeAttributes(self):
 		# 8-byte unsigned int in network byte order:
-		ret = struct.pack("!Q", self.amount)
+		ret = uint64Struct.pack(self.amount)
 
 		#Variable-length data:
 		ret += serializeBinList(
@@ -589,12 +603,11 @@ class Receipt(Message):
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
+	def deserializeAttributes(self, s, offset=0):
 		# 8-byte unsigned int in network byte order:
-		self.amount = struct.unpack("!Q", s[:8])[0]
-		s = s[8:]
+		self.amount = uint64Struct.unpack_from(s, offset)[0]
 
-		binList = deserializeBinList(s)
+		binList = deserializeBinList(s, offset + uint64Struct.size)
 		self.receipt = binList[0]
 		self.hash = binList[1]
 		self.meetingPoints = binList[2:]
@@ -636,11 +649,9 @@ class ChannelMessage(Message):
 
 	@inheritDocString(Message)
 	def serializeAttributes(self):
-		# 4-byte unsigned int in network byte order:
-		ret = struct.pack("!I", self.channelID)
-
-		# 1-byte unsigned int:
-		ret += struct.pack("!B", self.stage)
+		# channelID: 4-byte unsigned int in network byte order
+		# stage: 1-byte unsigned int
+		ret = channelMessageStruct.pack(self.channelID, self.stage)
 
 		ret += serializeBinList(self.payload)
 
@@ -648,16 +659,12 @@ class ChannelMessage(Message):
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
-		# 4-byte unsigned int in network byte order:
-		self.channelID = struct.unpack("!I", s[:4])[0]
-		s = s[4:]
+	def deserializeAttributes(self, s, offset=0):
+		# channelID: 4-byte unsigned int in network byte order
+		# stage: 1-byte unsigned int
+		self.channelID, self.stage = channelMessageStruct.unpack_from(s, offset)
 
-		# 1-byte unsigned int:
-		self.stage = struct.unpack("!B", s[0])[0]
-		s = s[1:]
-
-		self.payload = deserializeBinList(s)
+		self.payload = deserializeBinList(s, offset + channelMessageStruct.size)
 
 
 	@inheritDocString(Message)
@@ -700,28 +707,29 @@ class Deposit(ChannelMessage):
 	@inheritDocString(Message)
 	def serializeAttributes(self):
 		# 4-byte unsigned int in network byte order:
-		typeLen = struct.pack("!I", len(self.type))
+		typeLen = uint32Struct.pack(len(self.type))
 		ret = typeLen + self.type
 
 		# 1-byte unsigned int:
-		ret += struct.pack("!B", int(self.isInitial))
+		ret += uint8Struct.pack(int(self.isInitial))
 
 		ret += ChannelMessage.serializeAttributes(self)
 		return ret
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
+	def deserializeAttributes(self, s, offset=0):
 		# 4-byte unsigned int in network byte order:
-		typeLen = struct.unpack("!I", s[:4])[0]
-		self.type = s[4:4+typeLen]
-		s = s[4+typeLen:]
+		typeLen = uint32Struct.unpack_from(s, offset)[0]
+		offset += 4
+		self.type = s[offset:offset+typeLen]
+		offset += typeLen
 
 		# 1-byte unsigned int:
-		self.isInitial = bool(struct.unpack("!B", s[0])[0])
-		s = s[1:]
+		self.isInitial = bool(uint8Struct.unpack_from(s, offset)[0])
+		offset += 1
 
-		ChannelMessage.deserializeAttributes(self, s)
+		ChannelMessage.deserializeAttributes(self, s, offset)
 
 
 	@inheritDocString(Message)
@@ -782,7 +790,7 @@ class Lock(ChannelMessage):
 	@inheritDocString(Message)
 	def serializeAttributes(self):
 		# 4-byte unsigned int in network byte order:
-		hashLen = struct.pack("!I", len(self.hash))
+		hashLen = uint32Struct.pack(len(self.hash))
 		ret = hashLen + self.hash
 
 		ret += ChannelMessage.serializeAttributes(self)
@@ -790,13 +798,14 @@ class Lock(ChannelMessage):
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
+	def deserializeAttributes(self, s, offset=0):
 		# 4-byte unsigned int in network byte order:
-		hashLen = struct.unpack("!I", s[:4])[0]
-		self.hash = s[4:4+hashLen]
-		s = s[4+hashLen:]
+		hashLen = uint32Struct.unpack_from(s, offset)[0]
+		offset += 4
+		self.hash = s[offset:offset+hashLen]
+		offset += hashLen
 
-		ChannelMessage.deserializeAttributes(self, s)
+		ChannelMessage.deserializeAttributes(self, s, offset)
 
 
 	@inheritDocString(Message)
@@ -853,7 +862,7 @@ class Commit(ChannelMessage):
 	@inheritDocString(Message)
 	def serializeAttributes(self):
 		# 4-byte unsigned int in network byte order:
-		tokenLen = struct.pack("!I", len(self.token))
+		tokenLen = uint32Struct.pack(len(self.token))
 		ret = tokenLen + self.token
 
 		ret += ChannelMessage.serializeAttributes(self)
@@ -861,13 +870,14 @@ class Commit(ChannelMessage):
 
 
 	@inheritDocString(Message)
-	def deserializeAttributes(self, s):
+	def deserializeAttributes(self, s, offset=0):
 		# 4-byte unsigned int in network byte order:
-		tokenLen = struct.unpack("!I", s[:4])[0]
-		self.token = s[4:4+tokenLen]
-		s = s[4+tokenLen:]
+		tokenLen = uint32Struct.unpack_from(s, offset)[0]
+		offset += 4
+		self.token = s[offset:offset+tokenLen]
+		offset += tokenLen
 
-		ChannelMessage.deserializeAttributes(self, s)
+		ChannelMessage.deserializeAttributes(self, s, offset)
 
 
 	@inheritDocString(Message)
@@ -875,3 +885,26 @@ class Commit(ChannelMessage):
 		return "[Commit] channelID: %d; token: %s" % \
 			(self.channelID, self.token.encode("hex"))
 
+
+
+#Type ID -> message class, used by deserialize:
+messageClasses = \
+{
+ID_STRING: String,
+ID_LINK: Link,
+ID_PAY: Pay,
+ID_RECEIPT: Receipt,
+ID_CONFIRM: Confirm,
+ID_MAKEROUTE: MakeRoute,
+ID_HAVEROUTE: HaveRoute,
+ID_HAVENOROUTE: HaveNoRoute,
+ID_LOCK: Lock,
+ID_CANCEL: Cancel,
+ID_COMMIT: Commit,
+ID_MYURLS: MyURLs,
+ID_DEPOSIT: Deposit,
+ID_WITHDRAW: Withdraw,
+ID_REQUESTCOMMIT: RequestCommit,
+ID_CANCELROUTE: CancelRoute
+}
+
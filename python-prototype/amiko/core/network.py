@@ -39,6 +39,14 @@ import log
 minProtocolVersion = 1
 maxProtocolVersion = 1
 
+#Range of the number of bytes read/written in one socket call.
+#Within this range, the number grows while the socket keeps up, and
+#shrinks when it doesn't.
+minChunkSize = 4096
+maxChunkSize = 262144
+
+lengthStruct = struct.Struct("!I")
+
 
 
 class Listener(event.Handler):
@@ -88,8 +96,15 @@ class Connection(event.Handler):
 
 		#self.socket.setblocking(False)
 
-		self.__writeBuffer = ""
-		self.__readBuffer = ""
+		#Write buffer: bytes before __writePos have already been sent
+		self.__writeBuffer = bytearray()
+		self.__writePos = 0
+		self.__writeChunkSize = minChunkSize
+
+		#Read buffer: bytes are removed once all complete messages are handled
+		self.__readBuffer = bytearray()
+		self.__readChunkSize = minChunkSize
+
 		self.__isClosed = False
 
 		self.connect(self.socket, event.signals.readyForRead,
@@ -135,27 +150,37 @@ class Connection(event.Handler):
 		#print "Sending serialized message: ", repr(msg)
 
 		# 4-byte unsigned int in network byte order:
-		lenStr = struct.pack("!I", len(msg))
-		self.__send(lenStr + msg)
+		self.__send(lengthStruct.pack(len(msg)), msg)
 
 
-	def __send(self, data):
+	def __send(self, *data):
 		if self.isClosed():
 			raise Exception("Connection is closed")
 
-		self.__writeBuffer += data
-		self.connect(self.socket, event.signals.readyForWrite,
-			self.__handleWriteAvailable)
+		#Only connect once; data that is queued in the mean time is
+		#gathered and sent together with the already queued data:
+		if len(self.__writeBuffer) == 0:
+			self.connect(self.socket, event.signals.readyForWrite,
+				self.__handleWriteAvailable)
+
+		for d in data:
+			self.__writeBuffer += d
 
 
 	def __handleReadAvailable(self):
 		try:
-			bytes = self.socket.recv(4096)
+			bytes = self.socket.recv(self.__readChunkSize)
 
 			if len(bytes) == 0:
 				log.log("Detected socket close by other side; closing this side too")
 				self.close()
 
+			#Read more at once if the socket has more data available:
+			if len(bytes) == self.__readChunkSize:
+				self.__readChunkSize = min(2*self.__readChunkSize, maxChunkSize)
+			elif len(bytes) < self.__readChunkSize / 4:
+				self.__readChunkSize = max(self.__readChunkSize / 2, minChunkSize)
+
 			self.__readBuffer += bytes
 			if self.protocolVersion == None:
 				self.__tryReadProtocolVersion()
@@ -163,27 +188,34 @@ class Connection(event.Handler):
 				return
 
 			#There can be multiple messages in the read buffer,
-			#so repeat until there is no more complete message
-			while True:
+			#so repeat until there is no more complete message.
+			#Handled messages are removed from the buffer afterwards, all at
+			#once.
+			pos = 0
+			try:
+				while True:
 
-				# Message detection:
-				if len(self.__readBuffer) < 4:
-					return
+					# Message detection:
+					if len(self.__readBuffer) < pos+4:
+						return
 
-				# 4-byte unsigned int in network byte order:
-				msgLen = struct.unpack("!I", self.__readBuffer[:4])[0]
-				if len(self.__readBuffer) < msgLen+4:
-					return
+					# 4-byte unsigned int in network byte order:
+					msgLen = lengthStruct.unpack_from(self.__readBuffer, pos)[0]
+					if len(self.__readBuffer) < pos+msgLen+4:
+						return
 
-				msg = self.__readBuffer[4:msgLen+4]
-				self.__readBuffer = self.__readBuffer[msgLen+4:]
+					msg = memoryview(self.__readBuffer)[
+						pos+4:pos+msgLen+4].tobytes()
+					pos += msgLen+4
 
-				#print "Received serialized message: ", repr(msg)
+					#print "Received serialized message: ", repr(msg)
 
-				#de-serialize
-				msg = messages.deserialize(msg)
+					#de-serialize
+					msg = messages.deserialize(msg)
 
-				self.__handleMessage(msg)
+					self.__handleMessage(msg)
+			finally:
+				del self.__readBuffer[:pos]
 
 		except:
 			log.logException()
@@ -191,18 +223,32 @@ class Connection(event.Handler):
 
 
 	def __handleWriteAvailable(self):
-		if self.__writeBuffer != "":
+		if self.__writePos < len(self.__writeBuffer):
 			# Never try to send more than this amount each time:
-			maxChunkSize = 4096
+			chunkSize = self.__writeChunkSize
 
-			bytesSent = self.socket.send(self.__writeBuffer[:maxChunkSize])
-			self.__writeBuffer = self.__writeBuffer[bytesSent:]
+			bytesSent = self.socket.send(memoryview(self.__writeBuffer)[
+				self.__writePos:self.__writePos+chunkSize])
+			self.__writePos += bytesSent
 			#print "Sent bytes: ", bytesSent
 
+			#Send more at once if the socket keeps up:
+			if bytesSent == chunkSize:
+				self.__writeChunkSize = min(2*chunkSize, maxChunkSize)
+			else:
+				self.__writeChunkSize = max(chunkSize / 2, minChunkSize)
+
 		#Disconnect once write is finished:
-		if self.__writeBuffer == "":
+		if self.__writePos >= len(self.__writeBuffer):
+			del self.__writeBuffer[:]
+			self.__writePos = 0
 			self.context.removeConnectionsByHandler(self.__handleWriteAvailable)
 
+		#Don't let already sent data pile up in front of the buffer:
+		elif self.__writePos >= maxChunkSize:
+			del self.__writeBuffer[:self.__writePos]
+			self.__writePos = 0
+
 
 	def __sendProtocolVersion(self):
 		self.__send("AMIKOPAY/%d/%d\n" % \
@@ -214,15 +260,15 @@ class Connection(event.Handler):
 		magic = "AMIKOPAY/"
 		if len(self.__readBuffer) < len(magic):
 			return
-		if self.__readBuffer[:len(magic)] != magic:
+		if str(self.__readBuffer[:len(magic)]) != magic:
 			raise Exception("Received invalid magic bytes")
 
 		if len(self.__readBuffer) > 128 and '\n' not in self.__readBuffer:
 			raise Exception("Did not receive version negotiation terminator")
 		pos = self.__readBuffer.index('\n')
 
-		versions = self.__readBuffer[len(magic):pos]
-		self.__readBuffer = self.__readBuffer[pos+1:]
+		versions = str(self.__readBuffer[len(magic):pos])
+		del self.__readBuffer[:pos+1]
 
 		if '/' not in versions:
 			raise Exception("No min/max separator in version string")
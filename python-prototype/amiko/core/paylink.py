@@ -159,6 +159,11 @@ class Payer(event.Handler):
 		self.connection.sendMessage(messages.HaveRoute())
 
 
+	def msg_haveNoRoute(self, transaction):
+		log.log("Payer: haveNoRoute")
+		self.msg_cancel(transaction)
+
+
 	def msg_cancel(self, transaction):
 		log.log("Payer: cancel")
 		#1: adjust own state
@@ -324,6 +329,15 @@ class Payee(event.Handler):
 		self.__checkRoutesAndConfirmToPayer()
 
 
+	def msg_haveNoRoute(self, transaction):
+		log.log("Payee: haveNoRoute")
+		#1: adjust own state
+		self.state = self.states.cancelled
+		#2: network traffic
+		if self.isConnected():
+			self.connection.sendMessage(messages.Cancel())
+
+
 	def msg_lock(self, transaction):
 		log.log("Payee: locked; committing the transaction")
 		#1: adjust own state
@@ -0,0 +1,154 @@
+#    routingtable.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import time
+
+
+
+class RoutingTable:
+	"""
+	Routing information, learned from the results of earlier routing attempts.
+
+	For each (meeting point, link) combination, it is remembered whether
+	routing over that link to that meeting point succeeded before, and for
+	which amount it recently failed. Transaction uses this to try likely routes
+	first, and to skip routes that are known to fail.
+
+	Attributes:
+	failureTimeout: float; the time (in seconds) a failed route is skipped
+	"""
+
+	def __init__(self, failureTimeout=60.0):
+		"""
+		Constructor.
+
+		Arguments:
+		failureTimeout: float; the time (in seconds) a failed route is skipped
+		                (default: 60.0)
+		"""
+
+		self.failureTimeout = failureTimeout
+
+		#meeting point ID -> link ID -> number of successful routing attempts
+		self.__successes = {}
+
+		#meeting point ID -> link ID -> (amount, time) of the last failure
+		self.__failures = {}
+
+
+	def reportSuccess(self, meetingPoint, linkID, amount):
+		"""
+		Remember that routing to a meeting point over a link succeeded.
+
+		Arguments:
+		meetingPoint: str; the ID of the meeting point
+		linkID: str; the local ID of the link
+		amount: int; the amount (in Satoshi) of the transaction
+		"""
+
+		successes = self.__successes.setdefault(meetingPoint, {})
+		successes[linkID] = successes.get(linkID, 0) + 1
+
+		#Larger amounts may succeed again:
+		failures = self.__failures.get(meetingPoint, {})
+		if linkID in failures and amount >= failures[linkID][0]:
+			del failures[linkID]
+
+
+	def reportFailure(self, meetingPoint, linkID, amount):
+		"""
+		Remember that routing to a meeting point over a link failed.
+		For failureTimeout seconds, the link will be skipped for routing this
+		amount or larger amounts to the meeting point.
+
+		Arguments:
+		meetingPoint: str; the ID of the meeting point
+		linkID: str; the local ID of the link
+		amount: int; the amount (in Satoshi) of the transaction
+		"""
+
+		failures = self.__failures.setdefault(meetingPoint, {})
+		failedAmount = amount
+		if linkID in failures and not self.__isExpired(failures[linkID]):
+			failedAmount = min(failedAmount, failures[linkID][0])
+		failures[linkID] = (failedAmount, time.time())
+
+
+	def getRoutes(self, meetingPoint, amount, links, getCapacity):
+		"""
+		Return the links over which routing should be tried, in the order in
+		which they should be tried.
+
+		Links over which routing of this amount (or a smaller one) to this
+		meeting point failed recently are left out. The other links are
+		sorted on:
+		1. whether they have enough capacity for the amount
+		2. the number of earlier successful routing attempts
+		3. the capacity
+
+		Arguments:
+		meetingPoint: str; the ID of the meeting point
+		amount: int; the amount (in Satoshi) of the transaction
+		links: list of Link; the candidate links
+		getCapacity: function(Link) -> int; returns the amount (in Satoshi)
+		             that can be transferred over a link in the required
+		             direction
+
+		Return value:
+		list of str; the local IDs of the links
+		"""
+
+		successes = self.__successes.get(meetingPoint, {})
+		failures = self.__failures.get(meetingPoint, {})
+
+		candidates = []
+		for i, lnk in enumerate(links):
+			failure = failures.get(lnk.localID)
+			if failure is not None:
+				if self.__isExpired(failure):
+					del failures[lnk.localID]
+				elif amount >= failure[0]:
+					continue #pruned
+
+			capacity = getCapacity(lnk)
+			sortKey = \
+			(
+				capacity < amount,
+				-successes.get(lnk.localID, 0),
+				-capacity,
+				i #keep the original order otherwise
+			)
+			candidates.append((sortKey, lnk.localID))
+
+		candidates.sort()
+		return [ID for sortKey, ID in candidates]
+
+
+	def __isExpired(self, failure):
+		return failure[1] + self.failureTimeout < time.time()
+
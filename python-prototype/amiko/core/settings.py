@@ -92,9 +92,15 @@ class Settings:
 		if self.externalMeetingPoints[-1] == '':
 			self.externalMeetingPoints = self.externalMeetingPoints[:-1] #remove empty
 
+		#routing
+		self.parallelRoutes = int(self.__get(
+			"routing", "parallelRoutes", 1))
+
 		#bitcoin RPC
 		self.bitcoinRPCURL = self.__get(
 			"bitcoind", "RPCURL", "")
+		self.watchdogInterval = float(self.__get(
+			"bitcoind", "watchdogInterval", 0.01))
 
 		self.__config = None
 
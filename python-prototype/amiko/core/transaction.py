@@ -57,7 +57,9 @@ class Transaction:
 		Constructor.
 		All arguments are stored as attributes with the same name.
 		In addition, the attribute "token" is initialized as None.
-		A list of to-be-tried routes is initialized, based on routingContext.
+		A list of to-be-tried routes is initialized, based on routingContext
+		and its routing table. Up to routingContext.parallelRoutes of these
+		routes are tried at the same time.
 
 		Arguments:
 		context: Context; event context
@@ -89,13 +91,6 @@ class Transaction:
 		self.payerLink = payerLink
 		self.payeeLink = payeeLink
 
-		#Initialize routing possibilities:
-		#Note: just list the IDs here, not references to actual link objects.
-		#This allows other code to remove links while we're routing.
-		self.__remainingRoutes = \
-			[lnk.localID for lnk in self.routingContext.links]
-		self.__currentRoute = None
-
 		#Note: this will give an exception if both payer and payee link are None,
 		#or if neither is None.
 		self.isPayerSide = \
@@ -104,6 +99,18 @@ class Transaction:
 		(False, True): False #payer link is None -> payee side
 		} [(payeeLink == None, payerLink == None)]
 
+		#Initialize routing possibilities, most likely routes first:
+		#Note: just list the IDs here, not references to actual link objects.
+		#This allows other code to remove links while we're routing.
+		self.__remainingRoutes = self.routingContext.routingTable.getRoutes(
+			self.meetingPoint, self.amount, self.routingContext.links,
+			self.__getLinkCapacity)
+
+		#The routes to which msg_makeRoute was sent, and which were not yet
+		#ended or found to have no route.
+		#route ID -> Link/MeetingPoint; a meeting point has route ID None.
+		self.__currentRoutes = {}
+
 
 	def msg_makeRoute(self, sourceLinkID=None):
 		"""
@@ -125,14 +132,17 @@ class Transaction:
 		if self.__tryMeetingPoint():
 			return #found -> finished
 
+		#This starts a new routing attempt:
+		self.__currentRoutes = {}
+
 		#Remove sourceLinkID from the to-be-tried routes:
 		while sourceLinkID in self.__remainingRoutes:
 			self.__remainingRoutes.remove(sourceLinkID)
 
-		#Note: this will just try the first route.
+		#Note: this will just try the first route(s).
 		#However, if that fails we'll be notified about it, and then
 		#we'll try the next, and so on.
-		self.__tryNextRoute()
+		self.__tryNextRoutes()
 
 
 	def msg_haveRoute(self, link, startTime, endTime):
@@ -141,7 +151,8 @@ class Transaction:
 		a msg_makeRoute from this object; it passes itself as argument.
 
 		Replace the missing (None-valued) link (either payerLink or payeeLink)
-		with the given link object. Call msg_haveRoute on the link that was
+		with the given link object. Call msg_endRoute on all other routes that
+		are still being tried, and call msg_haveRoute on the link that was
 		already known.
 
 		Arguments:
@@ -161,6 +172,19 @@ class Transaction:
 		self.startTime = startTime
 		self.endTime = endTime
 
+		#The first route that is found is used; cancel all others:
+		routeIDs = self.__getRouteIDs(link)
+		for ID, route in self.__currentRoutes.items():
+			if ID not in routeIDs:
+				route.msg_endRoute(self)
+		self.__currentRoutes = dict((ID, link) for ID in routeIDs)
+		self.__remainingRoutes = None
+
+		for ID in routeIDs:
+			if ID != None:
+				self.routingContext.routingTable.reportSuccess(
+					self.meetingPoint, ID, self.amount)
+
 		if self.isPayerSide:
 			self.payeeLink = link
 			self.payerLink.msg_haveRoute(self)
@@ -169,23 +193,72 @@ class Transaction:
 			self.payeeLink.msg_haveRoute(self)
 
 
-	def msg_haveNoRoute(self):
+	def msg_haveNoRoute(self, link=None):
 		"""
 		This method is typically called by a link that has previously received
 		a msg_makeRoute from this object.
 
 		Choose a new link from the routing context, and call msg_makeRoute to
 		that link.
-		If no suitable link exists, call msg_haveNoRoute on the already attached link
+		If no suitable link exists and no other routes are still being tried,
+		call msg_haveNoRoute on the already attached link
 		(either payerLink or payeeLink, whichever is non-None).
+		If the link is the route that was already found, the route is
+		withdrawn, and msg_haveNoRoute is called on the already attached link
+		as well.
+
+		Arguments:
+		link: Link; the link on which no route was found (default: None).
+		      If None, all routes that are still being tried are assumed
+		      to have failed.
 		"""
 
 		log.log("Transaction: haveNoRoute")
-		#Immediately try next route, or send cancel back if there is none:
-		self.__tryNextRoute()
 
+		if link is None:
+			routeIDs = self.__currentRoutes.keys()
+		else:
+			routeIDs = self.__getRouteIDs(link)
+
+		for ID in routeIDs:
+			del self.__currentRoutes[ID]
+			if ID != None:
+				self.routingContext.routingTable.reportFailure(
+					self.meetingPoint, ID, self.amount)
+
+		self.__continueRouting(routeIDs)
+
+
+	def msg_cancelRoute(self, route=None):
+		"""
+		This method is typically called by a meeting point that has previously
+		received a msg_makeRoute from this object, when it withdraws the route
+		(e.g. because the other side ended its route, or because the other
+		side doesn't match).
+
+		Forget the route. If routing is still in progress, try the next routes,
+		like msg_haveNoRoute does. If the route was already found, call
+		msg_haveNoRoute on the already attached link (either payerLink or
+		payeeLink, whichever is the source of the routing), so that the route
+		is withdrawn there as well.
+
+		Arguments:
+		route: Link/MeetingPoint; the route that is cancelled (default: None).
+		       If None, all routes that are still being tried, or the route
+		       that was found, are cancelled.
+		"""
+
+		log.log("Transaction: cancelRoute")
+
+		if route is None:
+			routeIDs = self.__currentRoutes.keys()
+		else:
+			routeIDs = self.__getRouteIDs(route)
+
+		for ID in routeIDs:
+			del self.__currentRoutes[ID]
 
-	#TODO: msg_cancelRoute
+		self.__continueRouting(routeIDs)
 
 
 	def msg_endRoute(self):
@@ -193,15 +266,18 @@ class Transaction:
 		This method is typically called by the already-existing link to
 		end the routing that was previously started with a msg_makeRoute call.
 
-		Call msg_endRoute to the link or meeting point to which the last
-		msg_makeRoute was sent. If no such routing attempt was made or if the
-		last routing attempt was already cancelled or ended, nothing is done.
+		Call msg_endRoute to all links or meeting points to which msg_makeRoute
+		was sent, and whose routing attempts were not yet cancelled or ended.
+		If there are no such routing attempts, nothing is done.
+		No new routes will be tried after this.
 		"""
 
 		log.log("Transaction: endRoute")
-		if self.__currentRoute != None:
-			self.__currentRoute.msg_endRoute(self)
-			self.__currentRoute = None
+		currentRoutes = self.__currentRoutes.values()
+		self.__currentRoutes = {}
+		self.__remainingRoutes = None
+		for route in currentRoutes:
+			route.msg_endRoute(self)
 
 
 	def msg_lock(self):
@@ -268,38 +344,127 @@ class Transaction:
 
 		for mp in self.routingContext.meetingPoints:
 			if mp.ID == self.meetingPoint:
-				self.__currentRoute = mp
+				#If the meeting point refuses us, don't route any further:
+				self.__remainingRoutes = []
+				self.__currentRoutes = {None: mp}
 				mp.msg_makeRoute(self)
 				return True #found
 
 		return False #not found
 
 
-	def __tryNextRoute(self):
+	def __getLinkCapacity(self, lnk):
 		"""
-		Choose a new link from the routing context, and call msg_makeRoute to
-		that link.
-		If no suitable link exists, call msg_haveNoRoute on the already attached link
-		(either payerLink or payeeLink, whichever is non-None).
+		Return the amount that can be transferred over a link, in the direction
+		in which this transaction would use it.
+
+		Arguments:
+		lnk: Link; the link
+
+		Return value:
+		int; the amount (in Satoshi)
+		"""
+
+		balance = self.routingContext.getLinkBalance(lnk)
+		if self.isPayerSide:
+			return balance["availableForSpending"]
+		return balance["availableForReceiving"]
+
+
+	def __getRouteIDs(self, route):
+		"""
+		Return the IDs under which a link or meeting point is being tried.
+
+		Arguments:
+		route: Link/MeetingPoint; the link or meeting point
+
+		Return value:
+		list of str; the route IDs (empty if route is not being tried)
 		"""
 
-		while len(self.__remainingRoutes) > 0:
+		return [ID for ID, r in self.__currentRoutes.items() if r is route]
+
+
+	def __tryNextRoutes(self):
+		"""
+		Choose new links from the routing context, and call msg_makeRoute to
+		those links, until routingContext.parallelRoutes routes are being tried.
+		Links with insufficient available funds are skipped.
+		If no route is being tried and no suitable link exists, call
+		msg_haveNoRoute on the already attached link (either payerLink or
+		payeeLink, whichever is non-None).
+		"""
+
+		#Routing was already finished:
+		if self.__remainingRoutes is None:
+			return
+
+		links = dict((lnk.localID, lnk) for lnk in self.routingContext.links)
+
+		while len(self.__currentRoutes) < self.routingContext.parallelRoutes \
+			and len(self.__remainingRoutes) > 0:
+
 			nextRoute = self.__remainingRoutes.pop(0)
 
-			for lnk in self.routingContext.links:
-				if lnk.localID == nextRoute:
-					log.log("Transaction: try next route")
-					self.__currentRoute = lnk
-					lnk.msg_makeRoute(self)
+			#Skip links that can't carry the amount:
+			if nextRoute in links and \
+				self.__getLinkCapacity(links[nextRoute]) >= self.amount:
+
+				log.log("Transaction: try next route")
+				self.__currentRoutes[nextRoute] = links[nextRoute]
+				links[nextRoute].msg_makeRoute(self)
+
+				#The link may have answered immediately, and that may
+				#have finished the routing:
+				if self.__remainingRoutes is None:
 					return
 
+		if len(self.__currentRoutes) > 0:
+			return #wait for the answers of the routes being tried
+
 		log.log("Transaction: no more route")
 		#No more route: send cancel back to source
-		self.__currentRoute = None
-		del self.__remainingRoutes
+		self.__sendHaveNoRoute()
+
+
+	def __continueRouting(self, removedRouteIDs):
+		"""
+		Continue after routes were removed from the routes being tried.
+
+		If routing is still in progress, try the next routes. If a route was
+		already found and it was removed, call msg_haveNoRoute on the already
+		attached link (either payerLink or payeeLink, whichever is the source
+		of the routing).
+
+		Arguments:
+		removedRouteIDs: list of str; the IDs of the removed routes
+		"""
+
+		if self.__remainingRoutes is not None:
+			#Immediately try next route, or send cancel back if there is none:
+			self.__tryNextRoutes()
+			return
+
+		#Routing was already finished; if the found route was removed,
+		#withdraw it towards the source as well:
+		if len(removedRouteIDs) > 0 and len(self.__currentRoutes) == 0:
+			log.log("Transaction: found route is withdrawn")
+			self.__sendHaveNoRoute()
+
+
+	def __sendHaveNoRoute(self):
+		"""
+		Finish the routing, and call msg_haveNoRoute on the already attached
+		link (either payerLink or payeeLink, whichever is the source of the
+		routing).
+		"""
+
+		self.__remainingRoutes = None
 		if self.isPayerSide:
+			self.payeeLink = None
 			self.payerLink.msg_haveNoRoute(self)
 		else:
+			self.payerLink = None
 			self.payeeLink.msg_haveNoRoute(self)
 
 
@@ -107,8 +107,8 @@ class Watchdog:
 	def checkTransactionHashes(self):
 		#log.log("Watchdog: checking transaction hashes...")
 
-		#Since, in event.py, the wait for network events has a 0.01 s timeout,
-		# this limits us to checking 1000 tx/s.
+		#Since check is called every settings.watchdogInterval seconds
+		#(default: 0.01 s), this limits us to checking 1000 tx/s.
 		#TODO: maybe make this number configurable.
 		maxNumberOfChecks = 10
 
@@ -43,6 +43,7 @@ from core import log
 from core import paylog
 from core import bitcoind
 from core import watchdog
+from core import routingtable
 
 #Somehow it is hard to replace the above copyright information with a more
 #sensible doc string...
@@ -59,15 +60,50 @@ class RoutingContext:
 	"""
 	The context in which transaction routing takes place.
 
-	Contains all objects relevant to routing, such as links and meeting points.
+	Contains all objects relevant to routing, such as links and meeting points,
+	the routing table with what was learned from earlier routing attempts,
+	and the balances that are available on each link.
 
 	Intended for internal use by Node.
 	Not intended to be part of the API.
 	"""
 
-	def __init__(self):
+	def __init__(self, routingTable=None, parallelRoutes=1, linkBalances=None):
 		self.links = []
 		self.meetingPoints = []
+		self.routingTable = \
+			routingtable.RoutingTable() if routingTable is None else routingTable
+		self.parallelRoutes = parallelRoutes
+
+		#link ID -> balance, as returned by Link.getBalance:
+		self.linkBalances = {} if linkBalances is None else linkBalances
+
+
+	def updateLinkBalance(self, lnk):
+		"""
+		Update the stored balance of a link.
+		Links call this whenever the balance of one of their channels changes.
+
+		Arguments:
+		lnk: Link; the link
+		"""
+		self.linkBalances[lnk.localID] = lnk.getBalance()
+
+
+	def getLinkBalance(self, lnk):
+		"""
+		Return the stored balance of a link.
+
+		Arguments:
+		lnk: Link; the link
+
+		Return value:
+		dict; the balance, as returned by Link.getBalance
+		"""
+		if lnk.localID not in self.linkBalances:
+			self.updateLinkBalance(lnk)
+		return self.linkBalances[lnk.localID]
+
 
 	def getState(self, forDisplay=False):
 		return \
@@ -94,6 +130,7 @@ def runInNodeThread(implementationFunc):
 		with self._commandFunctionLock:
 			self._commandFunction = (implementationFunc, args, kwargs)
 			self._commandProcessed.clear()
+		self.context.wakeUp()
 		self._commandProcessed.wait()
 
 		if isinstance(self._commandReturnValue, Exception):
@@ -141,7 +178,8 @@ class Node(threading.Thread):
 
 		self.context = event.Context()
 
-		self.routingContext = RoutingContext()
+		self.routingContext = RoutingContext(
+			parallelRoutes=self.settings.parallelRoutes)
 		self.payees = []
 
 		self.payLog = paylog.PayLog(self.settings)
@@ -163,6 +201,10 @@ class Node(threading.Thread):
 		self.context.connectPost(event.signals.message,
 			self.__postHandleMessageSignal)
 
+		#The watchdog polls bitcoind, so it is called regularly:
+		if self.bitcoind.isConnected():
+			self.context.setTimer(0.0, self.__checkWatchdog)
+
 		self.__loadState()
 
 
@@ -174,6 +216,7 @@ class Node(threading.Thread):
 		"""
 
 		self.__stop = True
+		self.context.wakeUp()
 		self.join()
 
 
@@ -234,7 +277,9 @@ class Node(threading.Thread):
 	def __pay(self, URL, linkname=None):
 		rc = self.routingContext
 		if linkname != None:
-			rc = RoutingContext()
+			rc = RoutingContext(self.routingContext.routingTable,
+				self.routingContext.parallelRoutes,
+				self.routingContext.linkBalances)
 			rc.links = \
 				[lnk for lnk in self.routingContext.links if lnk.name == linkname]
 			if len(rc.links) == 0:
@@ -383,9 +428,9 @@ class Node(threading.Thread):
 		self.__stop = False
 		while True:
 
+			#Waits until a network event, timer event or API call happens:
 			self.context.dispatchNetworkEvents()
 			self.context.dispatchTimerEvents()
-			self.watchdog.check()
 
 			with self._commandFunctionLock:
 				s = self._commandFunction
@@ -411,10 +456,17 @@ class Node(threading.Thread):
 
 		#This closes all network connections etc.
 		self.context.sendSignal(None, event.signals.quit)
+		self.context.close()
 
 		log.log("Node thread terminated\n\n")
 
 
+	def __checkWatchdog(self):
+		self.watchdog.check()
+		self.context.setTimer(self.settings.watchdogInterval,
+			self.__checkWatchdog)
+
+
 	def __loadState(self):
 
 		oldFile = self.settings.stateFile + ".old"
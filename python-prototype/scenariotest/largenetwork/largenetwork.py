@@ -41,8 +41,8 @@ from amiko.core import event, settings
 """
 The network has the following shape:
 
-            (3)         (6)
-             |           |
+            (3) ---+    (6)
+             |     |     |
 (0) - (1) - (2) - (4) - (5) - (7)
              |           |
             (8)         (10)
@@ -51,15 +51,23 @@ The network has the following shape:
 
 Payment is between 0 and 7
 Meeting point is 4
+The link between 3 and 4 makes a cycle, so that parallel routing attempts
+can reach nodes through different routes.
+
+Usage: largenetwork.py [parallelRoutes [numPayments]]
 """
 
+#Routing benchmark parameters:
+parallelRoutes = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+numPayments = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
 linkDefinitions = \
 [
 	[1],          #0
 	[0, 2],       #1
 	[1, 3, 4, 8], #2
-	[2],          #3
-	[2, 5],       #4
+	[2, 4],       #3
+	[2, 3, 5],    #4
 	[4, 6, 7, 10],#5
 	[5],          #6
 	[5],          #7
@@ -83,6 +91,7 @@ for i in range(len(linkDefinitions)):
 	s.stateFile = "state_%d.dat" % i
 	s.payLogFile = "payments_%d.log" % i
 	s.externalMeetingPoints = ["Node4"]
+	s.parallelRoutes = parallelRoutes
 
 	meetingPoints = []
 	if i == 4:
@@ -157,20 +166,26 @@ time.sleep(3)
 print "Before payment:"
 printNodeInfo()
 
-t0 = time.time()
-#Pay from 0 to 7:
-URL = nodes[7].request(123, "receipt")
-print "Payment URL:", URL
+durations = []
+for i in range(numPayments):
+	t0 = time.time()
+	#Pay from 0 to 7:
+	URL = nodes[7].request(123, "receipt")
+	print "Payment URL:", URL
+
+	payer = nodes[0].pay(URL)
+	nodes[0].confirmPayment(payer, True)
+	print "Payment is ", payer.state
+	t1 = time.time()
 
-payer = nodes[0].pay(URL)
-nodes[0].confirmPayment(payer, True)
-print "Payment is ", payer.state
-t1 = time.time()
+	print "Payment took %f seconds" % (t1-t0)
+	durations.append(t1-t0)
 
-print "Payment took %f seconds" % (t1-t0)
+	#Allow paylink to disconnect
+	time.sleep(0.5)
 
-#Allow paylink to disconnect
-time.sleep(0.5)
+print "Parallel routes: %d; average payment time: %f seconds" % \
+	(parallelRoutes, sum(durations) / len(durations))
 
 
 print "After payment:"
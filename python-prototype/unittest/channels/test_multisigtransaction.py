@@ -45,9 +45,15 @@ class Test(unittest.TestCase):
 	def test_constructor(self):
 		"Test the MultiSigTransaction constructor"
 
-		tx = multisigtransaction.MultiSigTransaction("tx", ["a", "b"])
+		TCD1 = tcd.TCD(1, 2, 3, 'a'*20, 'b'*20, 'c'*20)
+		TCD2 = tcd.TCD(4, 5, 6, 'd'*20, 'e'*20, 'f'*20)
+		tx = multisigtransaction.MultiSigTransaction("tx", [TCD1, TCD2])
 		self.assertEqual(tx.transaction, "tx")
-		self.assertEqual(tx.TCDlist, ["a", "b"])
+		self.assertEqual(tx.TCDlist, [TCD1, TCD2])
+		self.assertTrue(isinstance(tx.TCDlist, tcd.TCDTable))
+
+		self.assertRaises(Exception, multisigtransaction.MultiSigTransaction,
+			"tx", [TCD1, TCD1])
 
 
 	def test_makeNew(self):
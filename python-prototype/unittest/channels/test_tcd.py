@@ -104,6 +104,53 @@ class Test(unittest.TestCase):
 		self.assertRaises(Exception, tcd.deserializeList, data + '\x00')
 
 
+	def test_TCDTable(self):
+		"Test the TCDTable class"
+
+		TCD1 = tcd.TCD(1, 2, 7, 'a'*20, 'b'*20, 'c'*20)
+		TCD2 = tcd.TCD(3, 4, 8, 'd'*20, 'e'*20, 'f'*20)
+		TCD3 = tcd.TCD(5, 6, 9, 'g'*20, 'h'*20, 'i'*20)
+
+		table = tcd.TCDTable()
+		self.assertEqual(len(table), 0)
+		self.assertEqual(table.serialize(), '')
+		self.assertEqual(table.getAmount(), 0)
+
+		table = tcd.TCDTable([TCD1, TCD2, TCD3])
+		self.assertEqual(len(table), 3)
+		self.assertEqual(table, [TCD1, TCD2, TCD3])
+		self.assertEqual(table[1], TCD2)
+		self.assertEqual(table.serialize(), tcd.serializeList([TCD1, TCD2, TCD3]))
+		self.assertEqual(table.getAmount(), 24)
+		self.assertTrue(table.exists('d'*20))
+		self.assertFalse(table.exists('x'*20))
+
+		self.assertRaises(Exception, table.add, TCD2)
+		self.assertEqual(table, [TCD1, TCD2, TCD3]) #it's not added
+
+		table.remove('d'*20)
+		self.assertEqual(table, [TCD1, TCD3])
+		self.assertFalse(table.exists('d'*20))
+		self.assertEqual(table.serialize(), tcd.serializeList([TCD1, TCD3]))
+		self.assertEqual(table.getAmount(), 16)
+
+		self.assertRaises(Exception, table.remove, 'd'*20)
+		self.assertEqual(table, [TCD1, TCD3]) #no effect
+
+		table.add(TCD2)
+		self.assertEqual(table, [TCD1, TCD3, TCD2])
+		self.assertEqual(table.serialize(), tcd.serializeList([TCD1, TCD3, TCD2]))
+
+		table2 = tcd.TCDTable.deserialize(table.serialize())
+		self.assertEqual(len(table2), 3)
+		self.assertEqual(table2.serialize(), table.serialize())
+		self.assertEqual(table2.getAmount(), 24)
+		self.assertTrue(table2.exists('a'*20))
+		self.assertEqual(table2[2].tokenHash, 'd'*20)
+
+		self.assertRaises(Exception, tcd.TCDTable.deserialize, table.serialize()[:-1])
+
+
 
 if __name__ == "__main__":
 	unittest.main(verbosity=2)
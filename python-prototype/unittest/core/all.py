@@ -32,9 +32,12 @@ import unittest
 import testenvironment
 
 from test_channel import Test as test_channel
+from test_event import Test as test_event
 from test_log import Test as test_log
 from test_meetingpoint import Test as test_meetingpoint
 from test_messages import Test as test_messages
+from test_network import Test as test_network
+from test_routingtable import Test as test_routingtable
 from test_transaction import Test as test_transaction
 
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#    benchmark_messages.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+"""
+Measures the speed of message serialization and de-serialization.
+
+For each message type, the number of messages per second is reported for
+encoding (Message.serialize) and for decoding (messages.deserialize).
+"""
+
+import time
+
+import testenvironment
+
+from amiko.core import messages
+
+
+
+#Minimum measurement time per message type and direction (seconds):
+measurementTime = 0.5
+
+hash = "\x01" * 20
+token = "\x02" * 32
+payload = ["\x03" * 250] * 8 #e.g. a multi-TCD channel payload
+
+testMessages = \
+[
+	messages.String("Foobar"),
+	messages.Link("link_to_1", 0x12345678),
+	messages.Pay("payer_ID"),
+	messages.Receipt(1000, "Receipt", hash, ["MP1", "MP2"]),
+	messages.Confirm("MP1"),
+	messages.MakeRoute(1000, True, hash, 1234567890, 1234654290, "MP1"),
+	messages.HaveRoute(hash, 1234567890, 1234654290),
+	messages.HaveNoRoute(hash),
+	messages.CancelRoute(hash),
+	messages.Lock(1, hash, payload),
+	messages.Cancel(),
+	messages.Commit(1, token, payload),
+	messages.MyURLs(["amikolink://localhost:4321/link_to_1"]),
+	messages.Deposit(1, "multisig", True, 0, payload),
+	messages.Withdraw(1, 0, payload),
+	messages.RequestCommit(token)
+]
+
+
+def measure(function, arg):
+	"""
+	Call function(arg) repeatedly, for at least measurementTime seconds.
+
+	Return value:
+	float; the number of calls per second
+	"""
+	count = 0
+	n = 100
+	t0 = time.time()
+	while True:
+		for i in xrange(n):
+			function(arg)
+		count += n
+		dt = time.time() - t0
+		if dt >= measurementTime:
+			return count / dt
+		n *= 2
+
+
+print "%-16s %8s %14s %14s" % ("Message", "Size", "Encoded/s", "Decoded/s")
+for msg in testMessages:
+	data = msg.serialize()
+	encodeRate = measure(lambda m: m.serialize(), msg)
+	decodeRate = measure(messages.deserialize, data)
+	print "%-16s %8d %14.0f %14.0f" % \
+		(msg.__class__.__name__, len(data), encodeRate, decodeRate)
+
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#    test_event.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+import socket
+import threading
+import time
+
+import testenvironment
+
+from amiko.core import event
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		self.context = event.Context()
+		self.trace = []
+
+
+	def tearDown(self):
+		self.context.close()
+
+
+	def makeHandler(self, name):
+		def handler(*args, **kwargs):
+			self.trace.append((name, args, kwargs))
+		return handler
+
+
+	def test_sendSignal(self):
+		"Test that signals only reach the handlers connected to them"
+
+		h1 = self.makeHandler("h1")
+		h2 = self.makeHandler("h2")
+		h3 = self.makeHandler("h3")
+		self.context.connect("sender1", event.signals.save, h1)
+		self.context.connect("sender2", event.signals.save, h2)
+		self.context.connect("sender1", event.signals.quit, h3)
+		self.context.connectPost(event.signals.save, h3)
+
+		self.context.sendSignal("sender1", event.signals.save, 1, x=2)
+		self.assertEqual(self.trace,
+			[("h1", (1,), {"x": 2}), ("h3", (1,), {"x": 2})])
+
+		self.trace = []
+		self.context.sendSignal("sender3", event.signals.link)
+		self.assertEqual(self.trace, [])
+
+
+	def test_removeConnectionsBySender(self):
+		"Test the removeConnectionsBySender method"
+
+		h1 = self.makeHandler("h1")
+		h2 = self.makeHandler("h2")
+		self.context.connect("sender1", event.signals.save, h1)
+		self.context.connect("sender1", event.signals.quit, h1)
+		self.context.connect("sender2", event.signals.save, h1)
+		self.context.connect("sender2", event.signals.save, h2)
+
+		self.context.removeConnectionsBySender("sender1")
+		self.context.sendSignal("sender1", event.signals.save)
+		self.context.sendSignal("sender1", event.signals.quit)
+		self.assertEqual(self.trace, [])
+		self.context.sendSignal("sender2", event.signals.save)
+		self.assertEqual(self.trace, [("h1", (), {}), ("h2", (), {})])
+
+		#Removing again should be a NOP:
+		self.context.removeConnectionsBySender("sender1")
+
+
+	def test_removeConnectionsByHandler(self):
+		"Test the removeConnectionsByHandler method"
+
+		h1 = self.makeHandler("h1")
+		h2 = self.makeHandler("h2")
+		self.context.connect("sender1", event.signals.save, h1)
+		self.context.connect("sender1", event.signals.save, h2)
+		self.context.connect("sender2", event.signals.quit, h1)
+		self.context.connectPost(event.signals.save, h1)
+
+		self.context.removeConnectionsByHandler(h1)
+		self.context.sendSignal("sender1", event.signals.save)
+		self.context.sendSignal("sender2", event.signals.quit)
+		self.assertEqual(self.trace, [("h2", (), {})])
+
+		#Removing again should be a NOP:
+		self.context.removeConnectionsByHandler(h1)
+
+
+	def test_dispatchNetworkEvents(self):
+		"Test that only sockets with handlers are watched"
+
+		s1, s2 = socket.socketpair()
+		try:
+			h1 = self.makeHandler("h1")
+			h2 = self.makeHandler("h2")
+			self.context.connect(s1, event.signals.readyForRead, h1)
+			self.context.connect(s1, event.signals.readyForWrite, h2)
+
+			self.context.dispatchNetworkEvents()
+			self.assertEqual(self.trace, [("h2", (), {})])
+
+			self.trace = []
+			self.context.removeConnectionsByHandler(h2)
+			s2.send("x")
+			self.context.dispatchNetworkEvents()
+			self.assertEqual(self.trace, [("h1", (), {})])
+
+			self.trace = []
+			self.context.removeConnectionsBySender(s1)
+			self.context.dispatchNetworkEvents(maxTimeout=0.01)
+			self.assertEqual(self.trace, [])
+		finally:
+			s1.close()
+			s2.close()
+
+	def test_timers(self):
+		"Test setting, dispatching and cancelling timers"
+
+		h1 = self.makeHandler("h1")
+		h2 = self.makeHandler("h2")
+		h3 = self.makeHandler("h3")
+		self.assertEqual(self.context.getNextDeadline(), None)
+
+		t0 = time.time()
+		self.context.setTimer(-1.0, h2)
+		timer = self.context.setTimer(-2.0, h3)
+		self.context.setTimer(-3.0, h1)
+		self.context.setTimer(100.0, h1)
+		self.assertTrue(self.context.getNextDeadline() < t0 - 2.5)
+
+		#Expired timers are called in order of their time stamps:
+		self.context.cancelTimer(timer)
+		self.context.dispatchTimerEvents()
+		self.assertEqual(self.trace, [("h1", (), {}), ("h2", (), {})])
+		self.assertTrue(self.context.getNextDeadline() >= t0 + 100.0)
+
+		#Cancelling again should be a NOP:
+		self.context.cancelTimer(timer)
+
+		#Removing the handler also removes its timers:
+		self.trace = []
+		self.context.removeConnectionsByHandler(h1)
+		self.assertEqual(self.context.getNextDeadline(), None)
+
+
+	def test_timerTimeout(self):
+		"Test that the network wait ends when a timer expires"
+
+		self.context.setTimer(0.05, self.makeHandler("h1"))
+		t0 = time.time()
+		self.context.dispatchNetworkEvents(maxTimeout=10.0)
+		self.assertTrue(time.time() - t0 < 1.0)
+
+		t0 = time.time()
+		self.context.dispatchNetworkEvents(maxTimeout=0.02)
+		self.assertTrue(time.time() - t0 < 0.04)
+
+		#Without maximum:
+		self.context.setTimer(0.05, self.makeHandler("h2"))
+		t0 = time.time()
+		self.context.dispatchNetworkEvents()
+		self.assertTrue(time.time() - t0 < 1.0)
+
+
+	def test_wakeUp(self):
+		"Test that wakeUp ends the network wait"
+
+		#Without timers, the wait only ends on network events or wakeUp:
+		self.assertEqual(self.context.getNextDeadline(), None)
+		waker = threading.Timer(0.05, self.context.wakeUp)
+		waker.start()
+		t0 = time.time()
+		self.context.dispatchNetworkEvents()
+		self.assertTrue(time.time() - t0 < 1.0)
+		waker.join()
+
+		#A wake-up before the wait also ends it:
+		self.context.wakeUp()
+		self.context.dispatchNetworkEvents(maxTimeout=10.0)
+		self.assertEqual(self.trace, [])
+
+		#Every wake-up is only used once:
+		t0 = time.time()
+		self.context.dispatchNetworkEvents(maxTimeout=0.05)
+		self.assertTrue(time.time() - t0 >= 0.04)
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
+
@@ -111,12 +111,22 @@ class Test(unittest.TestCase):
 		t2 = DummyTransaction(
 			amount=0, hash="hash", meetingPoint="meetingpoint", isPayerSide=True)
 		self.mp.msg_makeRoute(t2)
-		self.assertEqual(self.mp.transactionPairs, {})
+		self.assertEqual(self.mp.transactionPairs, {"hash": [t1, None]})
+		self.assertEqual(t1.trace, [])
+		self.assertEqual(t2.trace, [
+			('msg_haveNoRoute', (self.mp,), {})
+			])
+
+		#The first one can still be matched:
+		t3 = DummyTransaction(
+			amount=0, hash="hash", meetingPoint="meetingpoint", isPayerSide=False)
+		self.mp.msg_makeRoute(t3)
+		self.assertEqual(self.mp.transactionPairs, {"hash": [t1, t3]})
 		self.assertEqual(t1.trace, [
-			('msg_cancelRoute', (), {})
+			('msg_haveRoute', (self.mp, 12, 34), {})
 			])
-		self.assertEqual(t2.trace, [
-			('msg_cancelRoute', (), {})
+		self.assertEqual(t3.trace, [
+			('msg_haveRoute', (self.mp, 12, 34), {})
 			])
 
 
@@ -133,12 +143,22 @@ class Test(unittest.TestCase):
 		t2 = DummyTransaction(
 			amount=0, hash="hash", meetingPoint="meetingpoint", isPayerSide=False)
 		self.mp.msg_makeRoute(t2)
-		self.assertEqual(self.mp.transactionPairs, {})
+		self.assertEqual(self.mp.transactionPairs, {"hash": [None, t1]})
+		self.assertEqual(t1.trace, [])
+		self.assertEqual(t2.trace, [
+			('msg_haveNoRoute', (self.mp,), {})
+			])
+
+		#The first one can still be matched:
+		t3 = DummyTransaction(
+			amount=0, hash="hash", meetingPoint="meetingpoint", isPayerSide=True)
+		self.mp.msg_makeRoute(t3)
+		self.assertEqual(self.mp.transactionPairs, {"hash": [t3, t1]})
 		self.assertEqual(t1.trace, [
-			('msg_cancelRoute', (), {})
+			('msg_haveRoute', (self.mp, 12, 34), {})
 			])
-		self.assertEqual(t2.trace, [
-			('msg_cancelRoute', (), {})
+		self.assertEqual(t3.trace, [
+			('msg_haveRoute', (self.mp, 12, 34), {})
 			])
 
 
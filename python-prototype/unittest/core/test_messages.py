@@ -70,6 +70,10 @@ class Test(unittest.TestCase):
 			self.assertEqual(data   , messages.serializeBinList(binList))
 			self.assertEqual(binList, messages.deserializeBinList(data))
 
+		#Starting at an offset:
+		self.assertEqual(["Foobar", "fuz"], messages.deserializeBinList(
+			"XX\x00\x00\x00\x06Foobar\x00\x00\x00\x03fuz", 2))
+
 		self.assertRaises(Exception, messages.deserializeBinList, "\x00")
 		self.assertRaises(Exception, messages.deserializeBinList, "Hello")
 
@@ -126,6 +130,16 @@ class Test(unittest.TestCase):
 		self.assertEqual(msg.value, "Bar")
 
 
+	def test_CancelRoute(self):
+		"Test CancelRoute message class"
+
+		msg = messages.CancelRoute("Foo")
+		self.assertEqual(msg.serialize(), "\x00\x00\x00%cFoo" % \
+			messages.ID_CANCELROUTE)
+		msg.deserializeAttributes("Bar")
+		self.assertEqual(msg.value, "Bar")
+
+
 	def test_Cancel(self):
 		"Test Cancel message class"
 
@@ -435,7 +449,10 @@ class Test(unittest.TestCase):
 			messages.Commit,
 			messages.MyURLs,
 			messages.Deposit,
-			messages.Withdraw
+			messages.Withdraw,
+			messages.RequestCommit,
+			messages.HaveNoRoute,
+			messages.CancelRoute
 			]:
 				a = clss()
 				s1 = a.serialize()
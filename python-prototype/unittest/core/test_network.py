@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#    test_network.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+
+import testenvironment
+
+from amiko.core import event
+from amiko.core import network
+from amiko.core import messages
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		self.context = event.Context()
+		self.received = []
+		self.accepted = []
+
+		self.listener = network.Listener(self.context, "localhost", 0)
+		self.context.connect(None, event.signals.link, self.handleLink)
+
+		port = self.listener.socket.getsockname()[1]
+		self.connection = network.Connection(self.context, ("localhost", port))
+
+
+	def tearDown(self):
+		self.context.sendSignal(None, event.signals.quit)
+		self.context.close()
+
+
+	def handleLink(self, connection, message):
+		self.accepted.append(connection)
+		self.context.connect(connection, event.signals.message,
+			self.handleMessage)
+
+
+	def handleMessage(self, message):
+		self.received.append(message)
+
+
+	def dispatchUntil(self, condition):
+		for i in range(1000):
+			if condition():
+				return
+			self.context.dispatchNetworkEvents(maxTimeout=0.01)
+		self.fail("Timeout")
+
+
+	def test_messages(self):
+		"Test sending small and large messages in one go"
+
+		sentMessages = \
+		[
+			messages.String("Foo"),
+			messages.String("x" * 1000000),
+			messages.String(""),
+			messages.String("Bar")
+		]
+
+		self.connection.sendMessage(messages.Link("ID", 42))
+		for msg in sentMessages:
+			self.connection.sendMessage(msg)
+
+		self.dispatchUntil(lambda: len(self.received) == len(sentMessages))
+
+		self.assertEqual(len(self.accepted), 1)
+		self.assertEqual(
+			[msg.value for msg in self.received],
+			[msg.value for msg in sentMessages])
+
+		#Also in the other direction:
+		self.received = []
+		self.context.connect(self.connection, event.signals.message,
+			self.handleMessage)
+		for msg in sentMessages:
+			self.accepted[0].sendMessage(msg)
+
+		self.dispatchUntil(lambda: len(self.received) == len(sentMessages))
+		self.assertEqual(
+			[msg.value for msg in self.received],
+			[msg.value for msg in sentMessages])
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
+
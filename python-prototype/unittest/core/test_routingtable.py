@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#    test_routingtable.py
+#    Copyright (C) 2015 by CJP
+#
+#    This file is part of Amiko Pay.
+#
+#    Amiko Pay is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Amiko Pay is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Amiko Pay. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Additional permission under GNU GPL version 3 section 7
+#
+#    If you modify this Program, or any covered work, by linking or combining it
+#    with the OpenSSL library (or a modified version of that library),
+#    containing parts covered by the terms of the OpenSSL License and the SSLeay
+#    License, the licensors of this Program grant you additional permission to
+#    convey the resulting work. Corresponding Source for a non-source form of
+#    such a combination shall include the source code for the parts of the
+#    OpenSSL library used as well as that of the covered work.
+
+import unittest
+import time
+
+import testenvironment
+
+from dummy_interfaces import DummyLink
+
+from amiko.core import routingtable
+
+
+
+class Test(unittest.TestCase):
+	def setUp(self):
+		self.routingTable = routingtable.RoutingTable()
+		self.links = [DummyLink("link1"), DummyLink("link2"), DummyLink("link3")]
+		self.capacities = {"link1": 100, "link2": 100, "link3": 100}
+
+
+	def getCapacity(self, lnk):
+		return self.capacities[lnk.localID]
+
+
+	def getRoutes(self, meetingPoint="MP", amount=10):
+		return self.routingTable.getRoutes(
+			meetingPoint, amount, self.links, self.getCapacity)
+
+
+	def test_defaultOrder(self):
+		"Test that, without information, the original order is kept"
+
+		self.assertEqual(self.getRoutes(), ["link1", "link2", "link3"])
+
+
+	def test_capacity(self):
+		"Test ordering on capacity"
+
+		self.capacities = {"link1": 5, "link2": 100, "link3": 200}
+		self.assertEqual(self.getRoutes(amount=10), ["link3", "link2", "link1"])
+
+		#Links with insufficient capacity are tried last, but are not removed:
+		self.assertEqual(self.getRoutes(amount=150), ["link3", "link2", "link1"])
+		self.capacities["link3"] = 5
+		self.assertEqual(self.getRoutes(amount=150), ["link2", "link1", "link3"])
+
+
+	def test_reportSuccess(self):
+		"Test the reportSuccess method"
+
+		self.routingTable.reportSuccess("MP", "link3", 10)
+		self.routingTable.reportSuccess("MP", "link2", 10)
+		self.routingTable.reportSuccess("MP", "link2", 10)
+		self.assertEqual(self.getRoutes(), ["link2", "link3", "link1"])
+
+		#Other meeting points are not affected:
+		self.assertEqual(self.getRoutes(meetingPoint="MP2"),
+			["link1", "link2", "link3"])
+
+
+	def test_reportFailure(self):
+		"Test the reportFailure method"
+
+		self.routingTable.reportFailure("MP", "link1", 10)
+
+		#Skipped for the same or larger amounts:
+		self.assertEqual(self.getRoutes(amount=10), ["link2", "link3"])
+		self.assertEqual(self.getRoutes(amount=20), ["link2", "link3"])
+
+		#Not for smaller amounts or other meeting points:
+		self.assertEqual(self.getRoutes(amount=5), ["link1", "link2", "link3"])
+		self.assertEqual(self.getRoutes(meetingPoint="MP2"),
+			["link1", "link2", "link3"])
+
+		#A failure of a smaller amount also prunes smaller amounts:
+		self.routingTable.reportFailure("MP", "link1", 5)
+		self.assertEqual(self.getRoutes(amount=5), ["link2", "link3"])
+
+		#Success of a sufficiently large amount removes the failure:
+		self.routingTable.reportSuccess("MP", "link1", 5)
+		self.assertEqual(self.getRoutes(amount=10), ["link1", "link2", "link3"])
+
+
+	def test_failureTimeout(self):
+		"Test the expiration of failures"
+
+		self.routingTable.failureTimeout = 0.1
+		self.routingTable.reportFailure("MP", "link1", 10)
+		self.assertEqual(self.getRoutes(), ["link2", "link3"])
+
+		time.sleep(0.2)
+		self.assertEqual(self.getRoutes(), ["link1", "link2", "link3"])
+
+
+
+if __name__ == "__main__":
+	unittest.main(verbosity=2)
+
@@ -223,6 +223,210 @@ class Test(unittest.TestCase):
 		self.assertEqual(sourceLink.trace, [])
 
 
+	def test_routingTable(self):
+		"Test the use of the routing table"
+
+		sourceLink = Tracer()
+		self.makeNewTransaction(payerLink=sourceLink, payeeLink=None)
+
+		#link1 fails, link2 succeeds:
+		self.transaction.msg_makeRoute()
+		self.transaction.msg_haveNoRoute()
+		self.transaction.msg_haveRoute(self.routingContext.links[1], 123, 456)
+
+		for lnk in self.routingContext.links:
+			lnk.trace = []
+
+		#A new transaction tries link2 first:
+		self.makeNewTransaction(payerLink=Tracer(), payeeLink=None)
+		self.transaction.msg_makeRoute()
+		self.assertEqual(self.routingContext.links[0].trace, [])
+		self.assertEqual(self.routingContext.links[1].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+		self.routingContext.links[1].trace = []
+
+		#...and then skips link1:
+		self.transaction.msg_haveNoRoute()
+		self.assertEqual(self.routingContext.links[0].trace, [])
+		self.assertEqual(self.routingContext.links[2].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+
+
+	def test_linkBalances(self):
+		"Test skipping links with insufficient funds"
+
+		links = self.routingContext.links
+		self.routingContext.linkBalances = \
+		{
+		"link1": {"availableForSpending": 41, "availableForReceiving": 1000},
+		"link2": {"availableForSpending": 1000, "availableForReceiving": 41}
+		}
+
+		#Payer side: link1 can't send the amount:
+		sourceLink = Tracer()
+		self.makeNewTransaction(payerLink=sourceLink, payeeLink=None)
+		self.transaction.msg_makeRoute()
+		self.assertEqual(links[0].trace, [])
+		self.assertEqual(links[1].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+
+		links[1].trace = []
+
+		#Payee side: link2 can't receive the amount:
+		self.makeNewTransaction(payerLink=None, payeeLink=sourceLink)
+		self.transaction.msg_makeRoute()
+		self.assertEqual(links[0].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+		links[0].trace = []
+		self.transaction.msg_haveNoRoute()
+		self.assertEqual(links[1].trace, [])
+		self.assertEqual(links[2].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+
+
+	def test_parallelRoutes(self):
+		"Test trying multiple routes in parallel"
+
+		self.routingContext.parallelRoutes = 2
+		sourceLink = Tracer()
+		self.makeNewTransaction(payerLink=sourceLink, payeeLink=None)
+		links = self.routingContext.links
+
+		#The first two routes are tried at the same time:
+		self.transaction.msg_makeRoute()
+		self.assertEqual(links[0].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+		self.assertEqual(links[1].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+		self.assertEqual(links[2].trace, [])
+
+		for lnk in links:
+			lnk.trace = []
+
+		#A failing route is replaced by the next one:
+		self.transaction.msg_haveNoRoute(links[0])
+		self.assertEqual(links[0].trace, [])
+		self.assertEqual(links[1].trace, [])
+		self.assertEqual(links[2].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+		self.assertEqual(sourceLink.trace, [])
+
+		links[2].trace = []
+
+		#The first found route is used, and the others are ended:
+		self.transaction.msg_haveRoute(links[2], 123, 456)
+		self.assertEqual(self.transaction.payeeLink, links[2])
+		self.assertEqual(links[1].trace,
+			[('msg_endRoute', (self.transaction,), {})]
+			)
+		self.assertEqual(links[2].trace, [])
+		self.assertEqual(links[3].trace, [])
+		self.assertEqual(sourceLink.trace,
+			[('msg_haveRoute', (self.transaction,), {})]
+			)
+
+		links[1].trace = []
+
+		#Ending the route only ends the used route:
+		self.transaction.msg_endRoute()
+		self.assertEqual(links[1].trace, [])
+		self.assertEqual(links[2].trace,
+			[('msg_endRoute', (self.transaction,), {})]
+			)
+
+		for lnk in links:
+			lnk.trace = []
+		sourceLink.trace = []
+
+		#No route is reported back when all parallel routes fail:
+		self.makeNewTransaction(payerLink=sourceLink, payeeLink=None)
+		self.transaction.msg_makeRoute()
+		for lnk in links:
+			self.transaction.msg_haveNoRoute(lnk)
+			if lnk != links[-1]:
+				self.assertEqual(sourceLink.trace, [])
+		self.assertEqual(sourceLink.trace,
+			[('msg_haveNoRoute', (self.transaction,), {})]
+			)
+
+
+	def test_cancelRoute(self):
+		"Test the msg_cancelRoute method"
+
+		sourceLink = Tracer()
+		links = self.routingContext.links
+		meetingPoint = DummyMeetingPoint("meetingPoint")
+
+		#A cancelled meeting point route is not replaced by a link route:
+		self.routingContext.meetingPoints = [meetingPoint]
+		self.makeNewTransaction(payerLink=sourceLink, payeeLink=None)
+		self.transaction.msg_makeRoute()
+		self.transaction.msg_cancelRoute()
+		for lnk in links:
+			self.assertEqual(lnk.trace, [])
+		self.assertEqual(sourceLink.trace,
+			[('msg_haveNoRoute', (self.transaction,), {})]
+			)
+
+		sourceLink.trace = []
+
+		#The same holds for a refusal by the meeting point:
+		self.makeNewTransaction(payerLink=sourceLink, payeeLink=None)
+		self.transaction.msg_makeRoute()
+		self.transaction.msg_haveNoRoute(meetingPoint)
+		for lnk in links:
+			self.assertEqual(lnk.trace, [])
+		self.assertEqual(sourceLink.trace,
+			[('msg_haveNoRoute', (self.transaction,), {})]
+			)
+
+		sourceLink.trace = []
+
+		#Cancelling a found route withdraws it towards the source:
+		self.makeNewTransaction(payerLink=sourceLink, payeeLink=None)
+		self.transaction.msg_makeRoute()
+		self.transaction.msg_haveRoute(meetingPoint, 123, 456)
+		self.assertEqual(self.transaction.payeeLink, meetingPoint)
+		sourceLink.trace = []
+		self.transaction.msg_cancelRoute(meetingPoint)
+		self.assertEqual(self.transaction.payeeLink, None)
+		for lnk in links:
+			self.assertEqual(lnk.trace, [])
+		self.assertEqual(sourceLink.trace,
+			[('msg_haveNoRoute', (self.transaction,), {})]
+			)
+
+		sourceLink.trace = []
+
+		#After that, nothing is routed anymore:
+		self.transaction.msg_cancelRoute()
+		self.transaction.msg_haveNoRoute()
+		self.assertEqual(sourceLink.trace, [])
+
+		#Cancelling a route that is being tried replaces it, like no route:
+		self.routingContext.meetingPoints = []
+		self.makeNewTransaction(payeeLink=sourceLink, payerLink=None)
+		self.transaction.msg_makeRoute()
+		self.assertEqual(links[0].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+		links[0].trace = []
+		self.transaction.msg_cancelRoute(links[0])
+		self.assertEqual(links[0].trace, [])
+		self.assertEqual(links[1].trace,
+			[('msg_makeRoute', (self.transaction,), {})]
+			)
+		self.assertEqual(sourceLink.trace, [])
+
+
 	def test_endRoute(self):
 		"Test the msg_endRoute method"
 
@@ -28,6 +28,8 @@
 
 from amiko.utils import base58
 
+from amiko.core import routingtable
+
 
 
 class Tracer:
@@ -89,6 +91,14 @@ class DummyRoutingContext:
 			DummyLink("link4")
 		]
 		self.meetingPoints = []
+		self.routingTable = routingtable.RoutingTable()
+		self.parallelRoutes = 1
+		self.linkBalances = {}
+
+
+	def getLinkBalance(self, lnk):
+		return self.linkBalances.get(lnk.localID,
+			{"availableForSpending": 1000, "availableForReceiving": 1000})
 
 
 